@@ -0,0 +1,290 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .metrics import stage
+from .searchindex import timestamp_values
+from .storage import open_predictions
+
+
+# Width of the time windows behaviour is kept in, in seconds; timelines can merge windows into
+# any multiple of it
+BEHAVIOUR_WINDOW = int(os.getenv("BEHAVIOUR_WINDOW", "3600"))
+# Label of the flows that are not flagged; every other label counts as flagged
+BENIGN_LABEL = os.getenv("BENIGN_LABEL", "Benign")
+# Prediction rows aggregated at a time while profiles are built; larger uploads merge the batches' groups
+BEHAVIOUR_BATCH_ROWS = 1 << 20
+
+KINDS = ("msisdn", "ip")
+SORTS = ("flagged", "flagged_ratio", "sessions", "volume", "last_seen")
+
+_NS = 10 ** 9
+# Window of rows without a (parseable) timestamp; viewed as datetime64 it is NaT
+_NO_TIME = np.iinfo(np.int64).min
+# Sessions per predicted label are kept in a column per label, named with this prefix
+_LABEL = "label:"
+_SOURCE_COLUMNS = ["prediction", "ip", "msisdn", "timestamp", "volume"]
+
+
+def profiles_path(preds_path):
+    """predictions_{ts}.parquet -> behaviour_{ts}.parquet (per key) and behaviour_{ts}.windows.parquet (per key and window)"""
+    directory, name = os.path.split(preds_path)
+    stem = os.path.splitext(name)[0]
+    if stem.startswith("predictions_"):
+        stem = stem[len("predictions_"):]
+    return os.path.join(directory, f"behaviour_{stem}.parquet")
+
+
+def windows_path(preds_path):
+    return profiles_path(preds_path)[:-len(".parquet")] + ".windows.parquet"
+
+
+def _source_meta(preds_path):
+    stat = os.stat(preds_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _label_columns(frame):
+    return [c for c in frame.columns if c.startswith(_LABEL)]
+
+
+def _sums(frame):
+    # How the columns of profile rows combine when rows are merged
+    return dict({"sessions": "sum", "volume": "sum", "first_seen": "min", "last_seen": "max"}, **{c: "sum" for c in _label_columns(frame)})
+
+
+def _aggregate(table, window):
+    # {kind: ((key, window) groups, key groups)} of one batch of prediction rows, in key then window order
+    times = timestamp_values(table.column("timestamp").to_pandas())
+    windows = np.where(times == _NO_TIME, _NO_TIME, times // (window * _NS) * (window * _NS))
+    label_codes, labels = pd.factorize(table.column("prediction").to_pandas(), sort=True, use_na_sentinel=False)
+    volume = table.column("volume").to_numpy(zero_copy_only=False)
+    parts = {}
+    for kind in KINDS:
+        # Grouping on the codes of keys factorized in sorted order keeps the groups sorted by key
+        codes, keys = pd.factorize(table.column(kind).to_pandas().str.strip(), sort=True)
+        keep = codes >= 0
+        if not keep.any():
+            continue
+        rows = pd.DataFrame({"key": codes[keep], "window": windows[keep], "time": times[keep].view("datetime64[ns]"), "volume": volume[keep]})
+        groups = rows.groupby(["key", "window"], sort=True)
+        frame = groups.agg(sessions=("time", "size"), volume=("volume", "sum"), first_seen=("time", "min"),
+                           last_seen=("time", "max")).reset_index()
+        # Sessions per label: one count per (group, label) pair
+        pairs = groups.ngroup().to_numpy() * len(labels) + label_codes[keep]
+        counts = np.bincount(pairs, minlength=len(frame) * len(labels)).reshape(len(frame), len(labels))
+        for j, label in enumerate(labels):
+            frame[f"{_LABEL}{label}"] = counts[:, j]
+        totals = frame.drop(columns="window").groupby("key", sort=True).agg(_sums(frame)).reset_index()
+        keys = np.asarray(keys, dtype=object)
+        frame["key"] = keys[frame["key"].to_numpy()]
+        totals["key"] = keys[totals["key"].to_numpy()]
+        parts[kind] = frame, totals
+    return parts
+
+
+def _batches(preds):
+    # The prediction rows in tables of BEHAVIOUR_BATCH_ROWS (readers give a row group at a time)
+    pending, held = [], 0
+    for batch in preds.iter_batches(columns=_SOURCE_COLUMNS):
+        pending.append(batch)
+        held += batch.num_rows
+        if held >= BEHAVIOUR_BATCH_ROWS:
+            yield pa.concat_tables(pending)
+            pending, held = [], 0
+    if pending:
+        yield pa.concat_tables(pending)
+
+
+def _merge(frames, by):
+    # Rows of `frames` with the same `by` values combined, ordered by them
+    frame = pd.concat(frames, ignore_index=True)
+    labels = _label_columns(frame)
+    frame[labels] = frame[labels].fillna(0).astype(np.int64)
+    return frame.groupby(by, sort=True).agg(_sums(frame)).reset_index()
+
+
+def _write(frames, path, meta):
+    frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame({"kind": [], "key": []})
+    labels = sorted(_label_columns(frame))
+    frame[labels] = frame[labels].fillna(0).astype(np.int64)
+    frame = frame[[c for c in frame.columns if c not in labels] + labels]
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.set_column(0, "kind", table.column(0).cast(pa.string()).dictionary_encode())
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(table.replace_schema_metadata(meta), tmp, compression="zstd")
+    os.replace(tmp, path)
+
+
+class BehaviourProfiles:
+    """Per-MSISDN and per-IP behaviour of one stored upload, kept in sidecars of its predictions.
+
+    For every MSISDN and IP value it holds the sessions (flow records), their total volume, when
+    the first and last were seen and the sessions per predicted label: over the whole upload
+    (profiles_path) and per time window of BEHAVIOUR_WINDOW seconds (windows_path). Both are
+    built once per prediction set by grouped aggregations over batches of its rows, so
+    analyses read them instead of scanning the upload again. Rows without a timestamp form a
+    group without a window; rows without the key are left out.
+    """
+
+    def __init__(self, preds_path, window):
+        self.preds_path = preds_path
+        self.window = window
+
+    @classmethod
+    def build(cls, preds_path, window=BEHAVIOUR_WINDOW):
+        """Aggregate the prediction set at `preds_path` and write its sidecars."""
+        meta = {b"predictions": _source_meta(preds_path).encode(), b"window": str(window).encode()}
+        batches = {kind: [] for kind in KINDS}
+        for batch in _batches(open_predictions(preds_path)):
+            for kind, groups in _aggregate(batch, window).items():
+                batches[kind].append(groups)
+        windowed, totals = [], []
+        for kind, parts in batches.items():
+            if not parts:
+                continue
+            frame, total = parts[0] if len(parts) == 1 else (_merge([p[0] for p in parts], ["key", "window"]),
+                                                            _merge([p[1] for p in parts], ["key"]))
+            frame.insert(0, "kind", kind)
+            total.insert(0, "kind", kind)
+            windowed.append(frame)
+            totals.append(total)
+        for frame in windowed:
+            frame["window"] = frame["window"].to_numpy().view("datetime64[ns]")
+        # Written last, so a complete per-key file means a complete windows file
+        _write(windowed, windows_path(preds_path), meta)
+        _write(totals, profiles_path(preds_path), meta)
+        return cls(preds_path, window)
+
+    @classmethod
+    def load(cls, preds_path, window=BEHAVIOUR_WINDOW):
+        """The stored profiles if they match the prediction set on disk and the window width, else None."""
+        try:
+            meta = pq.read_schema(profiles_path(preds_path)).metadata or {}
+            fresh = meta.get(b"predictions", b"").decode() == _source_meta(preds_path)
+        except (OSError, pa.ArrowInvalid):
+            return None
+        if not fresh or meta.get(b"window") != str(window).encode():
+            return None
+        return cls(preds_path, window)
+
+    @classmethod
+    def open(cls, preds_path, window=BEHAVIOUR_WINDOW):
+        return cls.load(preds_path, window) or cls.build(preds_path, window)
+
+    def totals(self, kind):
+        """One row per value of `kind` ("msisdn" or "ip") over the whole upload, as a DataFrame."""
+        return self._read(profiles_path(self.preds_path), [("kind", "=", kind)])
+
+    def windows(self, kind, key=None, time_range=(None, None)):
+        """One row per value of `kind` and time window, for one value if `key` is given.
+
+        `time_range` ([start, stop) in epoch nanoseconds, as from parse_time_range()) keeps the
+        windows overlapping it; the group without a window is then left out.
+        """
+        frame = self._read(windows_path(self.preds_path), [("kind", "=", kind)] + ([("key", "=", key)] if key is not None else []))
+        start, stop = time_range
+        if start is not None or stop is not None:
+            begins = frame["window"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+            keep = begins != _NO_TIME
+            if start is not None:
+                keep &= begins + self.window * _NS > start
+            if stop is not None:
+                keep &= begins < stop
+            frame = frame[keep]
+        return frame
+
+    @staticmethod
+    def _read(path, filters):
+        columns = [name for name in pq.read_schema(path).names if name != "kind"]
+        return pq.read_table(path, columns=columns, filters=filters).to_pandas()
+
+
+def store_profiles(preds_path):
+    """Build the behaviour profiles of a prediction set as it is stored, where they are missing or stale."""
+    try:
+        with stage("behaviour"):
+            if BehaviourProfiles.load(preds_path) is None:
+                BehaviourProfiles.build(preds_path)
+    except OSError:
+        pass
+    # Deleted meanwhile: drop what was just written for it
+    if not os.path.exists(preds_path):
+        remove_profiles(preds_path)
+
+
+def remove_profiles(preds_path):
+    for path in (profiles_path(preds_path), windows_path(preds_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _iso(value):
+    return None if pd.isna(value) else pd.Timestamp(value).isoformat()
+
+
+def _summarize(frames, by):
+    # Rows of `frames` combined per value of column `by`, with their flagged sessions
+    frame = pd.concat(frames, ignore_index=True)
+    labels = _label_columns(frame)
+    frame[labels] = frame[labels].fillna(0).astype(np.int64)
+    if len(frames) == 1 and frame[by].is_unique:
+        totals = frame.set_index(by)
+    else:
+        totals = frame.groupby(by, sort=False).agg(_sums(frame))
+    totals = totals[["sessions", "volume", "first_seen", "last_seen"] + sorted(labels)]
+    benign = [c for c in labels if c[len(_LABEL):].lower() == BENIGN_LABEL.lower()]
+    totals["flagged"] = totals["sessions"] - totals[benign].sum(axis=1)
+    totals["flagged_ratio"] = totals["flagged"] / totals["sessions"]
+    return totals
+
+
+def _records(totals, name):
+    out = []
+    for value, row in totals.iterrows():
+        sessions = int(row["sessions"])
+        labels = {c[len(_LABEL):]: int(row[c]) for c in _label_columns(totals) if row[c]}
+        out.append({name: _iso(value) if name == "window_start" else value, "sessions": sessions, "volume": float(row["volume"]),
+                    "first_seen": _iso(row["first_seen"]), "last_seen": _iso(row["last_seen"]), "flagged": int(row["flagged"]),
+                    "flagged_ratio": float(row["flagged_ratio"]),
+                    "labels": {label: {"sessions": n, "ratio": n / sessions} for label, n in labels.items()}})
+    return out
+
+
+def rank_profiles(frames, sort="flagged", start=0, count=50):
+    """Profiles of the keys in `frames` (from BehaviourProfiles.totals() or .windows()), highest `sort` first.
+
+    Returns (number of keys, the `count` profiles from position `start`); ties are ordered by key.
+    """
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return 0, []
+    totals = _summarize(frames, "key").rename_axis("key").reset_index()
+    totals = totals.sort_values([sort, "key"], ascending=[False, True], na_position="last", kind="stable")
+    return len(totals), _records(totals.iloc[start:start + count].set_index("key"), "key")
+
+
+def timeline(frames, window=BEHAVIOUR_WINDOW, base=BEHAVIOUR_WINDOW):
+    """(profile over all of `frames`, profiles per `window`-second window in time order) for one key.
+
+    `frames` come from BehaviourProfiles.windows(); `window` must be a multiple of the width
+    `base` they were built with. The group without a timestamp counts in the overall profile only.
+    """
+    if window <= 0 or window % base:
+        raise ValueError(f"window must be a positive multiple of {base} seconds")
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return None, []
+    overall = _records(_summarize([f.assign(key=0) for f in frames], "key"), "key")[0]
+    del overall["key"]
+    begins = [f["window"].to_numpy(dtype="datetime64[ns]").view(np.int64) for f in frames]
+    timed = [f[b != _NO_TIME].assign(window_start=(b[b != _NO_TIME] // (window * _NS) * (window * _NS)).view("datetime64[ns]"))
+             for f, b in zip(frames, begins)]
+    timed = [f for f in timed if len(f)]
+    if not timed:
+        return overall, []
+    return overall, _records(_summarize(timed, "window_start").sort_index(), "window_start")
@@ -0,0 +1,484 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+import pandas as pd
+from .storage import content_hash, list_prediction_files, open_predictions, predictions_path
+
+
+SCHEMA_SAMPLE_ROWS = 1000
+# Equal-width bins over [0, 1] in which each upload's confidences are counted for the report histogram
+CONFIDENCE_BINS = 100
+# Seconds an upload CSV may go without a catalog entry before verify() reports it: it is
+# stored before it is scored, so uploads being scored or queued as jobs have none yet
+UNREGISTERED_GRACE = 3600
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS uploads (
+    file TEXT PRIMARY KEY,
+    predictions TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    label_counts TEXT NOT NULL,
+    schema TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    model_version TEXT,
+    confidence_bins TEXT,
+    content_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS label_totals (
+    label TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS totals (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_ips (
+    file TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (file, ip)
+);
+CREATE TABLE IF NOT EXISTS ip_totals (
+    ip TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ip_totals_count ON ip_totals (count);
+CREATE TABLE IF NOT EXISTS confidence_totals (
+    bin INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+"""
+
+
+def _frame_schema(df):
+    return [[str(c), str(t)] for c, t in df.dtypes.items()]
+
+
+def _json_or_none(text):
+    return json.loads(text) if text else None
+
+
+def sample_schema(csv_path):
+    """Column names and pandas dtypes inferred from the first rows of a stored CSV."""
+    try:
+        return _frame_schema(pd.read_csv(csv_path, nrows=SCHEMA_SAMPLE_ROWS))
+    except Exception:
+        return None
+
+
+class Catalog:
+    """SQLite catalog mapping each uploaded CSV to its prediction artifact.
+
+    Stores row count, label histogram, column schema, timestamps, the scoring model
+    version and the SHA-256 of the CSV per upload so the API can answer lookups (including
+    "was this exact file scored before?") without opening every prediction file. Upload and prediction totals and the per-label counts are kept in `totals`/`label_totals`
+    and adjusted in the same transaction that adds or removes an upload, so summary
+    endpoints read a handful of rows however many uploads exist. The other inputs of the PDF
+    report are kept the same way: rows per IP (`upload_ips` per upload, summed in `ip_totals`)
+    and a confidence histogram (`confidence_bins` per upload, summed in `confidence_totals`).
+    A fresh connection is used per call; SQLite's own locking makes that safe across threads
+    and worker processes.
+    """
+
+    def __init__(self, path, uploads_dir):
+        self.path = path
+        self.uploads_dir = uploads_dir
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        backfill = False
+        try:
+            conn.executescript(_DDL)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(uploads)")}
+            if "model_version" not in columns:
+                # Catalogs created before model versions were recorded
+                conn.execute("ALTER TABLE uploads ADD COLUMN model_version TEXT")
+                conn.commit()
+            if "confidence_bins" not in columns:
+                # Catalogs created before the report inputs were kept: fill them in from the artifacts
+                conn.execute("ALTER TABLE uploads ADD COLUMN confidence_bins TEXT")
+                conn.commit()
+                backfill = True
+            if "content_hash" not in columns:
+                # Catalogs created before uploads were hashed; those uploads are never matched as duplicates
+                conn.execute("ALTER TABLE uploads ADD COLUMN content_hash TEXT")
+                conn.commit()
+            conn.execute("CREATE INDEX IF NOT EXISTS uploads_content_hash ON uploads (content_hash)")
+            conn.commit()
+        finally:
+            conn.close()
+        if backfill:
+            self._backfill_report_inputs()
+        with self._connect(write=True) as conn:
+            # Catalogs created before the aggregate tables existed start with empty totals
+            if conn.execute("SELECT COUNT(*) FROM totals").fetchone()[0] == 0:
+                self._recompute(conn)
+
+    @contextmanager
+    def _connect(self, write=False):
+        # One transaction per block: committed on success, rolled back on error, then closed.
+        # Writers take the lock up front so read-modify-write of the totals cannot interleave.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _apply(conn, sign, rows, label_counts):
+        # Adjust the running totals by one upload's contribution (sign is +1 or -1)
+        for name, value in (("uploads", 1), ("predictions", rows)):
+            conn.execute("INSERT INTO totals (name, value) VALUES (?, ?) "
+                         "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, sign * value))
+        for label, count in label_counts.items():
+            conn.execute("INSERT INTO label_totals (label, count) VALUES (?, ?) "
+                         "ON CONFLICT(label) DO UPDATE SET count = count + excluded.count", (str(label), sign * count))
+        conn.execute("DELETE FROM label_totals WHERE count = 0")
+
+    @staticmethod
+    def _apply_ips(conn, sign, file):
+        # Adjust the per-IP totals by the rows of `file` in upload_ips
+        conn.execute("INSERT INTO ip_totals (ip, count) SELECT ip, ? * count FROM upload_ips WHERE file = ? "
+                     "ON CONFLICT(ip) DO UPDATE SET count = count + excluded.count", (sign, file))
+        conn.execute("DELETE FROM ip_totals WHERE count = 0")
+
+    @staticmethod
+    def _apply_confidence(conn, sign, confidence_bins):
+        for i, count in enumerate(confidence_bins or []):
+            if count:
+                conn.execute("INSERT INTO confidence_totals (bin, count) VALUES (?, ?) "
+                             "ON CONFLICT(bin) DO UPDATE SET count = count + excluded.count", (i, sign * count))
+
+    @staticmethod
+    def _recompute(conn):
+        conn.execute("DELETE FROM totals")
+        conn.execute("DELETE FROM label_totals")
+        conn.execute("DELETE FROM ip_totals")
+        conn.execute("DELETE FROM confidence_totals")
+        conn.executemany("INSERT INTO totals (name, value) VALUES (?, 0)", [("uploads",), ("predictions",)])
+        conn.execute("DELETE FROM upload_ips WHERE file NOT IN (SELECT file FROM uploads)")
+        conn.execute("INSERT INTO ip_totals (ip, count) SELECT ip, SUM(count) FROM upload_ips GROUP BY ip")
+        for row in conn.execute("SELECT rows, label_counts, confidence_bins FROM uploads").fetchall():
+            Catalog._apply(conn, 1, row["rows"], json.loads(row["label_counts"]))
+            Catalog._apply_confidence(conn, 1, _json_or_none(row["confidence_bins"]))
+
+    def register(self, file, predictions_path, schema=None, content_hash=None):
+        """Record (or replace) the prediction artifact of `file`; returns the stored entry.
+
+        `content_hash` is the SHA-256 of the CSV (kept from the previous entry when not given).
+        """
+        preds = open_predictions(predictions_path)
+        if schema is None:
+            schema = sample_schema(os.path.join(self.uploads_dir, file))
+        label_counts = preds.label_counts()
+        ip_counts = preds.ip_counts()
+        confidence_bins = preds.confidence_histogram(CONFIDENCE_BINS)
+        now = time.time()
+        with self._connect(write=True) as conn:
+            row = conn.execute("SELECT rows, label_counts, created_at, confidence_bins, content_hash FROM uploads WHERE file = ?",
+                               (file,)).fetchone()
+            created = now
+            if row is not None:
+                content_hash = content_hash or row["content_hash"]
+                # Re-registering replaces the previous contribution
+                self._apply(conn, -1, row["rows"], json.loads(row["label_counts"]))
+                self._apply_ips(conn, -1, file)
+                self._apply_confidence(conn, -1, _json_or_none(row["confidence_bins"]))
+                created = row["created_at"]
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads (file, predictions, rows, label_counts, schema, created_at, updated_at, model_version, confidence_bins, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file, os.path.basename(predictions_path), preds.num_rows, json.dumps(label_counts),
+                 json.dumps(schema) if schema is not None else None, created, now, preds.model_version,
+                 json.dumps(confidence_bins), content_hash),
+            )
+            self._store_ips(conn, file, ip_counts)
+            self._apply(conn, 1, preds.num_rows, label_counts)
+            self._apply_ips(conn, 1, file)
+            self._apply_confidence(conn, 1, confidence_bins)
+        return self.get(file)
+
+    @staticmethod
+    def _store_ips(conn, file, ip_counts):
+        conn.execute("DELETE FROM upload_ips WHERE file = ?", (file,))
+        conn.executemany("INSERT INTO upload_ips (file, ip, count) VALUES (?, ?, ?)",
+                         [(file, str(ip), count) for ip, count in ip_counts.items()])
+
+    def _backfill_report_inputs(self):
+        # Per-upload IP counts and confidence histograms for uploads registered before they were kept
+        for entry in self.entries():
+            try:
+                preds = open_predictions(self.predictions_path(entry))
+                ip_counts, confidence_bins = preds.ip_counts(), preds.confidence_histogram(CONFIDENCE_BINS)
+            except Exception:
+                continue
+            with self._connect(write=True) as conn:
+                self._store_ips(conn, entry["file"], ip_counts)
+                conn.execute("UPDATE uploads SET confidence_bins = ? WHERE file = ?", (json.dumps(confidence_bins), entry["file"]))
+        with self._connect(write=True) as conn:
+            self._recompute(conn)
+
+    def get(self, file):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM uploads WHERE file = ?", (file,)).fetchone()
+        return self._entry(row) if row is not None else None
+
+    def find_content(self, content_hash, model_version=None):
+        """The newest upload whose CSV has this SHA-256 and whose files still exist, or None.
+
+        With `model_version` only uploads scored by that version are considered.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM uploads WHERE content_hash = ? ORDER BY created_at DESC", (content_hash,)).fetchall()
+        for row in rows:
+            entry = self._entry(row)
+            if model_version is not None and entry["model_version"] != model_version:
+                continue
+            if os.path.exists(os.path.join(self.uploads_dir, entry["file"])) and os.path.exists(self.predictions_path(entry)):
+                return entry
+        return None
+
+    def remove(self, file):
+        """Forget `file`; returns the removed entry or None."""
+        with self._connect(write=True) as conn:
+            row = conn.execute("SELECT * FROM uploads WHERE file = ?", (file,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM uploads WHERE file = ?", (file,))
+            self._apply(conn, -1, row["rows"], json.loads(row["label_counts"]))
+            self._apply_ips(conn, -1, file)
+            self._apply_confidence(conn, -1, _json_or_none(row["confidence_bins"]))
+            conn.execute("DELETE FROM upload_ips WHERE file = ?", (file,))
+        return self._entry(row)
+
+    def entries(self):
+        with self._connect() as conn:
+            return self._entries(conn)
+
+    def _entries(self, conn):
+        return [self._entry(r) for r in conn.execute("SELECT * FROM uploads ORDER BY created_at").fetchall()]
+
+    def totals(self):
+        """(number of uploads, number of stored predictions), from the maintained counters."""
+        with self._connect() as conn:
+            return self._totals(conn)
+
+    @staticmethod
+    def _totals(conn):
+        values = dict(conn.execute("SELECT name, value FROM totals").fetchall())
+        return values.get("uploads", 0), values.get("predictions", 0)
+
+    def label_totals(self):
+        """Prediction count per label across all uploads, from the maintained counters."""
+        with self._connect() as conn:
+            return self._label_totals(conn)
+
+    @staticmethod
+    def _label_totals(conn):
+        return dict(conn.execute("SELECT label, count FROM label_totals ORDER BY label").fetchall())
+
+    def top_ips(self, limit=10):
+        """The `limit` IPs with the most predictions across all uploads, as (ip, count) pairs."""
+        with self._connect() as conn:
+            return self._top_ips(conn, limit)
+
+    @staticmethod
+    def _top_ips(conn, limit):
+        return [tuple(r) for r in conn.execute("SELECT ip, count FROM ip_totals ORDER BY count DESC, ip LIMIT ?", (limit,))]
+
+    def confidence_totals(self):
+        """Prediction counts in CONFIDENCE_BINS equal-width confidence bins over [0, 1], across all uploads."""
+        with self._connect() as conn:
+            return self._confidence_totals(conn)
+
+    @staticmethod
+    def _confidence_totals(conn):
+        counts = [0] * CONFIDENCE_BINS
+        for row in conn.execute("SELECT bin, count FROM confidence_totals"):
+            if 0 <= row["bin"] < CONFIDENCE_BINS:
+                counts[row["bin"]] = row["count"]
+        return counts
+
+    def fingerprint(self):
+        """Short hash of the current set of prediction artifacts; changes whenever one is added, replaced or removed."""
+        with self._connect() as conn:
+            return self._fingerprint(conn)
+
+    @staticmethod
+    def _fingerprint(conn):
+        rows = conn.execute("SELECT file, predictions, updated_at FROM uploads ORDER BY file").fetchall()
+        return hashlib.sha1(json.dumps([list(r) for r in rows]).encode('utf-8')).hexdigest()[:16]
+
+    def snapshot(self, top_ips=10):
+        """fingerprint(), entries() and the maintained totals, all read in one transaction so they agree."""
+        with self._connect() as conn:
+            return {
+                "fingerprint": self._fingerprint(conn),
+                "entries": self._entries(conn),
+                "total": self._totals(conn)[1],
+                "by_label": self._label_totals(conn),
+                "top_ips": self._top_ips(conn, top_ips),
+                "confidence_bins": self._confidence_totals(conn),
+            }
+
+    def verify(self, deep=False, repair=False):
+        """Recompute the totals from scratch and report any drift from the maintained counters.
+
+        The recount sums the per-upload rows of the catalog; with deep=True each upload's
+        row count, label histogram and confidence histogram are first re-read from its
+        prediction artifact. With repair=True drifted values are overwritten by the recount.
+
+        CSVs in the uploads directory without a catalog entry (a scoring that died without
+        cleaning up) are reported as unregistered_uploads once UNREGISTERED_GRACE has passed;
+        they are not removed.
+        """
+        stale = []
+        if deep:
+            for entry in self.entries():
+                try:
+                    preds = open_predictions(self.predictions_path(entry))
+                    actual = (preds.num_rows, {str(k): v for k, v in preds.label_counts().items()},
+                              preds.confidence_histogram(CONFIDENCE_BINS))
+                except Exception:
+                    actual = None
+                if actual != (entry["rows"], entry["label_counts"], entry["confidence_bins"]):
+                    stale.append(entry["file"])
+                    if repair and actual is not None:
+                        self.register(entry["file"], self.predictions_path(entry), schema=entry["schema"])
+
+        with self._connect(write=repair) as conn:
+            stored_totals = dict(conn.execute("SELECT name, value FROM totals").fetchall())
+            stored_labels = dict(conn.execute("SELECT label, count FROM label_totals").fetchall())
+            actual_totals = {"uploads": 0, "predictions": 0}
+            actual_labels = {}
+            actual_bins = {}
+            for row in conn.execute("SELECT rows, label_counts, confidence_bins FROM uploads").fetchall():
+                actual_totals["uploads"] += 1
+                actual_totals["predictions"] += row["rows"]
+                for label, count in json.loads(row["label_counts"]).items():
+                    actual_labels[label] = actual_labels.get(label, 0) + count
+                for i, count in enumerate(_json_or_none(row["confidence_bins"]) or []):
+                    actual_bins[i] = actual_bins.get(i, 0) + count
+            drift = {}
+            for name in actual_totals:
+                if stored_totals.get(name, 0) != actual_totals[name]:
+                    drift[name] = {"stored": stored_totals.get(name, 0), "actual": actual_totals[name]}
+            for label in set(stored_labels) | set(actual_labels):
+                if stored_labels.get(label, 0) != actual_labels.get(label, 0):
+                    drift[f"label:{label}"] = {"stored": stored_labels.get(label, 0), "actual": actual_labels.get(label, 0)}
+            stored_ips = dict(conn.execute("SELECT ip, count FROM ip_totals").fetchall())
+            actual_ips = dict(conn.execute("SELECT ip, SUM(count) FROM upload_ips WHERE file IN (SELECT file FROM uploads) "
+                                           "GROUP BY ip").fetchall())
+            mismatched = sum(1 for ip in set(stored_ips) | set(actual_ips) if stored_ips.get(ip, 0) != actual_ips.get(ip, 0))
+            if mismatched:
+                drift["ip_totals"] = {"mismatched_ips": mismatched}
+            stored_bins = dict(conn.execute("SELECT bin, count FROM confidence_totals").fetchall())
+            mismatched = sum(1 for i in set(stored_bins) | set(actual_bins) if stored_bins.get(i, 0) != actual_bins.get(i, 0))
+            if mismatched:
+                drift["confidence_totals"] = {"mismatched_bins": mismatched}
+            if repair and drift:
+                self._recompute(conn)
+        unregistered = self._unregistered_uploads()
+        return {"ok": not drift and not stale and not unregistered, "drift": drift, "stale_uploads": stale,
+                "unregistered_uploads": unregistered, "repaired": bool(repair and (drift or stale))}
+
+    def _unregistered_uploads(self):
+        try:
+            names = sorted(n for n in os.listdir(self.uploads_dir) if n.endswith(".csv"))
+        except OSError:
+            return []
+        with self._connect() as conn:
+            known = {r[0] for r in conn.execute("SELECT file FROM uploads")}
+        cutoff = time.time() - UNREGISTERED_GRACE
+        out = []
+        for name in names:
+            if name in known:
+                continue
+            # A scoring in progress keeps writing its predictions' temporary file
+            paths = [os.path.join(self.uploads_dir, name), predictions_path(self.uploads_dir, name) + ".tmp"]
+            try:
+                if max(os.path.getmtime(p) for p in paths if os.path.exists(p)) < cutoff:
+                    out.append(name)
+            except (OSError, ValueError):
+                continue
+        return out
+
+    def predictions_path(self, entry):
+        return os.path.join(self.uploads_dir, entry["predictions"])
+
+    def _entry(self, row):
+        entry = dict(row)
+        entry["label_counts"] = json.loads(entry["label_counts"])
+        entry["schema"] = json.loads(entry["schema"]) if entry["schema"] else None
+        entry["confidence_bins"] = _json_or_none(entry["confidence_bins"])
+        return entry
+
+    def rebuild(self):
+        """Regenerate the catalog from the prediction artifacts in the uploads directory.
+
+        Artifacts whose CSV no longer exists are left out, matching what the API reports.
+        Returns the number of uploads catalogued.
+        """
+        entries = []
+        ips = []
+        for ppath in list_prediction_files(self.uploads_dir):
+            try:
+                preds = open_predictions(ppath)
+            except Exception:
+                continue
+            csv_path = os.path.join(self.uploads_dir, preds.file or "")
+            if not preds.file or not os.path.exists(csv_path):
+                continue
+            created = os.path.getmtime(csv_path)
+            entries.append((preds.file, os.path.basename(ppath), preds.num_rows, json.dumps(preds.label_counts()),
+                            json.dumps(sample_schema(csv_path)), created, time.time(), preds.model_version,
+                            json.dumps(preds.confidence_histogram(CONFIDENCE_BINS)), content_hash(csv_path)))
+            ips.extend((preds.file, str(ip), count) for ip, count in preds.ip_counts().items())
+        with self._connect(write=True) as conn:
+            conn.execute("DELETE FROM uploads")
+            conn.execute("DELETE FROM upload_ips")
+            conn.executemany(
+                "INSERT OR REPLACE INTO uploads (file, predictions, rows, label_counts, schema, created_at, updated_at, model_version, confidence_bins, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", entries)
+            conn.executemany("INSERT OR REPLACE INTO upload_ips (file, ip, count) VALUES (?, ?, ?)", ips)
+            self._recompute(conn)
+        return len(entries)
+
+
+def open_catalog(uploads_dir, path=None):
+    """Open the catalog for `uploads_dir`, building it from existing artifacts on first use."""
+    path = path or os.getenv("CATALOG_PATH") or os.path.join(uploads_dir, "catalog.sqlite3")
+    fresh = not os.path.exists(path)
+    catalog = Catalog(path, uploads_dir)
+    if fresh:
+        catalog.rebuild()
+    return catalog
+
+
+if __name__ == '__main__':
+    # python -m app.catalog rebuild [uploads_dir]
+    # python -m app.catalog verify [uploads_dir] [--deep] [--repair]
+    if len(sys.argv) < 2 or sys.argv[1] not in ('rebuild', 'verify'):
+        print("usage: python -m app.catalog rebuild|verify [uploads_dir] [--deep] [--repair]", file=sys.stderr)
+        sys.exit(2)
+    args = [a for a in sys.argv[2:] if not a.startswith('--')]
+    target_dir = args[0] if args else os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
+    catalog = open_catalog(target_dir)
+    if sys.argv[1] == 'rebuild':
+        print(f"catalogued {catalog.rebuild()} uploads into {catalog.path}")
+    else:
+        report = catalog.verify(deep='--deep' in sys.argv, repair='--repair' in sys.argv)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["ok"] or report["repaired"] else 1)
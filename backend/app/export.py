@@ -0,0 +1,121 @@
+import os
+import json
+import zlib
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from .storage import PREDICTION_COLUMNS, PREDICTION_COMPRESSION, decode_labels, open_predictions
+
+
+# Rows read from storage and encoded per step; memory use is bounded by one such batch
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "65536"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+# Every upload is exported with the same column types (labels as text), so the batches of
+# different uploads can go into one Parquet file or Arrow stream
+EXPORT_SCHEMA = pa.schema([
+    ('row', pa.int64()),
+    ('prediction', pa.string()),
+    ('ip', pa.string()),
+    ('msisdn', pa.string()),
+    ('timestamp', pa.string()),
+    ('volume', pa.float64()),
+    ('confidence', pa.float64()),
+])
+
+
+class _Drain:
+    """Write-only file object that hands back what the Arrow writers wrote since the last take()."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _batches(paths, batch_size):
+    for path in paths:
+        try:
+            preds = open_predictions(path)
+        except Exception:
+            continue
+        for table in preds.iter_batches(PREDICTION_COLUMNS, batch_size=batch_size):
+            if table.num_rows:
+                yield decode_labels(table).cast(EXPORT_SCHEMA)
+
+
+def _encode(batches, fmt):
+    # One block of bytes per batch; the Arrow writers emit into a _Drain that is emptied after each batch
+    sink = _Drain()
+    if fmt == "ndjson":
+        for table in batches:
+            yield ("\n".join(json.dumps(r) for r in table.to_pylist()) + "\n").encode('utf-8')
+        return
+    if fmt == "csv":
+        writer = pacsv.CSVWriter(sink, EXPORT_SCHEMA)
+    elif fmt == "parquet":
+        writer = pq.ParquetWriter(sink, EXPORT_SCHEMA, compression=PREDICTION_COMPRESSION)
+    else:
+        writer = pa.ipc.new_stream(sink, EXPORT_SCHEMA)
+    try:
+        if fmt == "csv":
+            # The header goes out even when there is nothing to export
+            writer.write_table(EXPORT_SCHEMA.empty_table())
+            yield sink.take()
+        for table in batches:
+            writer.write_table(table)
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def _gzip(chunks, level=EXPORT_GZIP_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(paths, fmt="csv", gzip=False, batch_size=EXPORT_BATCH_ROWS):
+    """Bytes of the prediction sets at `paths`, concatenated in order, in an EXPORT_FORMATS format.
+
+    Each prediction set is read one batch of row groups at a time and every batch is encoded in
+    one go, so memory stays flat however large the export. With gzip the stream is compressed
+    on the fly.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    chunks = (c for c in _encode(_batches(paths, batch_size), fmt) if c)
+    return _gzip(chunks) if gzip else chunks
+
+
+def export_filename(fmt, gzip=False):
+    return f"predictions_export.{EXPORT_FORMATS[fmt][1]}" + (".gz" if gzip else "")
@@ -0,0 +1,201 @@
+import os
+import shutil
+import numpy as np
+
+
+# Rows traversed together by the NumPy fallback; its working set is n_trees * FOREST_BATCH_ROWS node ids
+FOREST_BATCH_ROWS = int(os.getenv("FOREST_BATCH_ROWS", "1024"))
+
+# Arrays written by FlatForest.save, one .npy file each
+_ARRAYS = ("feature", "threshold", "left", "right", "missing_left", "roots", "leaf_values")
+
+
+def _accumulate_rows(X, feature, threshold, left, right, missing_left, roots, leaf_values, out):
+    # Compiled kernel. Trees are the outer loop so one tree's nodes stay in cache across rows;
+    # each row still receives the leaf distributions in estimator order.
+    for t in range(roots.shape[0]):
+        for i in range(X.shape[0]):
+            node = roots[t]
+            while left[node] != node:
+                x = X[i, feature[node]]
+                if x <= threshold[node] or (x != x and missing_left[node]):
+                    node = left[node]
+                else:
+                    node = right[node]
+            for c in range(leaf_values.shape[1]):
+                out[i, c] += leaf_values[node, c]
+
+
+_compiled_accumulate = None
+
+
+def _compiled():
+    # numba is imported on first use, not with the module: importing it alone costs a few hundred ms
+    # at startup, and it is optional (the NumPy traversal below is used without it)
+    global _compiled_accumulate
+    if _compiled_accumulate is None:
+        try:
+            from numba import njit
+        except ImportError:
+            _compiled_accumulate = False
+        else:
+            _compiled_accumulate = njit(nogil=True, cache=True)(_accumulate_rows)
+    return _compiled_accumulate if _compiled_accumulate is not False else None
+
+
+class FlatForest:
+    """A fitted sklearn tree-ensemble classifier flattened into contiguous NumPy arrays.
+
+    All trees' nodes live in one set of arrays (feature, threshold, left, right) with leaves
+    pointing at themselves. With numba installed a compiled kernel walks them row by row
+    without holding the GIL; otherwise a batch of rows descends every tree at once in NumPy,
+    one vectorized step per level for the (tree, row) pairs not yet at a leaf. Either way
+    leaf class distributions are summed tree by tree in estimator order and divided by the
+    number of trees, the same float64 operations sklearn performs, so predict_proba matches
+    it exactly.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, roots, leaf_values, depth, classes):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.roots = roots
+        self.leaf_values = leaf_values
+        self.depth = depth
+        self.classes_ = classes
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten a fitted RandomForestClassifier / ExtraTreesClassifier. Raises ValueError if unsupported."""
+        estimators = getattr(model, "estimators_", None)
+        if not estimators or getattr(model, "n_outputs_", 1) != 1 or not hasattr(estimators[0], "tree_"):
+            raise ValueError(f"Cannot flatten {type(model).__name__}")
+        n_classes = int(np.atleast_1d(model.n_classes_)[0])
+        features, thresholds, lefts, rights, missing, values, roots = [], [], [], [], [], [], []
+        offset = 0
+        depth = 0
+        for est in estimators:
+            tree = est.tree_
+            n = tree.node_count
+            idx = np.arange(n, dtype=np.intp)
+            leaf = tree.children_left == -1
+            features.append(np.where(leaf, 0, tree.feature).astype(np.intp))
+            thresholds.append(tree.threshold.astype(np.float64))
+            lefts.append(np.where(leaf, idx, tree.children_left) + offset)
+            rights.append(np.where(leaf, idx, tree.children_right) + offset)
+            mgl = getattr(tree, "missing_go_to_left", None)
+            missing.append(np.asarray(mgl, dtype=bool) if mgl is not None else np.zeros(n, dtype=bool))
+            proba = np.array(tree.value[:, 0, :n_classes], dtype=np.float64)
+            sums = proba.sum(axis=1)
+            if not np.allclose(sums[leaf], 1.0):
+                # Older sklearn stores class counts; normalize them the way its predict_proba does
+                sums[sums == 0.0] = 1.0
+                proba /= sums[:, np.newaxis]
+            values.append(proba)
+            roots.append(offset)
+            depth = max(depth, int(tree.max_depth))
+            offset += n
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            missing_left=np.concatenate(missing),
+            roots=np.array(roots, dtype=np.intp),
+            leaf_values=np.concatenate(values),
+            depth=depth,
+            classes=np.asarray(model.classes_),
+        )
+
+    def save(self, directory, source=None):
+        """Write the arrays to `directory` as .npy files for load(). Another process finishing first wins.
+
+        `source` is the pickle the forest was flattened from; load() ignores the files once it changes.
+        """
+        stat = os.stat(source) if source else None
+        meta = np.array([self.depth, stat.st_size if stat else -1, stat.st_mtime_ns if stat else -1], dtype=np.int64)
+        tmp = f"{directory}.tmp{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            for name in _ARRAYS:
+                np.save(os.path.join(tmp, name + ".npy"), getattr(self, name))
+            np.save(os.path.join(tmp, "classes.npy"), self.classes_, allow_pickle=True)
+            np.save(os.path.join(tmp, "meta.npy"), meta)
+            if os.path.isdir(directory) and FlatForest.load(directory, source) is None:
+                shutil.rmtree(directory, ignore_errors=True)
+            try:
+                os.rename(tmp, directory)
+            except OSError:
+                # A fresh copy appeared meanwhile (another worker built it)
+                pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory, source=None, mmap=True):
+        """The forest saved in `directory`, or None if missing or stale.
+
+        With mmap the arrays are memory-mapped read-only, so every process scoring with the same
+        files shares one copy of them in the page cache instead of holding its own.
+        """
+        try:
+            meta = np.load(os.path.join(directory, "meta.npy"))
+            if source:
+                stat = os.stat(source)
+                if (int(meta[1]), int(meta[2])) != (stat.st_size, stat.st_mtime_ns):
+                    return None
+            arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode='r' if mmap else None)
+                      for name in _ARRAYS}
+            classes = np.load(os.path.join(directory, "classes.npy"), allow_pickle=True)
+        except (OSError, ValueError, IndexError):
+            return None
+        return cls(depth=int(meta[0]), classes=classes, **arrays)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def compiled(self):
+        return _compiled() is not None
+
+    def _leaves(self, X):
+        # Leaf node id reached in every tree by every row of X: shape (n_trees, n_rows)
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        node = np.repeat(self.roots, n_rows)
+        row_base = np.tile(np.arange(n_rows, dtype=np.intp) * n_features, self.n_trees)
+        active = np.flatnonzero(self.left[node] != node)
+        while active.size:
+            current = node[active]
+            x = flat[row_base[active] + self.feature[current]]
+            go_left = x <= self.threshold[current]
+            if self.missing_left.any():
+                go_left |= np.isnan(x) & self.missing_left[current]
+            nxt = np.where(go_left, self.left[current], self.right[current])
+            node[active] = nxt
+            active = active[self.left[nxt] != nxt]
+        return node.reshape(self.n_trees, n_rows)
+
+    def predict_proba(self, X):
+        # sklearn validates X to float32 and compares it against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = np.zeros((X.shape[0], self.leaf_values.shape[1]), dtype=np.float64)
+        kernel = _compiled()
+        if kernel is not None:
+            kernel(X, self.feature, self.threshold, self.left, self.right, self.missing_left,
+                   self.roots, self.leaf_values, out)
+        else:
+            batch = max(1, FOREST_BATCH_ROWS)
+            for start in range(0, X.shape[0], batch):
+                leaves = self._leaves(X[start:start + batch])
+                acc = out[start:start + batch]
+                for t in range(self.n_trees):
+                    acc += self.leaf_values[leaves[t]]
+        out /= self.n_trees
+        return out
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
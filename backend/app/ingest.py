@@ -0,0 +1,277 @@
+import os
+import re
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.compute as pc
+from .metrics import INGEST_BYTES
+
+
+# "arrow" parses uploads with Arrow's multithreaded CSV reader: identifiers dictionary-encoded,
+# model features narrowed to float32 where no value changes. "pandas" uses pandas' C parser.
+INGEST_ENGINE = os.getenv("INGEST_ENGINE", "arrow")
+# Bytes of CSV text per Arrow parse block. The blocks of a file are parsed on Arrow's CPU
+# threads; streamed reads keep several blocks in flight, so larger blocks raise their memory use
+INGEST_BLOCK_SIZE = int(os.getenv("INGEST_BLOCK_SIZE", str(1 << 20)))
+
+ENGINES = ("arrow", "pandas")
+
+# Cells pandas reads as missing; the Arrow reader is given the same list
+NA_VALUES = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+             "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+
+# read_csv dtype values -> Arrow column types (Arrow types are also accepted as they are)
+_ARROW_TYPES = {"float64": pa.float64(), "category": pa.dictionary(pa.int32(), pa.string()), str: pa.string()}
+
+
+class TypeDrift(ValueError):
+    """A later block of a streamed CSV did not fit the type taken from the first: read `column` as `dtype`."""
+
+    def __init__(self, column, dtype):
+        super().__init__(column)
+        self.column = column
+        self.dtype = dtype
+
+
+class MemoryAccount:
+    """Bytes held by the buffers of one upload's ingest.
+
+    Every step holds its buffers under a name (the parsed Arrow table, the DataFrame built from
+    it, the current chunk); peak_bytes is the most held at once and resident_bytes what is still
+    held when the ingest is done. Sizes are those of the buffers themselves, not sampled from the
+    allocator. pandas' parser does not expose its working buffers, so with that engine only
+    resident_bytes is reported.
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine or INGEST_ENGINE
+        self.rows = 0
+        self._held = {}
+        self._peak = 0
+
+    def hold(self, name, nbytes):
+        self._held[name] = int(nbytes)
+        self._peak = max(self._peak, sum(self._held.values()))
+
+    def release(self, name):
+        self._held.pop(name, None)
+
+    @property
+    def peak_bytes(self):
+        return self._peak if self.engine == "arrow" else None
+
+    @property
+    def resident_bytes(self):
+        return sum(self._held.values())
+
+    def as_dict(self):
+        return {"engine": self.engine, "rows": self.rows, "peak_bytes": self.peak_bytes, "resident_bytes": self.resident_bytes}
+
+
+def record_ingest(memory):
+    """Observe an ingest's MemoryAccount.as_dict() into the ipdr_ingest_bytes histogram."""
+    if memory.get("peak_bytes") is not None:
+        INGEST_BYTES.observe(memory["peak_bytes"], engine=memory["engine"], kind="peak")
+    INGEST_BYTES.observe(memory["resident_bytes"], engine=memory["engine"], kind="resident")
+
+
+def frame_bytes(frame):
+    return int(frame.memory_usage(index=False, deep=True).sum())
+
+
+def read_csv_header(source):
+    """Column names of a CSV path or seekable file object, leaving file objects rewound.
+
+    Names are as pandas gives them (duplicates made unique); both engines use them.
+    """
+    cols = pd.read_csv(source, nrows=0).columns.tolist()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return cols
+
+
+def _arrow_options(columns, usecols, dtype):
+    read = pacsv.ReadOptions(use_threads=True, block_size=INGEST_BLOCK_SIZE, column_names=columns, skip_rows=1)
+    # Columns without a dtype are read as text and typed afterwards by _infer, as pandas would
+    types = {c: _arrow_type(dtype.get(c)) for c in (usecols or columns)}
+    convert = pacsv.ConvertOptions(include_columns=usecols, column_types=types, null_values=NA_VALUES,
+                                   strings_can_be_null=True)
+    return read, convert
+
+
+def _arrow_type(spec):
+    if isinstance(spec, pa.DataType):
+        return spec
+    return _ARROW_TYPES.get(spec, pa.string())
+
+
+def _sniff(path, columns, dtype):
+    # Types Arrow infers from the first block for the columns without a dtype, where they are
+    # numbers or booleans; dates and times are left as text, as pandas leaves them
+    read = pacsv.ReadOptions(block_size=INGEST_BLOCK_SIZE, column_names=columns, skip_rows=1)
+    convert = pacsv.ConvertOptions(column_types={c: _arrow_type(t) for c, t in dtype.items()}, null_values=NA_VALUES)
+    with pa.OSFile(path) as f:
+        schema = pacsv.open_csv(f, read_options=read, convert_options=convert).schema
+    return {field.name: field.type for field in schema if field.name not in dtype and (
+        pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or pa.types.is_boolean(field.type))}
+
+
+def _drift(exc, columns):
+    # "In CSV column #3: Row #12: CSV conversion error to int64: invalid value '1.5'": integers
+    # widen to floats, anything else to text
+    match = re.match(r"In CSV column #(\d+): .*CSV conversion error to (\w+)", str(exc))
+    if match is None or int(match.group(1)) >= len(columns):
+        return exc
+    return TypeDrift(columns[int(match.group(1))], "float64" if match.group(2).startswith("int") else str)
+
+
+def _infer(column):
+    # pandas' choice for a column of text: integers, else floats, else booleans, else text
+    if len(column) and column.null_count == len(column):
+        return pa.nulls(len(column), pa.float64())
+    # A failed cast still converts every value, so each type is tried on the first rows first
+    head = column.slice(0, 1024)
+    for type_ in (pa.int64(), pa.float64(), pa.bool_()):
+        try:
+            head.cast(type_)
+            return column.cast(type_)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    return column
+
+
+def _downcast(column):
+    # float64 -> float32 only when every value converts back unchanged, so scores cannot move
+    narrow = column.cast(pa.float32(), safe=False)
+    return narrow if pc.all(pc.equal(narrow.cast(pa.float64()), column)).as_py() else column
+
+
+def _finish(table, dtype, downcast):
+    for i, name in enumerate(table.column_names):
+        if name not in dtype:
+            table = table.set_column(i, name, _infer(table.column(i)))
+        elif name in downcast and dtype[name] == "float64":
+            table = table.set_column(i, name, _downcast(table.column(i)))
+    return table
+
+
+def _to_frame(table, account):
+    account.hold("parsed", table.nbytes)
+    # The table's buffers are released column by column as the DataFrame takes over
+    frame = table.to_pandas(split_blocks=True, self_destruct=True)
+    account.hold("frame", frame_bytes(frame))
+    account.release("parsed")
+    return frame
+
+
+def _rebatch(reader, rows):
+    # Tables of exactly `rows` rows (the last one shorter) out of the reader's batches of any size;
+    # a file without data rows gives one empty table, as pandas' chunked reader does
+    pending, held, done = [], 0, False
+    for batch in reader:
+        pending.append(batch)
+        held += batch.num_rows
+        while held >= rows:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, rows)
+            done = True
+            rest = table.slice(rows)
+            pending, held = rest.to_batches(), rest.num_rows
+    if held or not done:
+        yield pa.Table.from_batches(pending, schema=reader.schema)
+
+
+def read_csv(source, columns=None, usecols=None, dtype=None, downcast=(), engine=None, account=None):
+    """Parse a whole CSV (path or file object) into a DataFrame, as pd.read_csv(source, usecols=, dtype=) would.
+
+    `dtype` maps columns to "float64", "category" or str; the rest are typed by inference.
+    `columns` is the header when already known. The Arrow engine narrows the float64 columns in
+    `downcast` where lossless; files its reader rejects (ragged rows) are left to pandas.
+    """
+    engine = engine or INGEST_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown ingest engine: {engine}")
+    dtype = dtype or {}
+    account = account if account is not None else MemoryAccount(engine)
+    account.engine = engine
+    if engine == "arrow":
+        try:
+            read, convert = _arrow_options(columns or read_csv_header(source), usecols, dtype)
+            table = _finish(pacsv.read_csv(source, read_options=read, convert_options=convert), dtype, set(downcast))
+        except pa.ArrowInvalid:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            account.engine = "pandas"
+        else:
+            frame = _to_frame(table, account)
+            account.rows += len(frame)
+            return frame
+    frame = pd.read_csv(source, usecols=usecols, dtype=dtype or None)
+    account.hold("frame", frame_bytes(frame))
+    account.rows += len(frame)
+    return frame
+
+
+def iter_csv(path, chunk_size, columns=None, usecols=None, dtype=None, downcast=(), engine=None, account=None):
+    """Parse the CSV at `path` chunk_size rows at a time, with the options of read_csv().
+
+    Yields (DataFrame, bytes_read); only one chunk is held at a time. Columns typed by inference
+    are typed per chunk, as with pandas' chunked reader.
+    """
+    engine = engine or INGEST_ENGINE
+    dtype = dtype or {}
+    account = account if account is not None else MemoryAccount(engine)
+    account.engine = engine
+    if engine == "pandas":
+        with open(path, 'rb') as fh:
+            for chunk in pd.read_csv(fh, chunksize=chunk_size, usecols=usecols, dtype=dtype or None):
+                account.hold("frame", frame_bytes(chunk))
+                account.rows += len(chunk)
+                yield chunk, fh.tell()
+        return
+    read, convert = _arrow_options(columns or read_csv_header(path), usecols, dtype)
+    with pa.OSFile(path) as f:
+        reader = pacsv.open_csv(f, read_options=read, convert_options=convert)
+        for table in _rebatch(reader, chunk_size):
+            chunk = _to_frame(_finish(table, dtype, set(downcast)), account)
+            account.rows += len(chunk)
+            yield chunk, f.tell()
+
+
+def iter_csv_tables(path, batch_rows, dtype=None, engine=None, account=None):
+    """Every column of the CSV at `path` as Arrow tables of batch_rows rows, for the upload's Parquet copy.
+
+    Columns without a `dtype` that the Arrow engine reads as numbers or booleans in the first
+    block are parsed as such throughout, raising TypeDrift if a later block does not fit; the
+    other columns are typed per batch as by iter_csv().
+    """
+    engine = engine or INGEST_ENGINE
+    dtype = dtype or {}
+    account = account if account is not None else MemoryAccount(engine)
+    account.engine = engine
+    if engine == "pandas":
+        for chunk in pd.read_csv(path, chunksize=batch_rows, dtype=dtype or None):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            account.hold("batch", frame_bytes(chunk) + table.nbytes)
+            account.rows += table.num_rows
+            yield table
+        account.release("batch")
+        return
+    columns = read_csv_header(path)
+    dtype = dict(dtype, **_sniff(path, columns, dtype))
+    read, convert = _arrow_options(columns, None, dtype)
+    with pa.OSFile(path) as f:
+        tables = _rebatch(pacsv.open_csv(f, read_options=read, convert_options=convert), batch_rows)
+        while True:
+            try:
+                table = next(tables, None)
+            except pa.ArrowInvalid as exc:
+                raise _drift(exc, columns) from exc
+            if table is None:
+                break
+            account.hold("batch", table.nbytes)
+            table = _finish(table, dtype, ())
+            account.hold("batch", max(account.resident_bytes, table.nbytes))
+            account.rows += table.num_rows
+            yield table
+    account.release("batch")
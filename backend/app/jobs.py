@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Background workers that stand in for a real job queue when running locally
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Jobs allowed to wait for a worker; beyond JOB_WORKERS + JOB_QUEUE_SIZE unfinished jobs, new ones are refused
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))
+# Finished jobs are forgotten, in memory and on disk, this many seconds after they end...
+JOB_TTL = int(os.getenv("JOB_TTL", str(7 * 24 * 3600)))
+# ...and beyond the newest JOB_KEEP of them
+JOB_KEEP = int(os.getenv("JOB_KEEP", "1000"))
+
+JOB_FIELDS = ["job_id", "status", "file", "rows_scored", "total_rows", "model_version", "created_at", "started_at", "finished_at", "error", "ingest",
+              "deduplicated"]
+
+
+class JobQueueFull(Exception):
+    """Raised when every job worker is busy and the job queue is full."""
+
+
+class JobManager:
+    """In-process job queue for long-running prediction work.
+
+    Jobs are plain dicts guarded by one lock. Every state change is also written to
+    `jobs_dir/{job_id}.json`, so status stays visible after a restart or from another
+    worker process (partial results are only available from the process running the job).
+    Finished jobs older than `ttl` seconds, or beyond the newest `keep`, are removed when new
+    ones are submitted. At most `queue_size` jobs wait for a worker: submit() raises
+    JobQueueFull beyond that, as the inference pool refuses uploads when full.
+    """
+
+    def __init__(self, jobs_dir, workers=JOB_WORKERS, ttl=JOB_TTL, keep=JOB_KEEP, queue_size=JOB_QUEUE_SIZE):
+        self.jobs_dir = jobs_dir
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.ttl = ttl
+        self.keep = keep
+        self._jobs = {}
+        self._writers = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+        self._waits = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="jobs")
+            return self._executor
+
+    def submit(self, fn, file, total_rows=None):
+        """Queue fn(job_id) and return the new job's status. fn reports back through update()/attach_writer().
+
+        Raises JobQueueFull when `workers` jobs are running and `queue_size` more are waiting.
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "file": file,
+            "rows_scored": 0,
+            "total_rows": total_rows,
+            "model_version": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "deduplicated": False,
+        }
+        self._prune()
+        with self._lock:
+            if sum(1 for j in self._jobs.values() if j["finished_at"] is None) >= self.workers + self.queue_size:
+                self._rejected += 1
+                raise JobQueueFull(f"Job queue full ({self.workers} running, {self.queue_size} queued)")
+            self._jobs[job_id] = job
+        self._persist(job)
+        self._get_executor().submit(self._run, job_id, fn)
+        return self.get(job_id)
+
+    def _run(self, job_id, fn):
+        started = time.time()
+        with self._lock:
+            wait = max(0.0, started - self._jobs[job_id]["created_at"])
+            self._waits += 1
+            self._wait_total += wait
+            self._wait_last = wait
+            self._wait_max = max(self._wait_max, wait)
+        self.update(job_id, status="running", started_at=started)
+        try:
+            fn(job_id)
+        except Exception as exc:
+            self.update(job_id, status="failed", error=str(exc), finished_at=time.time())
+        else:
+            self.update(job_id, status="done", finished_at=time.time())
+        finally:
+            with self._lock:
+                self._writers.pop(job_id, None)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job = dict(job)
+        self._persist(job)
+
+    def attach_writer(self, job_id, writer):
+        """Register the PredictionWriter of a running job so partial results can be served."""
+        with self._lock:
+            self._writers[job_id] = writer
+
+    def writer(self, job_id):
+        with self._lock:
+            return self._writers.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._public(job)
+        path = os.path.join(self.jobs_dir, f"{job_id}.json")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except Exception:
+            return None
+        if job.get("status") in ("queued", "running"):
+            # Known only from disk, so the process that ran it is gone
+            job["status"] = "interrupted"
+        return self._public(job)
+
+    def list(self, limit=None):
+        """This process's jobs, newest first; the newest `limit` of them when given."""
+        with self._lock:
+            jobs = [self._public(j) for j in self._jobs.values()]
+        return sorted(jobs, key=lambda j: j["created_at"], reverse=True)[:limit]
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            finished = sorted((j for j in self._jobs.values() if j["finished_at"] is not None), key=lambda j: j["finished_at"], reverse=True)
+            for job in finished[self.keep:] + [j for j in finished[:self.keep] if j["finished_at"] < cutoff]:
+                del self._jobs[job["job_id"]]
+            active = {job_id for job_id, j in self._jobs.items() if j["finished_at"] is None}
+        # On disk by last update, and only records that say the job finished: other worker
+        # processes share the directory and their queued or running jobs are not known here
+        try:
+            names = [n for n in os.listdir(self.jobs_dir) if n.endswith(".json") and n[:-len(".json")] not in active]
+        except OSError:
+            return
+        records = []
+        for name in names:
+            try:
+                records.append((os.path.getmtime(os.path.join(self.jobs_dir, name)), name))
+            except OSError:
+                pass
+        records.sort(reverse=True)
+        for i, (mtime, name) in enumerate(records):
+            if i >= self.keep or mtime < cutoff:
+                path = os.path.join(self.jobs_dir, name)
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        finished = json.load(f).get("finished_at") is not None
+                    if finished:
+                        os.remove(path)
+                except (OSError, ValueError):
+                    pass
+
+    def counts(self):
+        """Number of this process's jobs in each status."""
+        with self._lock:
+            statuses = [j["status"] for j in self._jobs.values()]
+        return {status: statuses.count(status) for status in ("queued", "running", "done", "failed")}
+
+    def stats(self):
+        """Load of this process's job queue, in the shape of InferencePool.stats()."""
+        counts = self.counts()
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": counts["running"],
+                "queued": counts["queued"],
+                "rejected": self._rejected,
+                "wait_ms_avg": round(1000 * self._wait_total / self._waits, 2) if self._waits else 0.0,
+                "wait_ms_max": round(1000 * self._wait_max, 2),
+                "wait_ms_last": round(1000 * self._wait_last, 2),
+            }
+
+    @staticmethod
+    def _public(job):
+        out = {k: job.get(k) for k in JOB_FIELDS}
+        total = out.get("total_rows")
+        out["progress"] = round(out["rows_scored"] / total, 4) if total else (1.0 if out["status"] == "done" else 0.0)
+        return out
+
+    def _persist(self, job):
+        try:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            tmp = os.path.join(self.jobs_dir, f"{job['job_id']}.json.tmp")
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(job, f)
+            os.replace(tmp, os.path.join(self.jobs_dir, f"{job['job_id']}.json"))
+        except Exception:
+            pass
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
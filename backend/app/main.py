@@ -1,21 +1,45 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, BackgroundTasks, Header, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-import pandas as pd
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 import os
-import io
 import time
 import json
+import uuid
+import asyncio
 from typing import List, Optional
-from .model import ModelWrapper
+from .registry import ModelRegistry, UnknownVersion
+from .scoring import (
+    DEFAULT_CHUNK_SIZE,
+    UploadParseError,
+    index_upload,
+    iter_scored_chunks,
+    open_upload_reader,
+    parse_plan,
+    predict_stored_upload,
+    remove_upload,
+    score_file,
+    store_upload_table,
+)
+from .storage import (
+    PredictionWriter,
+    open_predictions,
+    predictions_path,
+)
+from .catalog import open_catalog
+from .behaviour import BEHAVIOUR_WINDOW, KINDS, BehaviourProfiles, rank_profiles, remove_profiles, store_profiles, timeline
+from .uploadtable import UploadTable
+from .searchindex import parse_term, parse_time_range
+from .export import EXPORT_FORMATS, export_filename, iter_export
+from .ingest import MemoryAccount, record_ingest
+from .jobs import JobManager, JobQueueFull
+from .metrics import CONTENT_TYPE, REGISTRY, ROWS_SCORED, MetricsMiddleware, stage
+from .receive import UnknownUpload, UploadConflict, UploadError, UploadSessions, receive_multipart, upload_name
+from .profiling import ProfileStore, ProfilingMiddleware, folded_text, token_matches
+from .report import ReportCache
+from .search import InvalidCursor, SearchExecutor, decode_cursor, encode_cursor, query_fingerprint
+from .workers import InferencePool, PoolSaturated
 from pydantic import BaseModel
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import ImageReader
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 
 class LoginRequest(BaseModel):
@@ -30,6 +54,8 @@ class RegisterRequest(BaseModel):
 
 
 USERS_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "backend_users.json")
+# UPLOADS_PATH points the service at another uploads directory (benchmarks use a scratch one)
+UPLOADS_DIR = os.getenv("UPLOADS_PATH") or os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
 
 
 def _load_users():
@@ -60,6 +86,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Profiles of single requests, taken on demand or when a request is slow (see profiling.py)
+profiles = ProfileStore(os.path.join(UPLOADS_DIR, "profiles"))
+app.add_middleware(ProfilingMiddleware, store=profiles)
+
+# Counts and times every request and sends its stage timings in a Server-Timing header (see metrics.py)
+app.add_middleware(MetricsMiddleware)
+
 
 @app.post('/auth/register')
 def register(req: RegisterRequest):
@@ -93,110 +126,480 @@ if not output_base:
         # Fallback to Docker path
         output_base = "/app/outputs"
 
-# Initialize model wrapper. It expects the model artifacts to be available in the `outputs/` folder.
-wrapper = ModelWrapper(
-    model_path=os.path.join(output_base, "ipdr_model.pkl"),
-    scaler_path=os.path.join(output_base, "ipdr_scaler.pkl"),
-    numeric_cols_path=os.path.join(output_base, "ipdr_features.pkl"),
-    le_path=os.path.join(output_base, "ipdr_label_encoder.pkl"),
-)
+# Model versions live under outputs/models/{version}/; the plain artifacts in `outputs/` are
+# version "default" (see registry.py). Requests take models.current() once, so activating another
+# version swaps it in without disturbing requests already running.
+models = ModelRegistry(output_base)
+
+# CPU-bound parsing and scoring run here instead of on the event loop (see workers.py for settings)
+inference_pool = InferencePool(models)
+
+# Maps each upload to its prediction artifact, row count and label histogram (see catalog.py)
+catalog = open_catalog(UPLOADS_DIR)
+
+# Long-running prediction jobs submitted through /jobs (see jobs.py)
+jobs = JobManager(os.path.join(UPLOADS_DIR, "jobs"))
+
+# Resumable uploads of large files, scored once complete like an upload to /predict-file (see receive.py)
+upload_sessions = UploadSessions(os.path.join(UPLOADS_DIR, "incoming"))
+
+# Parallel index search across uploads for /search (see search.py)
+searcher = SearchExecutor()
+
+# Rendered PDF reports, reused until the set of predictions changes (see report.py)
+reports = ReportCache(catalog, os.path.join(UPLOADS_DIR, "reports"))
+
+# Pool and job load, read when /metrics is scraped
+REGISTRY.gauge("ipdr_inference_tasks", "Inference pool tasks running or waiting for a worker, and streams scoring.", ("state",),
+               read=lambda: {(state,): inference_pool.stats()[state] for state in ("running", "queued", "streaming")})
+REGISTRY.counter("ipdr_inference_tasks_total", "Inference pool tasks by outcome.", ("outcome",),
+                 read=lambda: {(outcome,): inference_pool.stats()[outcome] for outcome in ("completed", "failed", "rejected")})
+REGISTRY.gauge("ipdr_jobs_in_flight", "Prediction jobs queued or running in this process.", ("status",),
+               read=lambda: {(status,): n for status, n in jobs.counts().items() if status in ("queued", "running")})
+
+
+# Seconds spent in each startup phase; reported by /system/status and benchmarks/bench_startup.py
+startup_timings = {}
+
+
+@app.on_event("startup")
+def _load_models():
+    # The model is loaded here rather than at import, so importing the app stays cheap and the
+    # load is timed on its own. uvicorn accepts requests once this returns.
+    started = time.perf_counter()
+    models.load_active()
+    startup_timings["model_load"] = round(time.perf_counter() - started, 3)
+
+
+@app.on_event("shutdown")
+def _shutdown_workers():
+    inference_pool.shutdown()
+    jobs.shutdown()
+    searcher.shutdown()
+    models.shutdown()
+    reports.shutdown()
+
+
+def _scored_before(digest):
+    # The stored upload with the same bytes, scored by the model serving now, or None
+    return catalog.find_content(digest, models.current().version)
 
 
-@app.post("/predict-file")
-async def predict_file(file: UploadFile = File(...)):
-    """Accept a CSV file, run the ML model, and return predictions."""
+def _stored_response(entry):
+    # /predict-file's response for an upload whose predictions are already stored
+    preds = open_predictions(catalog.predictions_path(entry))
+    return {"predictions": preds.labels(), "n": preds.num_rows, "file": entry["file"], "detailed": preds.read().to_pylist(),
+            "model_version": entry["model_version"], "ingest": None, "deduplicated": True}
+
+
+# The upload routes read their multipart body themselves (see receive.py); this documents it
+_FILE_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "properties": {"file": {"type": "string", "format": "binary"}}, "required": ["file"]}}}}}
+
+
+def _spool_path():
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    return os.path.join(UPLOADS_DIR, f".spool_{uuid.uuid4().hex}.part")
+
+
+async def _receive_file(request, path):
+    # Writes the body's `file` part to `path` and returns its SHA-256 (see receive.py)
     try:
-        # Pandas can read from the uploaded file-like object
-        df = pd.read_csv(file.file)
-    except Exception as exc:
-        return {"error": f"Failed to read CSV: {exc}"}
+        with stage("spool"):
+            return await receive_multipart(request, path)
+    except UploadError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+
+async def _finish_session(upload_id, path):
+    try:
+        with stage("spool"):
+            return await upload_sessions.finish(upload_id, path)
+    except UnknownUpload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadConflict:
+        raise HTTPException(status_code=409, detail="Upload is being appended to")
+
 
+async def _hold_slot():
     try:
-        preds = wrapper.predict(df)
-
-        # Save uploaded file and predictions for later viewing
-        uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
-        os.makedirs(uploads_dir, exist_ok=True)
-        ts = int(time.time())
-        filename = f"upload_{ts}.csv"
-        filepath = os.path.join(uploads_dir, filename)
-
-        # Save raw uploaded bytes to file
-        file.file.seek(0)
-        with open(filepath, "wb") as f:
-            f.write(file.file.read())
-
-        # Create detailed predictions by connecting predictions to CSV key fields
-        detailed = []
-        # Attempt to compute confidence if model supports predict_proba
-        confidences = None
+        return await inference_pool.hold()
+    except PoolSaturated as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "5"})
+
+
+def _check_chunk_size(chunk_size):
+    if chunk_size <= 0:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive")
+
+
+async def _spool_and_predict(background_tasks, receive, stream, chunk_size, reuse):
+    # receive(spool_path) writes the upload there and returns its SHA-256
+    if stream:
+        _check_chunk_size(chunk_size)
+    spool_path = _spool_path()
+    digest = await receive(spool_path)
+    if stream:
+        # Taken once the body is in, so a slow client does not keep a stream slot from scoring
         try:
-            if hasattr(wrapper.model, 'predict_proba'):
-                # Try to compute probabilities on numeric input; be tolerant of errors
-                try:
-                    # reuse wrapper preprocessing path by providing full df
-                    probs = None
-                    try:
-                        probs = wrapper.model.predict_proba(wrapper.scaler.transform(df[wrapper.numeric_cols]) if wrapper.scaler is not None and wrapper.numeric_cols is not None else df[wrapper.numeric_cols] if wrapper.numeric_cols is not None else df.select_dtypes(include=[float, int]))
-                    except Exception:
-                        try:
-                            probs = wrapper.model.predict_proba(df.select_dtypes(include=[float, int]))
-                        except Exception:
-                            probs = None
-                    if probs is not None:
-                        # take max probability per row
-                        confidences = [float(p.max()) for p in probs]
-                except Exception:
-                    confidences = None
-        except Exception:
-            confidences = None
-
-        # heuristics to pick key columns from uploaded dataframe
-        def pick_column(dfcols, candidates):
-            lower = {c.lower(): c for c in dfcols}
-            for cand in candidates:
-                if cand.lower() in lower:
-                    return lower[cand.lower()]
-            # try partial matching
-            for k, v in lower.items():
-                for cand in candidates:
-                    if cand.lower() in k:
-                        return v
-            return None
-
-        ip_col = pick_column(df.columns.tolist(), ["ip", "ip_address", "source_ip", "destination_ip", "src_ip", "dst_ip", "ipaddress", "ip address"])
-        msisdn_col = pick_column(df.columns.tolist(), ["msisdn", "msisdn_number", "msisdn_no", "msisdnid"])
-        ts_col = pick_column(df.columns.tolist(), ["timestamp", "time", "date", "ts", "datetime"]) 
-        volume_col = pick_column(df.columns.tolist(), ["data_volume", "volume", "bytes", "data_bytes", "data_volume_bytes"])
-
-        # build detailed entries
-        for i, row in df.reset_index(drop=True).iterrows():
-            entry = {
-                "row": int(i),
-                "prediction": preds[i] if i < len(preds) else None,
-                "ip": row.get(ip_col) if ip_col else None,
-                "msisdn": row.get(msisdn_col) if msisdn_col else None,
-                "timestamp": str(row.get(ts_col)) if ts_col and not pd.isna(row.get(ts_col)) else None,
-                "volume": row.get(volume_col) if volume_col else None,
-                "confidence": confidences[i] if confidences is not None and i < len(confidences) else None,
-            }
-            detailed.append(entry)
-
-        # Save predictions (both simple list and detailed)
-        preds_path = os.path.join(uploads_dir, f"predictions_{ts}.json")
-        with open(preds_path, "w", encoding="utf-8") as pf:
-            json.dump({"file": filename, "predictions": preds, "n": len(preds), "detailed": detailed}, pf)
-
-        return JSONResponse({"predictions": preds, "n": len(preds), "file": filename, "detailed": detailed})
+            release = await _hold_slot()
+        except HTTPException:
+            os.remove(spool_path)
+            raise
+        return await _predict_file_streaming(spool_path, digest, chunk_size, reuse, release)
+    return await _predict_spooled(background_tasks, spool_path, digest, reuse)
+
+
+@app.post("/predict-file", openapi_extra=_FILE_BODY)
+async def predict_file(request: Request, background_tasks: BackgroundTasks, stream: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       reuse: bool = True):
+    """Accept a CSV file, run the ML model, and return predictions.
+
+    The multipart body is written to disk once, as it arrives, and hashed in the same pass.
+    Parsing and scoring run on the inference pool, never on the event loop; when the pool and
+    its queue are full the upload is refused with 503 and a Retry-After header.
+
+    With `stream=true` the upload is scored `chunk_size` rows at a time and the response is an
+    NDJSON stream of progress events; detailed predictions are then fetched from /ml/results.
+
+    An upload byte-identical to a stored one already scored by the current model is not stored
+    or scored again: the response names the stored upload and has `deduplicated` set.
+    `reuse=false` scores it anyway, as a new upload. Files too large for one request are sent
+    in pieces through /uploads.
+    """
+    return await _spool_and_predict(background_tasks, lambda path: _receive_file(request, path), stream, chunk_size, reuse)
+
+
+async def _predict_spooled(background_tasks, spool_path, digest, reuse=True):
+    # Whole-file scoring of the upload spooled at spool_path, for /predict-file and /uploads/{id}/complete
+    if reuse:
+        with stage("dedupe"):
+            entry = await run_in_threadpool(_scored_before, digest)
+        if entry is not None:
+            os.remove(spool_path)
+            with stage("serialize"):
+                return JSONResponse(await run_in_threadpool(_stored_response, entry))
+
+    filename = upload_name()
+    filepath = os.path.join(UPLOADS_DIR, filename)
+    preds_path = predictions_path(UPLOADS_DIR, filename)
+    try:
+        preds, detailed, ingest = await inference_pool.run(predict_stored_upload, spool_path, filepath, preds_path, filename)
+    except PoolSaturated as exc:
+        os.remove(spool_path)
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "5"})
+    except UploadParseError as exc:
+        return {"error": f"Failed to read CSV: {exc}"}
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {exc}")
 
+    ROWS_SCORED.inc(len(preds))
+    record_ingest(ingest)
+    try:
+        with stage("catalog"):
+            entry = await run_in_threadpool(catalog.register, filename, preds_path, None, digest)
+    except Exception as exc:
+        remove_upload(filepath, preds_path)
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {exc}")
+    # Scoring parsed only the model's columns; the copy of all of them is written after the response
+    background_tasks.add_task(store_upload_table, filepath)
+    background_tasks.add_task(store_profiles, preds_path)
+    with stage("serialize"):
+        return JSONResponse({"predictions": preds, "n": len(preds), "file": filename, "detailed": detailed, "model_version": entry["model_version"],
+                             "ingest": ingest, "deduplicated": False})
+
+
+class _ClosingStream(StreamingResponse):
+    # Closes its generator however the response ends. When the client disconnects, the send
+    # fails and the generator would be left suspended at a yield, its finally blocks never run
+    def __init__(self, generator, **kwargs):
+        super().__init__(generator, **kwargs)
+        self._generator = generator
+
+    def _close(self):
+        # A chunk being produced on a threadpool thread is let finish first
+        while self._generator.gi_running:
+            time.sleep(0.01)
+        self._generator.close()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await run_in_threadpool(self._close)
+
+
+async def _predict_file_streaming(spool_path, digest, chunk_size, reuse, release):
+    """Store the spooled upload, then score it chunk by chunk while streaming NDJSON progress events.
+
+    The stream occupies the inference pool slot `release` frees until the last chunk is scored.
+    """
+    filepath = None
+    try:
+        entry = None
+        if reuse:
+            with stage("dedupe"):
+                entry = await run_in_threadpool(_scored_before, digest)
+        if entry is not None:
+            os.remove(spool_path)
+            release(True)
+            done = {"event": "done", "file": entry["file"], "n": entry["rows"], "model_version": entry["model_version"], "ingest": None,
+                    "deduplicated": True}
+            return StreamingResponse(iter([json.dumps(done) + "\n"]), media_type="application/x-ndjson")
+        filename = upload_name()
+        filepath = os.path.join(UPLOADS_DIR, filename)
+        os.replace(spool_path, filepath)
+        memory = MemoryAccount()
+        with stage("index"):
+            await run_in_threadpool(index_upload, filepath, None, memory)
+    except Exception:
+        release(False)
+        if filepath is not None:
+            remove_upload(filepath)
+        raise
+
+    model = models.current()
+
+    def events():
+        preds_path = predictions_path(UPLOADS_DIR, filename)
+        writer = PredictionWriter(preds_path, filename, model_version=model.version)
+        rows = 0
+        ok = False
+        try:
+            for offset, table, bytes_read, bytes_total in iter_scored_chunks(model.wrapper, filepath, chunk_size):
+                with stage("persist"):
+                    writer.write(table)
+                ROWS_SCORED.inc(table.num_rows)
+                rows = offset + table.num_rows
+                yield json.dumps({"event": "progress", "file": filename, "rows_scored": rows, "bytes_read": bytes_read, "bytes_total": bytes_total}) + "\n"
+            with stage("persist"):
+                writer.close()
+            with stage("catalog"):
+                catalog.register(filename, preds_path, content_hash=digest)
+            ok = True
+        except Exception as exc:
+            yield json.dumps({"event": "error", "file": filename, "rows_scored": rows, "detail": f"Prediction failed: {exc}"}) + "\n"
+            return
+        finally:
+            # Also when the client disconnects: closing the generator raises GeneratorExit at a yield
+            if not ok:
+                writer.abort()
+                remove_upload(filepath, preds_path)
+            release(ok)
+        store_profiles(preds_path)
+        yield json.dumps({"event": "done", "file": filename, "n": rows, "model_version": model.version, "ingest": memory.as_dict(),
+                          "deduplicated": False}) + "\n"
+
+    return _ClosingStream(events(), media_type="application/x-ndjson")
+
+
+@app.post("/jobs/predict-file", status_code=202, openapi_extra=_FILE_BODY)
+async def submit_prediction_job(request: Request, chunk_size: int = DEFAULT_CHUNK_SIZE, reuse: bool = True):
+    """Store the upload and score it on a background worker.
+
+    Returns a job ID immediately; poll /jobs/{job_id} for progress and /jobs/{job_id}/results
+    for the rows scored so far. Finished predictions are served by /ml/results like any upload.
+    A byte-identical upload already scored by the current model completes at once with the
+    stored upload's `file` and `deduplicated` set, unless `reuse=false`. When JOB_WORKERS jobs
+    are running and JOB_QUEUE_SIZE more are waiting, the upload is refused with 503 and a
+    Retry-After header.
+    """
+    _check_chunk_size(chunk_size)
+    spool_path = _spool_path()
+    return await _submit_spooled(spool_path, await _receive_file(request, spool_path), chunk_size, reuse)
+
+
+async def _submit_spooled(spool_path, digest, chunk_size, reuse=True):
+    # Job for the upload spooled at spool_path, for /jobs/predict-file and /uploads/{id}/complete
+    if reuse:
+        with stage("dedupe"):
+            entry = await run_in_threadpool(_scored_before, digest)
+        if entry is not None:
+            os.remove(spool_path)
+            return _submit_job(lambda job_id: jobs.update(job_id, rows_scored=entry["rows"], total_rows=entry["rows"],
+                                                          model_version=entry["model_version"], deduplicated=True), entry["file"])
+
+    filename = upload_name()
+    filepath = os.path.join(UPLOADS_DIR, filename)
+    os.replace(spool_path, filepath)
+    preds_path = predictions_path(UPLOADS_DIR, filename)
+    try:
+        return _submit_job(lambda job_id: _run_prediction_job(job_id, filepath, preds_path, filename, chunk_size, digest), filename)
+    except HTTPException:
+        os.remove(filepath)
+        raise
+
+
+def _submit_job(fn, file):
+    try:
+        return jobs.submit(fn, file)
+    except JobQueueFull as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "5"})
+
+
+@app.post("/uploads", status_code=201)
+def create_upload():
+    """Start a resumable upload, for files too large to send in one request.
+
+    Send the file's bytes with PATCH /uploads/{upload_id}, in as many pieces as needed, each
+    with an Upload-Offset header giving the byte it starts at. After an interruption GET
+    /uploads/{upload_id} tells how many bytes arrived; resend from there. POST
+    /uploads/{upload_id}/complete then scores the file as an upload to /predict-file would be.
+    """
+    return {"upload_id": upload_sessions.create(), "offset": 0}
+
+
+def _upload_state(upload_id, offset):
+    return JSONResponse({"upload_id": upload_id, "offset": offset}, headers={"Upload-Offset": str(offset)})
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Bytes a resumable upload holds (also in the Upload-Offset header)."""
+    try:
+        return _upload_state(upload_id, upload_sessions.offset(upload_id))
+    except UnknownUpload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+
+@app.patch("/uploads/{upload_id}")
+async def append_upload(upload_id: str, request: Request, upload_offset: int = Header(...)):
+    """Append the request body, the file from byte Upload-Offset on, to a resumable upload.
+
+    The body is written as it arrives; what arrived before a dropped connection is kept. An
+    Upload-Offset other than the bytes already held gets 409, with the current offset.
+    """
+    try:
+        with stage("spool"):
+            offset = await upload_sessions.append(upload_id, upload_offset, request)
+    except UnknownUpload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadConflict as exc:
+        return JSONResponse({"detail": "Upload-Offset does not match the bytes received, or the upload is in use", "offset": exc.offset},
+                            status_code=409, headers={"Upload-Offset": str(exc.offset)})
+    return _upload_state(upload_id, offset)
+
+
+@app.delete("/uploads/{upload_id}")
+async def discard_upload(upload_id: str):
+    """Abandon a resumable upload and drop the bytes received."""
+    try:
+        upload_sessions.discard(upload_id)
+    except UnknownUpload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadConflict:
+        raise HTTPException(status_code=409, detail="Upload is being appended to")
+    return {"status": "ok", "message": f"Upload {upload_id} discarded"}
+
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, background_tasks: BackgroundTasks, stream: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                          reuse: bool = True, job: bool = False):
+    """Score a resumable upload's file, ending the upload.
+
+    Takes the options of /predict-file and responds as it does; with `job=true` the file is
+    scored as a job instead, as /jobs/predict-file does (the response is then the job, 202).
+    """
+    if job:
+        _check_chunk_size(chunk_size)
+        spool_path = _spool_path()
+        submitted = await _submit_spooled(spool_path, await _finish_session(upload_id, spool_path), chunk_size, reuse)
+        return JSONResponse(submitted, status_code=202)
+    return await _spool_and_predict(background_tasks, lambda path: _finish_session(upload_id, path), stream, chunk_size, reuse)
+
+
+def _run_prediction_job(job_id, filepath, preds_path, filename, chunk_size, digest=None):
+    model = models.current()
+    memory = MemoryAccount()
+    writer = None
+    try:
+        with stage("index"):
+            total_rows = index_upload(filepath, account=memory)[0].rows
+        jobs.update(job_id, total_rows=total_rows, model_version=model.version, ingest=memory.as_dict())
+        writer = PredictionWriter(preds_path, filename, partial=True, model_version=model.version)
+        jobs.attach_writer(job_id, writer)
+        rows = score_file(model.wrapper, filepath, writer, chunk_size, progress=lambda rows, *_: jobs.update(job_id, rows_scored=rows))
+        ROWS_SCORED.inc(rows)
+        with stage("persist"):
+            writer.close()
+        with stage("catalog"):
+            catalog.register(filename, preds_path, content_hash=digest)
+    except Exception:
+        # Nothing of a failed job stays in the uploads directory without a catalog entry
+        if writer is not None:
+            writer.abort()
+        remove_upload(filepath, preds_path)
+        raise
+    store_profiles(preds_path)
+
+
+@app.get("/jobs")
+def list_jobs(limit: int = 100):
+    """Jobs submitted to this worker process, newest first: the newest `limit` of them.
+
+    Finished jobs are kept for JOB_TTL seconds, and only the newest JOB_KEEP (see jobs.py).
+    """
+    if limit <= 0:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    return jobs.list(limit)
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/results")
+def job_results(job_id: str, page: int = 0, page_size: int = 50):
+    """Page through a job's detailed predictions, including rows scored while the job is still running."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    start = page * page_size
+    rows = None
+    writer = jobs.writer(job_id)
+    if writer is not None:
+        rows = writer.read_partial(start, start + page_size)
+    if rows is None:
+        if job["status"] == "done":
+            rows = results_for_file(job["file"], page, page_size)["detailed"]
+        else:
+            rows = []
+    return {"job_id": job_id, "status": job["status"], "rows_scored": job["rows_scored"], "total_rows": job["total_rows"],
+            "detailed": rows, "page": page, "page_size": page_size}
+
+
+@app.get("/models")
+def list_models():
+    """Registered model versions, the one serving requests and any load in progress."""
+    return models.status()
+
+
+@app.post("/models/{version}/activate", status_code=202)
+async def activate_model(version: str, wait: bool = False):
+    """Load `version` in the background and swap it in once ready; requests in flight finish on the old model.
+
+    With `wait=true` the response is sent after the swap (or the load error).
+    """
+    try:
+        future = models.activate(version)
+    except UnknownVersion:
+        raise HTTPException(status_code=404, detail=f"Unknown model version: {version}")
+    if wait:
+        try:
+            await asyncio.wrap_future(future)
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=f"Loading {version} failed: {exc}")
+    return models.status()
 
 
 @app.get("/data/list")
 def list_uploads() -> List[str]:
     """List uploaded CSVs saved by the backend."""
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
+    uploads_dir = UPLOADS_DIR
     if not os.path.exists(uploads_dir):
         return []
     files = [f for f in os.listdir(uploads_dir) if f.endswith('.csv')]
@@ -204,42 +607,58 @@ def list_uploads() -> List[str]:
 
 
 @app.get("/data/view")
-def view_file(file: str, page: int = 0, page_size: int = 20):
+def view_file(file: str, page: int = 0, page_size: int = 20, columns: Optional[str] = None):
     """Return a page of rows from an uploaded CSV as JSON.
-    Supports pagination via `page` (0-indexed) and `page_size`.
+    Supports pagination via `page` (0-indexed) and `page_size`; `columns` (comma-separated) limits the columns returned.
     """
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
+    uploads_dir = UPLOADS_DIR
     filepath = os.path.join(uploads_dir, file)
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="File not found")
     try:
-        # Use chunked reading so large files don't get fully loaded
-        it = pd.read_csv(filepath, chunksize=page_size)
-        df_page = None
-        for i, chunk in enumerate(it):
-            if i == page:
-                df_page = chunk
-                break
-        if df_page is None:
+        # Pages come from the upload's Parquet copy (built at ingest, or here on first view),
+        # decoding only the row groups and columns the page needs
+        reader = open_upload_reader(filepath)
+        selected = [c.strip() for c in columns.split(',') if c.strip()] if columns else None
+        if selected:
+            unknown = [c for c in selected if c not in parse_plan(filepath).columns]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown columns: {', '.join(unknown)}")
+        start = page * page_size
+        if page_size <= 0 or start >= reader.rows:
             return {"columns": [], "rows": [], "page": page, "page_size": page_size}
-
-        # Compute total rows (fast-ish)
-        total = 0
-        try:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                total = sum(1 for _ in f) - 1
-        except Exception:
-            total = None
+        df_page = reader.read_page(start, page_size, columns=selected)
+        total = reader.rows
 
         return {"columns": df_page.columns.tolist(), "rows": df_page.to_dict(orient='records'), "page": page, "page_size": page_size, "total_rows": total}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/data/download")
+def download_file(file: str, format: str = 'csv'):
+    """Download an upload: the raw CSV exactly as uploaded, or (format=parquet) its columnar copy."""
+    filepath = os.path.join(UPLOADS_DIR, file)
+    if not os.path.abspath(filepath).startswith(os.path.abspath(UPLOADS_DIR)) or not file.endswith('.csv'):
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not os.path.exists(filepath):
+        raise HTTPException(status_code=404, detail="File not found")
+    if format.lower() == 'csv':
+        return FileResponse(filepath, media_type='text/csv', filename=file)
+    if format.lower() == 'parquet':
+        table = open_upload_reader(filepath)
+        if not isinstance(table, UploadTable):
+            raise HTTPException(status_code=404, detail="No Parquet copy for this file")
+        return FileResponse(table.path, media_type='application/vnd.apache.parquet', filename=os.path.basename(table.path))
+    raise HTTPException(status_code=400, detail="format must be csv or parquet")
+
+
 @app.delete("/data/delete")
 def delete_file(file: str):
     """Delete an uploaded CSV file and its associated predictions."""
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
+    uploads_dir = UPLOADS_DIR
     filepath = os.path.join(uploads_dir, file)
     
     # Security check: ensure file is in uploads directory
@@ -250,20 +669,15 @@ def delete_file(file: str):
         raise HTTPException(status_code=404, detail="File not found")
     
     try:
-        # Delete the CSV file
-        os.remove(filepath)
+        # Delete the CSV file, its Parquet copy and its sidecar indexes
+        remove_upload(filepath)
         
         # Delete associated predictions
-        preds_files = [p for p in os.listdir(uploads_dir) if p.startswith('predictions_') and p.endswith('.json')]
-        for pf in preds_files:
-            ppath = os.path.join(uploads_dir, pf)
-            try:
-                with open(ppath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if data.get('file') == file:
-                        os.remove(ppath)
-            except Exception:
-                continue
+        entry = catalog.remove(file)
+        if entry is not None and os.path.exists(catalog.predictions_path(entry)):
+            os.remove(catalog.predictions_path(entry))
+        if entry is not None:
+            remove_profiles(catalog.predictions_path(entry))
         
         return {"status": "ok", "message": f"File {file} deleted successfully"}
     except Exception as e:
@@ -273,303 +687,156 @@ def delete_file(file: str):
 @app.get("/ml/results")
 def results_for_file(file: str, page: int = 0, page_size: int = 50):
     """Return stored predictions for a given uploaded file, with pagination over detailed predictions."""
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
-    preds_files = [p for p in os.listdir(uploads_dir) if p.startswith('predictions_') and p.endswith('.json')]
-    for pf in preds_files:
-        ppath = os.path.join(uploads_dir, pf)
-        try:
-            with open(ppath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if data.get('file') == file:
-                    detailed = data.get('detailed', [])
-                    start = page * page_size
-                    end = start + page_size
-                    page_items = detailed[start:end]
-                    return {"file": file, "predictions": data.get('predictions', []), "n": data.get('n', len(data.get('predictions', []))), "detailed": page_items, "page": page, "page_size": page_size, "total": len(detailed)}
-        except Exception:
-            continue
-    raise HTTPException(status_code=404, detail='Predictions not found for file')
+    entry = catalog.get(file)
+    if entry is None:
+        raise HTTPException(status_code=404, detail='Predictions not found for file')
+    preds = open_predictions(catalog.predictions_path(entry))
+    # Only the requested page of detailed rows is read; the label column is read on its own
+    start = page * page_size
+    end = start + page_size
+    page_items = preds.read(start=start, stop=end).to_pylist()
+    return {"file": file, "predictions": preds.labels(), "n": preds.num_rows, "detailed": page_items, "page": page, "page_size": page_size, "total": preds.num_rows, "model_version": entry.get("model_version")}
 
 
 @app.get('/search')
-def search(file: Optional[str] = None, ip: Optional[str] = None, msisdn: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, min_volume: Optional[float] = None, page: int = 0, page_size: int = 50):
-    """Simple search API across an uploaded file (or across all uploads if file omitted).
-    Supports basic filters and pagination.
+def search(file: Optional[str] = None, ip: Optional[str] = None, msisdn: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, min_volume: Optional[float] = None, page: int = 0, page_size: int = 50, cursor: Optional[str] = None):
+    """Search an uploaded file (or all uploads if file omitted) through its sidecar indexes.
+
+    `ip` and `msisdn` match exactly, by prefix with a trailing '*' ("10.0.*"), and `ip` also by
+    CIDR block ("10.0.0.0/24"). `date_from`/`date_to` bound the timestamp column; a date-only
+    `date_to` includes that whole day. Uploads are searched in parallel and only the rows on the
+    requested page are read from the CSVs.
+
+    Pages can be addressed by `page` or by passing back `next_cursor`, which resumes after the
+    previous page without re-matching earlier uploads. `total_found` is exact when
+    `total_exact` is true; on cursor pages it is the total computed for the first page.
     """
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
+    if page < 0 or page_size <= 0:
+        raise HTTPException(status_code=400, detail="page must be >= 0 and page_size positive")
+    try:
+        ip_term = parse_term(ip, allow_cidr=True) if ip else None
+        msisdn_term = parse_term(msisdn) if msisdn else None
+        time_range = parse_time_range(date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = {"ip": ip_term, "msisdn": msisdn_term, "time_range": time_range, "min_volume": min_volume}
+    fingerprint = query_fingerprint(file=file, **filters)
+
     files_to_search = []
     if file:
-        files_to_search = [os.path.join(uploads_dir, file)] if os.path.exists(os.path.join(uploads_dir, file)) else []
-    else:
-        files_to_search = [os.path.join(uploads_dir, f) for f in os.listdir(uploads_dir) if f.endswith('.csv')]
+        files_to_search = [os.path.join(UPLOADS_DIR, file)] if os.path.exists(os.path.join(UPLOADS_DIR, file)) else []
+    elif os.path.exists(UPLOADS_DIR):
+        files_to_search = [os.path.join(UPLOADS_DIR, f) for f in os.listdir(UPLOADS_DIR) if f.endswith('.csv')]
 
-    results = []
-    for fp in files_to_search:
+    if cursor:
         try:
-            for chunk in pd.read_csv(fp, chunksize=10000):
-                # apply filters conservatively
-                df = chunk
-                if ip:
-                    cols = [c for c in df.columns if 'ip' in c.lower()]
-                    if cols:
-                        df = df[df[cols[0]].astype(str).str.contains(ip, na=False)]
-                if msisdn:
-                    cols = [c for c in df.columns if 'msisdn' in c.lower() or 'msisdn' in c.lower()]
-                    if cols:
-                        df = df[df[cols[0]].astype(str).str.contains(msisdn, na=False)]
-                if min_volume is not None:
-                    vol_cols = [c for c in df.columns if 'volume' in c.lower() or 'bytes' in c.lower()]
-                    if vol_cols:
-                        try:
-                            df = df[pd.to_numeric(df[vol_cols[0]], errors='coerce') >= float(min_volume)]
-                        except Exception:
-                            pass
-
-                # push rows into results until page_size * (page+1) to avoid unbounded memory
-                for _, r in df.iterrows():
-                    results.append(r.to_dict())
-                    if len(results) >= (page + 1) * page_size:
-                        break
-                if len(results) >= (page + 1) * page_size:
-                    break
-        except Exception:
-            continue
+            after_file, after_row, total = decode_cursor(cursor, fingerprint)
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        rows, last, more = searcher.search_after(files_to_search, filters, after_file, after_row, page_size)
+        total_exact = False
+    else:
+        rows, total, last, more = searcher.search(files_to_search, filters, page * page_size, page_size)
+        total_exact = True
 
-    start = page * page_size
-    end = start + page_size
-    page_rows = results[start:end]
-    return {"rows": page_rows, "page": page, "page_size": page_size, "total_found": len(results)}
+    next_cursor = encode_cursor(fingerprint, last[0], last[1], total) if more and last else None
+    return {"rows": rows, "page": page, "page_size": page_size, "total_found": total, "total_exact": total_exact, "next_cursor": next_cursor}
 
 
-@app.get('/reports/export')
-def export_predictions(format: str = 'csv'):
-    """Export aggregated predictions across uploads. Currently supports CSV.
-    Returns a streaming CSV response.
-    """
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
-    preds_files = [p for p in os.listdir(uploads_dir) if p.startswith('predictions_') and p.endswith('.json')]
-    rows = []
-    for pf in preds_files:
-        try:
-            with open(os.path.join(uploads_dir, pf), 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for d in data.get('detailed', []):
-                    rows.append(d)
-        except Exception:
-            continue
-
-    if format.lower() != 'csv':
-        raise HTTPException(status_code=400, detail='Only csv format supported')
-
-    # stream CSV
-    import csv
-    def iter_csv():
-        fieldnames = ['row','prediction','ip','msisdn','timestamp','volume','confidence']
-        output = io.StringIO()
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        yield output.getvalue()
-        output.seek(0)
-        output.truncate(0)
-        for r in rows:
-            writer.writerow({k: r.get(k, '') for k in fieldnames})
-            yield output.getvalue()
-            output.seek(0)
-            output.truncate(0)
-
-    return StreamingResponse(iter_csv(), media_type='text/csv', headers={"Content-Disposition": "attachment; filename=predictions_export.csv"})
+def _behaviour_of(file=None):
+    # Behaviour profiles of one upload, or of every catalogued upload; built here where missing or stale
+    if file:
+        entry = catalog.get(file)
+        if entry is None:
+            raise HTTPException(status_code=404, detail='Predictions not found for file')
+        entries = [entry]
+    else:
+        entries = catalog.entries()
+    paths = [catalog.predictions_path(entry) for entry in entries]
+    with stage("behaviour"):
+        return [BehaviourProfiles.open(path) for path in paths if os.path.exists(path)]
 
 
-@app.get('/reports/export_pdf')
-def export_pdf():
-    """Generate a PDF report aggregating predictions and simple analysis (charts + summary).
-    Streams back a generated PDF file.
-    """
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
-    preds_files = [p for p in os.listdir(uploads_dir) if p.startswith('predictions_') and p.endswith('.json')]
-    rows = []
-    for pf in preds_files:
-        try:
-            with open(os.path.join(uploads_dir, pf), 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for d in data.get('detailed', []):
-                    rows.append(d)
-        except Exception:
-            continue
-
-    # Build DataFrame
-    if len(rows) == 0:
-        # return a simple PDF stating no data
-        bio = io.BytesIO()
-        c = canvas.Canvas(bio, pagesize=letter)
-        c.setFont("Helvetica-Bold", 16)
-        c.drawString(72, 720, "IPDR Analysis Report")
-        c.setFont("Helvetica", 12)
-        c.drawString(72, 690, "No prediction data available to generate a report.")
-        c.showPage()
-        c.save()
-        bio.seek(0)
-        return StreamingResponse(io.BytesIO(bio.read()), media_type='application/pdf', headers={"Content-Disposition": "attachment; filename=ipdr_report.pdf"})
-
-    df = pd.DataFrame(rows)
-
-    # Basic summaries
-    total = len(df)
-    by_label = df['prediction'].value_counts().to_dict() if 'prediction' in df.columns else {}
-    by_ip = df['ip'].value_counts().head(10).to_dict() if 'ip' in df.columns else {}
-
-    # Create charts as PNGs in memory
-    images = []
+def _analysis_range(kind, date_from, date_to):
+    if kind not in KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown key: {kind} (one of {', '.join(KINDS)})")
     try:
-        # Label distribution pie
-        plt.figure(figsize=(6, 4))
-        if len(by_label) == 0:
-            plt.text(0.5, 0.5, 'No labels', ha='center')
-        else:
-            labels = list(by_label.keys())
-            sizes = list(by_label.values())
-            plt.pie(sizes, labels=labels, autopct='%1.1f%%')
-        buf = io.BytesIO()
-        plt.tight_layout()
-        plt.savefig(buf, format='png')
-        plt.close()
-        buf.seek(0)
-        images.append(buf)
-
-        # Top IPs bar
-        if len(by_ip) > 0:
-            plt.figure(figsize=(8, 4))
-            sns.barplot(x=list(by_ip.values()), y=list(by_ip.keys()), palette='viridis')
-            plt.title('Top IPs by prediction count')
-            plt.xlabel('Count')
-            plt.ylabel('IP')
-            buf2 = io.BytesIO()
-            plt.tight_layout()
-            plt.savefig(buf2, format='png')
-            plt.close()
-            buf2.seek(0)
-            images.append(buf2)
-
-        # Confidence histogram if present
-        if 'confidence' in df.columns:
-            try:
-                plt.figure(figsize=(6, 4))
-                df['confidence'] = pd.to_numeric(df['confidence'], errors='coerce')
-                df['confidence'].dropna().plot(kind='hist', bins=20)
-                plt.title('Prediction Confidence Distribution')
-                plt.xlabel('Confidence')
-                buf3 = io.BytesIO()
-                plt.tight_layout()
-                plt.savefig(buf3, format='png')
-                plt.close()
-                buf3.seek(0)
-                images.append(buf3)
-            except Exception:
-                pass
-    except Exception:
-        images = []
-
-    # Compose PDF
-    pdf_buf = io.BytesIO()
-    c = canvas.Canvas(pdf_buf, pagesize=letter)
-    width, height = letter
-
-    # Title
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(72, height - 72, "IPDR Analysis Report")
-    c.setFont("Helvetica", 10)
-    c.drawString(72, height - 96, f"Generated: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-    # Summary box
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(72, height - 128, "Summary")
-    c.setFont("Helvetica", 10)
-    c.drawString(72, height - 144, f"Total records analyzed: {total}")
-    y = height - 162
-    for k, v in by_label.items():
-        c.drawString(88, y, f"{k}: {v}")
-        y -= 14
-
-    # Insert charts
-    y_image = y - 12
-    for img_buf in images:
-        try:
-            img = ImageReader(img_buf)
-            # Draw image with max width 460, height scaled
-            iw, ih = img.getSize()
-            max_w = 460
-            scale = min(max_w / iw, 300 / ih, 1)
-            draw_w = iw * scale
-            draw_h = ih * scale
-            if y_image - draw_h < 72:
-                c.showPage()
-                y_image = height - 72
-            c.drawImage(img, 72, y_image - draw_h, width=draw_w, height=draw_h)
-            y_image = y_image - draw_h - 18
-        except Exception:
-            continue
+        return parse_time_range(date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get('/analysis/{kind}')
+def behaviour_profiles(kind: str, file: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None, sort: str = "flagged",
+                       page: int = 0, page_size: int = 50):
+    """Per-MSISDN (`kind=msisdn`) or per-IP (`kind=ip`) behaviour across uploads, or in one `file`, ranked by `sort`.
 
-    # Add a sample table of top 5 rows
+    A profile has the key's sessions, total volume, first and last seen, flagged sessions (any
+    label but the benign one) and their ratio, and the sessions and ratio of each label. They are
+    read from the aggregates stored when each upload was scored (see behaviour.py), not from the
+    CSVs. `date_from`/`date_to` keep the time windows overlapping that range. `sort` is one of
+    flagged, flagged_ratio, sessions, volume or last_seen.
+    """
+    if page < 0 or page_size <= 0:
+        raise HTTPException(status_code=400, detail="page must be >= 0 and page_size positive")
+    time_range = _analysis_range(kind, date_from, date_to)
+    ranged = time_range != (None, None)
+    frames = [p.windows(kind, time_range=time_range) if ranged else p.totals(kind) for p in _behaviour_of(file)]
     try:
-        c.showPage()
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(72, height - 72, "Sample Predictions (first 10)")
-        c.setFont("Helvetica", 9)
-        sample = df.head(10)
-        cols = [c for c in ['row', 'ip', 'timestamp', 'prediction', 'confidence'] if c in sample.columns]
-        x = 72
-        y = height - 96
-        # header
-        for col in cols:
-            c.drawString(x, y, col.upper())
-            x += 120
-        y -= 14
-        for _, r in sample.iterrows():
-            x = 72
-            for col in cols:
-                txt = str(r.get(col, ''))[:30]
-                c.drawString(x, y, txt)
-                x += 120
-            y -= 12
-            if y < 72:
-                c.showPage()
-                y = height - 72
-    except Exception:
-        pass
+        total, profiles = rank_profiles(frames, sort, page * page_size, page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"kind": kind, "file": file, "sort": sort, "page": page, "page_size": page_size, "total": total, "profiles": profiles}
+
+
+@app.get('/analysis/{kind}/{value}')
+def behaviour_timeline(kind: str, value: str, file: Optional[str] = None, window: int = BEHAVIOUR_WINDOW, date_from: Optional[str] = None,
+                       date_to: Optional[str] = None):
+    """One MSISDN's or IP's profile overall and per time window of `window` seconds (a multiple of BEHAVIOUR_WINDOW)."""
+    time_range = _analysis_range(kind, date_from, date_to)
+    frames = [p.windows(kind, value.strip(), time_range) for p in _behaviour_of(file)]
+    try:
+        profile, windows = timeline(frames, window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"No sessions for {kind} {value}")
+    return {"kind": kind, "key": value.strip(), "file": file, "window_seconds": window, "profile": profile, "windows": windows}
 
-    c.save()
-    pdf_buf.seek(0)
 
-    return StreamingResponse(io.BytesIO(pdf_buf.read()), media_type='application/pdf', headers={"Content-Disposition": "attachment; filename=ipdr_report.pdf"})
+@app.get('/reports/export')
+def export_predictions(format: str = 'csv', gzip: bool = False):
+    """Export all predictions across uploads as csv, ndjson, parquet or arrow (an Arrow IPC stream).
+
+    Streamed straight from the stored prediction sets, one upload and one batch of rows at a
+    time; gzip=true compresses the stream.
+    """
+    fmt = format.lower()
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    paths = [catalog.predictions_path(entry) for entry in catalog.entries()]
+    media_type = 'application/gzip' if gzip else EXPORT_FORMATS[fmt][0]
+    headers = {"Content-Disposition": f"attachment; filename={export_filename(fmt, gzip)}"}
+    return StreamingResponse(iter_export(paths, fmt, gzip=gzip), media_type=media_type, headers=headers)
+
+
+@app.get('/reports/export_pdf')
+async def export_pdf():
+    """PDF report of all predictions (label summary, charts and sample rows).
+
+    Served from the report cache while the prediction set is unchanged; otherwise rendered on
+    the report thread from the catalog's maintained totals (see report.py).
+    """
+    path = await asyncio.wrap_future(await run_in_threadpool(reports.get))
+    return FileResponse(path, media_type='application/pdf', filename="ipdr_report.pdf")
 
 
 @app.get("/reports/summary")
 def reports_summary():
     """Return a simple summary of predictions across all uploads."""
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
-    if not os.path.exists(uploads_dir):
-        return {"total_uploads": 0, "by_label": {}}
-    
-    # Get list of existing CSV files
-    csv_files = set([f for f in os.listdir(uploads_dir) if f.endswith('.csv')])
-    
-    # Only count predictions for files that still exist
-    preds_files = [p for p in os.listdir(uploads_dir) if p.startswith('predictions_') and p.endswith('.json')]
-    counts = {}
-    total = 0
-    for pf in preds_files:
-        try:
-            with open(os.path.join(uploads_dir, pf), 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Only count if the original CSV file still exists
-                if data.get('file') in csv_files:
-                    preds = data.get('predictions', [])
-                    total += len(preds)
-                    for p in preds:
-                        counts[p] = counts.get(p, 0) + 1
-        except Exception:
-            continue
-    return {"total_predictions": total, "by_label": counts}
+    # Counters are maintained by the catalog as uploads are added and deleted
+    _, total = catalog.totals()
+    return {"total_predictions": total, "by_label": catalog.label_totals()}
 
 
 @app.get('/auth/users')
@@ -581,21 +848,51 @@ def list_users_api():
     return out
 
 
+@app.get('/metrics')
+def metrics():
+    """Prometheus metrics of this worker process: request counts and latencies, per-stage timings,
+    rows scored, and inference pool and job load."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+def _require_profile_token(x_profile, profile):
+    if not token_matches(x_profile or profile):
+        raise HTTPException(status_code=403, detail="Profiles need the PROFILE_TOKEN, in an X-Profile header or a profile parameter")
+
+
+@app.get('/profiles')
+def list_profiles(x_profile: Optional[str] = Header(None), profile: Optional[str] = None):
+    """Stored request profiles, newest first."""
+    _require_profile_token(x_profile, profile)
+    return profiles.list()
+
+
+@app.get('/profiles/{profile_id}')
+def get_profile(profile_id: str, format: str = 'json', x_profile: Optional[str] = Header(None), profile: Optional[str] = None):
+    """One stored profile: JSON with the request, its stage timings, the hottest functions and the sampled
+    stacks, or (format=folded) the stacks alone in the collapsed format of flamegraph.pl and speedscope."""
+    _require_profile_token(x_profile, profile)
+    try:
+        doc = profiles.load(profile_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == 'folded':
+        return Response(folded_text(doc), media_type='text/plain', headers={"Content-Disposition": f"attachment; filename={profile_id}.folded"})
+    if format != 'json':
+        raise HTTPException(status_code=400, detail="format must be json or folded")
+    return doc
+
+
 @app.get('/system/status')
-def system_status():
-    uploads_dir = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
-    total_uploads = 0
-    total_predictions = 0
-    if os.path.exists(uploads_dir):
-        total_uploads = len([f for f in os.listdir(uploads_dir) if f.endswith('.csv')])
-        preds_files = [p for p in os.listdir(uploads_dir) if p.startswith('predictions_') and p.endswith('.json')]
-        for pf in preds_files:
-            try:
-                with open(os.path.join(uploads_dir, pf), 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    total_predictions += data.get('n', 0)
-            except Exception:
-                continue
+def system_status(verify: bool = False, deep: bool = False):
+    """Service counters. `verify=true` recounts the maintained totals from scratch and reports drift
+    (`deep=true` also re-reads every prediction artifact)."""
+    total_uploads, total_predictions = catalog.totals()
 
     users = _load_users()
-    return {"total_uploads": total_uploads, "total_predictions": total_predictions, "user_count": len(users)}
+    status = {"total_uploads": total_uploads, "total_predictions": total_predictions, "user_count": len(users), "inference": inference_pool.stats(), "jobs": jobs.stats(), "model": models.status(), "startup": startup_timings}
+    if verify:
+        status["verification"] = catalog.verify(deep=deep)
+    return status
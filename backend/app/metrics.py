@@ -0,0 +1,245 @@
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+
+# Upper bounds, in seconds, of the buckets of every duration histogram
+METRICS_BUCKETS = tuple(float(b) for b in os.getenv(
+    "METRICS_BUCKETS", "0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120").split(","))
+
+# Upper bounds, in bytes, of the buckets of memory histograms: 64 KiB to 16 GiB in powers of 4
+BYTE_BUCKETS = tuple(float(65536 * 4 ** i) for i in range(10))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A running total. With `read` it is taken from read() (a number, or {label values: number}) at scrape time."""
+
+    def __init__(self, name, help, labels=(), read=None):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.kind = "counter"
+        self.read = read
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        if self.read is not None:
+            values = self.read()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+            if not values and not self.label_names:
+                values = {(): 0}
+        return [(self.name, _labels(self.label_names, k), v) for k, v in sorted(values.items())]
+
+
+class Gauge(Counter):
+    """A value that goes up and down."""
+
+    def __init__(self, name, help, labels=(), read=None):
+        super().__init__(name, help, labels, read)
+        self.kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=METRICS_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.kind = "histogram"
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = sorted((k, (list(c), t)) for k, (c, t) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                out.append((f"{self.name}_bucket", _labels(self.label_names, key, [("le", _number(bound))]), cumulative))
+            out.append((f"{self.name}_sum", _labels(self.label_names, key), total))
+            out.append((f"{self.name}_count", _labels(self.label_names, key), cumulative))
+        return out
+
+
+class Registry:
+    """The metrics of this process, rendered in the Prometheus text format by render()."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=(), read=None):
+        return self._add(Counter(name, help, labels, read))
+
+    def gauge(self, name, help, labels=(), read=None):
+        return self._add(Gauge(name, help, labels, read))
+
+    def histogram(self, name, help, labels=(), buckets=METRICS_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+# Metrics are kept per process; with several uvicorn workers each one serves its own /metrics
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter("ipdr_http_requests_total", "HTTP requests by method, route and status.", ("method", "route", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("ipdr_http_request_duration_seconds", "Time from request to last response byte.", ("method", "route"))
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("ipdr_http_requests_in_flight", "Requests being handled.")
+STAGE_SECONDS = REGISTRY.histogram("ipdr_stage_duration_seconds", "Time a request or job spent in each processing stage.", ("stage",))
+ROWS_SCORED = REGISTRY.counter("ipdr_rows_scored_total", "Rows scored by the model.")
+PREDICTION_CACHE_ROWS = REGISTRY.counter("ipdr_prediction_cache_rows_total",
+                                         "Rows looked up in the prediction cache: hit (no tree traversal) or miss.", ("result",))
+INGEST_BYTES = REGISTRY.histogram("ipdr_ingest_bytes", "Memory held by parsed uploads: the peak while parsing and what stays resident.",
+                                  ("engine", "kind"), buckets=BYTE_BUCKETS)
+
+
+# Stage timings of the request being handled ({stage: seconds}); None outside requests
+_stages = contextvars.ContextVar("ipdr_stages", default=None)
+
+
+def record_stage(name, seconds):
+    """Add `seconds` to stage `name` of the current request, or observe it directly outside one."""
+    timings = _stages.get()
+    if timings is None:
+        STAGE_SECONDS.observe(seconds, stage=name)
+    else:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def record_stages(timings):
+    for name, seconds in timings.items():
+        record_stage(name, seconds)
+
+
+def current_stages():
+    """Copy of the stage timings of the request being handled, so far."""
+    return dict(_stages.get() or {})
+
+
+@contextmanager
+def stage(name):
+    """Time the with-block as processing stage `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+@contextmanager
+def collect_stages():
+    """Gather the stages timed in the with-block into the yielded dict instead of recording them.
+
+    Work done for a request on a pool worker (another thread or process) collects its timings
+    this way and the request merges them with record_stages().
+    """
+    timings = {}
+    token = _stages.set(timings)
+    try:
+        yield timings
+    finally:
+        _stages.reset(token)
+
+
+def server_timing(timings, total=None):
+    """Server-Timing header value for {stage: seconds}, in milliseconds."""
+    parts = [f"{name};dur={1000 * seconds:.1f}" for name, seconds in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={1000 * total:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing HTTP requests and reporting their stages.
+
+    Stages timed before the response starts are sent in a Server-Timing header; every stage of
+    the request, including those timed while a streamed body is produced, is observed into
+    STAGE_SECONDS when the response is complete.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        timings = {}
+        token = _stages.set(timings)
+        status = [500]
+        # Background tasks run after the last body message; the request is timed up to that message
+        finished = [None]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - started).encode("latin-1")))
+                message = dict(message, headers=headers)
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                finished[0] = time.perf_counter()
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            _stages.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUESTS.inc(method=scope["method"], route=route, status=str(status[0]))
+            REQUEST_SECONDS.observe((finished[0] or time.perf_counter()) - started, method=scope["method"], route=route)
+            for name, seconds in timings.items():
+                STAGE_SECONDS.observe(seconds, stage=name)
@@ -1,14 +1,51 @@
 import os
+import threading
 import joblib
 import numpy as np
+from .forest import FlatForest
+from .metrics import stage
+from .predictcache import PREDICTION_CACHE_SIZE, PredictionCache
+
+
+# "sklearn" scores with the loaded estimator; "flat" flattens a tree ensemble into NumPy
+# arrays at load time and scores with app/forest.py (same probabilities, less overhead per call).
+# "flat" compiles its tree walk with numba when installed (pip install "numba>=0.58"), an
+# optional speed-up; without it a NumPy kernel is used
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "sklearn")
+
+
+def flat_cache_path(model_path):
+    """Directory holding the flattened forest of a model pickle, memory-mapped by every worker."""
+    return model_path + ".flat"
+
+
+def prepare_flat_model(model_path):
+    """Flatten the model once and save it next to the pickle, so workers start by mapping the files."""
+    cache = flat_cache_path(model_path)
+    if FlatForest.load(cache, source=model_path) is None:
+        FlatForest.from_sklearn(joblib.load(model_path)).save(cache, source=model_path)
+    return cache
 
 
 class ModelWrapper:
-    def __init__(self, model_path, scaler_path=None, numeric_cols_path=None, le_path=None):
+    def __init__(self, model_path, scaler_path=None, numeric_cols_path=None, le_path=None, backend=None, version=None):
         # Load model and optional artifacts. Paths are expected to be absolute in the container (/app/outputs/...)
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found: {model_path}")
-        self.model = joblib.load(model_path)
+        self.model_path = model_path
+        self._model = None
+        self._model_lock = threading.Lock()
+        # Registry version these artifacts belong to (see registry.py); recorded with every prediction set
+        self.version = version
+
+        self.backend = "sklearn"
+        self.forest = None
+        if (backend or INFERENCE_BACKEND) == "flat":
+            self.forest = self._load_forest()
+            if self.forest is not None:
+                self.backend = "flat"
+        if self.forest is None and self._model is None:
+            self._model = joblib.load(model_path)
 
         self.scaler = None
         if scaler_path and os.path.exists(scaler_path):
@@ -25,40 +62,74 @@ class ModelWrapper:
             except Exception:
                 self.le = None
 
-    def predict(self, df):
-        # Minimal preprocessing: select numeric columns if provided, otherwise infer
-        X = df.copy()
-        
-        if self.numeric_cols:
-            # Check which columns are missing
-            missing_cols = set(self.numeric_cols) - set(X.columns)
-            available_cols = [col for col in self.numeric_cols if col in X.columns]
-            
-            if missing_cols:
-                # Add missing columns with zeros (default value)
-                for col in missing_cols:
-                    X[col] = 0.0
-            
-            # Select columns in the correct order expected by the model
-            X_num = X[self.numeric_cols]
-        else:
-            X_num = X.select_dtypes(include=[np.number])
+        # Predictions of rows already scored by these artifacts (see predictcache.py)
+        self.cache = PredictionCache() if PREDICTION_CACHE_SIZE > 0 else None
 
-        # Ensure we have data
-        if X_num.empty or len(X_num.columns) == 0:
-            raise ValueError("No numeric columns found in the uploaded CSV. "
-                           "Expected columns: " + ", ".join(str(c) for c in self.numeric_cols[:5]) + "...")
+    @property
+    def model(self):
+        # With a memory-mapped forest the estimator is only loaded if an input needs it (non-finite values)
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = joblib.load(self.model_path)
+        return self._model
+
+    def _load_forest(self):
+        cache = flat_cache_path(self.model_path)
+        forest = FlatForest.load(cache, source=self.model_path)
+        if forest is not None:
+            return forest
+        try:
+            forest = FlatForest.from_sklearn(self.model)
+        except ValueError:
+            # Not a tree ensemble we can flatten; keep scoring with the estimator itself
+            return None
+        try:
+            forest.save(cache, source=self.model_path)
+        except OSError:
+            # Read-only artifacts: score from this process's own copy
+            return forest
+        shared = FlatForest.load(cache, source=self.model_path)
+        if shared is None:
+            return forest
+        # Drop the private copies in favour of the mapped files
+        self._model = None
+        return shared
+
+    def _prepare(self, df):
+        """Build the model input matrix: feature selection/ordering followed by the scaler."""
+        with stage("preprocess"):
+            X_num = self._select_features(df)
 
         # If scaler exists, apply it
         if self.scaler is not None:
             try:
-                X_num = self.scaler.transform(X_num)
+                with stage("scale"):
+                    X_num = self.scaler.transform(X_num)
             except Exception as e:
                 # If transform fails, proceed with raw numeric values
                 pass
 
-        preds = self.model.predict(X_num)
+        return X_num
 
+    def _select_features(self, df):
+        # Minimal preprocessing: select numeric columns if provided, otherwise infer
+        if self.numeric_cols:
+            # The model's columns in its order, copied out of the upload; missing ones are zeros
+            X_num = df.reindex(columns=self.numeric_cols, fill_value=0.0)
+            # Features may arrive narrowed to float32 (ingest.py); the scaler always gets float64
+            if (X_num.dtypes != np.float64).any():
+                X_num = X_num.astype(np.float64)
+        else:
+            X_num = df.select_dtypes(include=[np.number])
+
+        # Ensure we have data
+        if X_num.empty or len(X_num.columns) == 0:
+            raise ValueError("No numeric columns found in the uploaded CSV. "
+                           "Expected columns: " + ", ".join(str(c) for c in self.numeric_cols[:5]) + "...")
+        return X_num
+
+    def _decode(self, preds):
         # If label encoder exists, try to invert transform
         try:
             if self.le is not None:
@@ -71,3 +142,45 @@ class ModelWrapper:
             return preds.tolist()
         except Exception:
             return [int(p) if hasattr(p, '__int__') else str(p) for p in preds]
+
+    def _use_forest(self, X_num):
+        # Inputs with NaN/inf go to the estimator so its validation (and errors) apply unchanged
+        return self.forest is not None and np.isfinite(np.asarray(X_num, dtype=np.float64)).all()
+
+    def _predict_proba(self, X_num):
+        if self._use_forest(X_num):
+            return self.forest.predict_proba(X_num)
+        return self.model.predict_proba(X_num)
+
+    def _best(self, X_num):
+        # Index of the most probable class and its probability, per row
+        with stage("predict_proba"):
+            probs = self._predict_proba(X_num)
+        best = probs.argmax(axis=1)
+        return best, probs[np.arange(len(best)), best]
+
+    def predict(self, df):
+        X_num = self._prepare(df)
+        if self._use_forest(X_num):
+            return self._decode(self.forest.predict(X_num))
+        return self._decode(self.model.predict(X_num))
+
+    def predict_with_confidence(self, df):
+        """Return (labels, confidences) from one preprocessing pass and one predict_proba call.
+
+        Labels match predict(): the class with the highest probability, decoded by the label
+        encoder. confidences is that maximum probability per row, or None when the model has no
+        predict_proba. Rows scored before by this model are answered from its prediction cache.
+        """
+        X_num = self._prepare(df)
+        if self.forest is None and not hasattr(self.model, 'predict_proba'):
+            return self._decode(self.model.predict(X_num)), None
+
+        if self.cache is not None and len(X_num):
+            best, confidences = self.cache.score(X_num, self._best)
+        else:
+            best, confidences = self._best(X_num)
+        with stage("decode"):
+            classes = self.forest.classes_ if self.forest is not None else self.model.classes_
+            preds = classes.take(best, axis=0)
+            return self._decode(preds), confidences.tolist()
@@ -0,0 +1,181 @@
+import os
+import threading
+import numpy as np
+from .metrics import PREDICTION_CACHE_ROWS, stage
+
+
+# Model input rows whose prediction is remembered per loaded model (40 bytes each), rounded up
+# to a power of two; 0 turns the cache off
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", str(1 << 18)))
+# Entries per set: a row can be kept in any of the slots of the one set its hash picks
+PREDICTION_CACHE_WAYS = 4
+
+# murmur3's 64-bit finalizer, applied to every value before a row's values are summed
+_MIX = (np.uint64(33), np.uint64(0xff51afd7ed558ccd), np.uint64(0xc4ceb9fe1a85ec53))
+
+
+def _weights(columns):
+    # Two independent odd multipliers per column; fixed, so keys are stable within and across processes
+    rng = np.random.default_rng(0x1DD2)
+    return rng.integers(0, 1 << 63, size=(2, columns), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+def row_keys(X):
+    """Two 64-bit hashes per row of a 2-D float array, of the row's exact values, as an (n, 2) uint64 array.
+
+    Every value's bits are mixed, then summed per row with two sets of column weights, so rows
+    that differ anywhere (including in column order) get different pairs except with
+    probability around 2**-128. Works a column at a time to stay in cache.
+    """
+    X = np.asfortranarray(X, dtype=np.float64)
+    n, columns = X.shape
+    bits = X.view(np.uint64)
+    weights = _weights(columns)
+    shift, m1, m2 = _MIX
+    keys = np.zeros((2, n), dtype=np.uint64)
+    x = np.empty(n, dtype=np.uint64)
+    t = np.empty(n, dtype=np.uint64)
+    for j in range(columns):
+        np.right_shift(bits[:, j], shift, out=x)
+        np.bitwise_xor(x, bits[:, j], out=x)
+        np.multiply(x, m1, out=x)
+        np.right_shift(x, shift, out=t)
+        np.bitwise_xor(x, t, out=x)
+        np.multiply(x, m2, out=x)
+        np.right_shift(x, shift, out=t)
+        np.bitwise_xor(x, t, out=x)
+        for k in range(2):
+            np.multiply(x, weights[k, j], out=t)
+            np.add(keys[k], t, out=keys[k])
+    return keys.T
+
+
+def _groups(values):
+    # Sort order of `values`, and the group (run of equal values) of each position in that order
+    order = np.argsort(values)
+    ordered = values[order]
+    starts = np.empty(len(values), dtype=bool)
+    starts[:1] = True
+    np.not_equal(ordered[1:], ordered[:-1], out=starts[1:])
+    return order, starts
+
+
+def _distinct(keys):
+    # (one row per distinct key pair, position of every row's pair among those rows)
+    order, starts = _groups(keys[:, 0])
+    inverse = np.empty(len(keys), dtype=np.intp)
+    inverse[order] = np.cumsum(starts) - 1
+    first = order[starts]
+    if (keys[first, 1][inverse] != keys[:, 1]).any():
+        # Rows sharing the first hash but not the second
+        pairs = np.ascontiguousarray(keys).view(np.dtype((np.void, 16))).ravel()
+        _, first, inverse = np.unique(pairs, return_index=True, return_inverse=True)
+    return first, inverse.ravel()
+
+
+def _take(X, rows):
+    return X.iloc[rows] if hasattr(X, "iloc") else X[rows]
+
+
+def _ranks(values):
+    # 0, 1, 2... over the elements of each distinct value
+    order, starts = _groups(values)
+    positions = np.arange(len(values))
+    ranks = np.empty(len(values), dtype=np.intp)
+    ranks[order] = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+    return ranks
+
+
+class PredictionCache:
+    """Map from a model input row to its scored class index and confidence, for one loaded model.
+
+    IPDR exports repeat the same feature vectors (idle and keep-alive flows) within and across
+    uploads. score() scores each distinct row once and serves rows seen before from the cache,
+    so they skip the trees. Rows are keyed on two 64-bit hashes of their values (row_keys()).
+
+    The cache is set-associative, like a CPU cache, so lookups and inserts are whole-array
+    NumPy operations: the first hash picks a set of PREDICTION_CACHE_WAYS slots, and a new row
+    replaces the least recently used entry of its set. It belongs to a ModelWrapper, so entries
+    never outlive the model version that produced them. Hits and misses are counted in
+    ipdr_prediction_cache_rows_total (by this process: with INFERENCE_POOL=process the counts
+    stay in the workers).
+    """
+
+    def __init__(self, size=PREDICTION_CACHE_SIZE, ways=PREDICTION_CACHE_WAYS):
+        sets = 1 << (max(1, -(-size // ways)) - 1).bit_length()
+        self.ways = ways
+        self.size = sets * ways
+        self._mask = np.uint64(sets - 1)
+        self._keys = np.zeros((sets, ways, 2), dtype=np.uint64)
+        self._classes = np.zeros((sets, ways), dtype=np.int64)
+        self._confidences = np.zeros((sets, ways), dtype=np.float64)
+        # Tick of each entry's last use; 0 marks an empty slot
+        self._used = np.zeros((sets, ways), dtype=np.uint64)
+        self._tick = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _sets(self, keys):
+        return (keys[:, 0] & self._mask).astype(np.intp)
+
+    def score(self, X, score):
+        """(class index, confidence) arrays for the rows of X (an array or DataFrame of model inputs).
+
+        score(rows) computes them for the rows not cached, given the same kind of object.
+        """
+        n = len(X)
+        with stage("cache"):
+            keys = row_keys(np.asarray(X, dtype=np.float64))
+            first, inverse = _distinct(keys)
+            distinct = keys[first]
+            sets = self._sets(distinct)
+            with self._lock:
+                # Empty slots hold the pair (0, 0), as unlikely for a row as any other pair
+                stored = self._keys[sets]
+                found = (stored[:, :, 0] == distinct[:, None, 0]) & (stored[:, :, 1] == distinct[:, None, 1])
+                hit = found.any(axis=1)
+                hit_sets, hit_ways = sets[hit], found[hit].argmax(axis=1)
+                classes = np.empty(len(first), dtype=np.int64)
+                confidences = np.empty(len(first), dtype=np.float64)
+                classes[hit] = self._classes[hit_sets, hit_ways]
+                confidences[hit] = self._confidences[hit_sets, hit_ways]
+                self._tick += 1
+                self._used[hit_sets, hit_ways] = self._tick
+        missing = np.flatnonzero(~hit)
+        if len(missing):
+            rows = first[missing]
+            if len(rows) == n:
+                # Every row is new: score X as it is and put the results in key order
+                new_classes, new_confidences = (np.asarray(a)[rows] for a in score(X))
+            else:
+                new_classes, new_confidences = (np.asarray(a) for a in score(_take(X, rows)))
+            classes[missing] = new_classes
+            confidences[missing] = new_confidences
+            with stage("cache"):
+                self._add(distinct[missing], new_classes, new_confidences)
+        scored = len(missing)
+        with self._lock:
+            self.hits += n - scored
+            self.misses += scored
+        PREDICTION_CACHE_ROWS.inc(n - scored, result="hit")
+        PREDICTION_CACHE_ROWS.inc(scored, result="miss")
+        return classes[inverse], confidences[inverse]
+
+    def _add(self, keys, classes, confidences):
+        sets = self._sets(keys)
+        # Up to `ways` new rows per set, each in the next least recently used slot of the set
+        ranks = _ranks(sets)
+        keep = ranks < self.ways
+        sets, ranks = sets[keep], ranks[keep]
+        with self._lock:
+            ways = np.argsort(self._used[sets], axis=1, kind="stable")[np.arange(len(sets)), ranks]
+            self._tick += 1
+            self._keys[sets, ways] = keys[keep]
+            self._classes[sets, ways] = classes[keep]
+            self._confidences[sets, ways] = confidences[keep]
+            self._used[sets, ways] = self._tick
+
+    def stats(self):
+        with self._lock:
+            return {"size": self.size, "entries": int(np.count_nonzero(self._used)), "hits": self.hits, "misses": self.misses}
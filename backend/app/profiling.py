@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import hmac
+import time
+import uuid
+import threading
+from urllib.parse import parse_qsl, urlencode
+from starlette.concurrency import run_in_threadpool
+from .metrics import current_stages
+
+
+# Secret that turns profiling on for one request: send it in an X-Profile header or a
+# `profile` query parameter. Also required to list and download profiles. Unset disables both.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# When above 0, every request is sampled and its profile kept if it took at least this long
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Profiles kept on disk; the oldest are removed beyond this
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+PROFILE_TOP = 25
+
+# Leaf frames of threads that are waiting rather than working; their samples are dropped
+_IDLE_FRAMES = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("selectors.py", "select"),
+                ("queue.py", "get"), ("thread.py", "_worker")}
+
+
+def token_matches(value):
+    return bool(PROFILE_TOKEN) and value is not None and hmac.compare_digest(value.encode(), PROFILE_TOKEN.encode())
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Profile:
+    def __init__(self):
+        self.samples = 0
+        self.stacks = {}
+
+    def add(self, stack):
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+
+class Sampler:
+    """Samples the Python stacks of every thread of this process while at least one profile is open.
+
+    A request's work is spread over the event loop, the request threadpool and the inference
+    workers, so the stacks of all threads are recorded: with concurrent requests a profile also
+    shows what the others were doing at the time. Code run in process-pool workers is not seen.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._open = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        profile = _Profile()
+        with self._lock:
+            self._open.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def stop(self, profile):
+        """Close `profile`; waits for a sampling pass in progress, so it is not added to afterwards."""
+        with self._lock:
+            self._open.discard(profile)
+        return profile
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                profiles = list(self._open)
+                if not profiles:
+                    self._thread = None
+                    return
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                stacks.append((names.get(ident, str(ident)),) + tuple(reversed(codes)))
+            # Under the lock, against the profiles still open: stop() cannot return mid-pass
+            with self._lock:
+                for profile in profiles:
+                    if profile not in self._open:
+                        continue
+                    profile.samples += 1
+                    for stack in stacks:
+                        profile.add(stack)
+
+
+def _summary(stacks):
+    # Functions with the most samples on top of the stack (self) and anywhere in it (total)
+    own, total = {}, {}
+    folded = {}
+    for (thread, *codes), count in stacks.items():
+        names = [_frame_name(c) for c in codes]
+        key = ";".join([thread] + names)
+        folded[key] = folded.get(key, 0) + count
+        if names:
+            own[names[-1]] = own.get(names[-1], 0) + count
+        for name in set(names):
+            total[name] = total.get(name, 0) + count
+
+    def top(counts):
+        return sorted(counts.items(), key=lambda item: item[1], reverse=True)[:PROFILE_TOP]
+    return dict(sorted(folded.items(), key=lambda item: item[1], reverse=True)), top(own), top(total)
+
+
+class ProfileStore:
+    """Request profiles saved as JSON files in `directory`, newest PROFILE_KEEP of them."""
+
+    def __init__(self, directory, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def path(self, profile_id):
+        if not profile_id or os.path.basename(profile_id) != profile_id or profile_id.startswith("."):
+            raise ValueError(f"Invalid profile id: {profile_id}")
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def save(self, profile_id, meta, profile):
+        folded, top_self, top_total = _summary(profile.stacks)
+        doc = dict(meta, id=profile_id, samples=profile.samples, top_self=top_self, top_total=top_total, stacks=folded)
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(profile_id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(doc, f)
+        os.replace(tmp, path)
+        self._prune()
+
+    def _prune(self):
+        names = sorted(f for f in os.listdir(self.directory) if f.endswith(".json"))
+        for name in names[:max(0, len(names) - self.keep)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def list(self):
+        """Summaries of the stored profiles, newest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        out = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    doc = json.load(f)
+            except (OSError, ValueError):
+                continue
+            out.append({k: doc.get(k) for k in ("id", "trigger", "method", "path", "status", "duration_ms", "started_at", "samples")})
+        return out
+
+    def load(self, profile_id):
+        """The stored profile, or None."""
+        try:
+            with open(self.path(profile_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def folded_text(doc):
+    """A profile's stacks in the collapsed format read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in doc["stacks"].items())
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that ask for it (PROFILE_TOKEN) or turn out slow (PROFILE_SLOW_MS).
+
+    Requests asking for a profile get its id in an X-Profile-Id response header. Stage timings
+    from metrics.py are stored with each profile.
+    """
+
+    def __init__(self, app, store, sampler=None):
+        self.app = app
+        self.store = store
+        self.sampler = sampler or Sampler()
+
+    def _requested(self, scope):
+        for name, value in scope.get("headers", []):
+            if name == b"x-profile":
+                return token_matches(value.decode("latin-1"))
+        for name, value in parse_qsl(scope.get("query_string", b"").decode("latin-1")):
+            if name == "profile":
+                return token_matches(value)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/profiles"):
+            return await self.app(scope, receive, send)
+        requested = self._requested(scope)
+        if not requested and PROFILE_SLOW_MS <= 0:
+            return await self.app(scope, receive, send)
+
+        slug = scope["path"].strip("/").replace("/", "_") or "root"
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{slug}_{uuid.uuid4().hex[:8]}"
+        status = [500]
+        finished = [None]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if requested:
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())])
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                finished[0] = time.perf_counter()
+            await send(message)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        profile = self.sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.sampler.stop(profile)
+            # Up to the last response byte; the profile itself also covers background tasks run after it
+            elapsed_ms = 1000 * ((finished[0] or time.perf_counter()) - started)
+            if requested or elapsed_ms >= PROFILE_SLOW_MS:
+                query = [(k, v) for k, v in parse_qsl(scope.get("query_string", b"").decode("latin-1")) if k != "profile"]
+                meta = {
+                    "trigger": "request" if requested else "slow",
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": urlencode(query),
+                    "route": getattr(scope.get("route"), "path", None),
+                    "status": status[0],
+                    "started_at": started_at,
+                    "duration_ms": round(elapsed_ms, 1),
+                    "interval_ms": 1000 * self.sampler.interval,
+                    "stages_ms": {k: round(1000 * v, 1) for k, v in current_stages().items()},
+                }
+                try:
+                    await run_in_threadpool(self.store.save, profile_id, meta, profile)
+                except Exception:
+                    # A profile that cannot be saved is lost; the request it covers is not failed
+                    pass
@@ -0,0 +1,266 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+from starlette.concurrency import run_in_threadpool
+from .storage import content_hash
+
+try:
+    import python_multipart as multipart
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart before 0.0.13
+    import multipart
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import parse_options_header
+
+
+# Bytes of a request body gathered before they are hashed and written, off the event loop
+RECEIVE_BLOCK_SIZE = int(os.getenv("RECEIVE_BLOCK_SIZE", str(1 << 20)))
+# Resumable uploads not appended to for this many seconds are removed
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+_SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadError(ValueError):
+    """The request body does not carry an upload."""
+
+
+class UnknownUpload(KeyError):
+    """No resumable upload with this id (never created, completed, discarded or expired)."""
+
+
+class UploadConflict(ValueError):
+    """An append did not start where the resumable upload ends, or another request is using it.
+
+    `offset` is the number of bytes the upload holds: the client resends from there.
+    """
+
+    def __init__(self, offset):
+        super().__init__(f"Upload holds {offset} bytes")
+        self.offset = offset
+
+
+def upload_name():
+    """File name for a new upload: upload_{unix time}_{random hex}.csv, unique within the second too."""
+    return f"upload_{int(time.time())}_{uuid.uuid4().hex[:8]}.csv"
+
+
+class _Sink:
+    # Writes a body to `f` in RECEIVE_BLOCK_SIZE blocks, each hashed into `digest` (when given)
+    # in the same threadpool call that writes it
+    def __init__(self, f, digest=None):
+        self.f = f
+        self.digest = digest
+        self.size = 0
+        self._pending = []
+        self._held = 0
+
+    def add(self, data):
+        self._pending.append(data)
+        self._held += len(data)
+
+    @property
+    def full(self):
+        return self._held >= RECEIVE_BLOCK_SIZE
+
+    async def flush(self):
+        if self._pending:
+            block = b"".join(self._pending)
+            self._pending, self._held = [], 0
+            await run_in_threadpool(self._write, block)
+
+    def _write(self, block):
+        if self.digest is not None:
+            self.digest.update(block)
+        self.f.write(block)
+        self.size += len(block)
+
+
+class _FilePart:
+    # python-multipart callbacks passing the data of the first part named `field` to a _Sink
+    def __init__(self, field, sink):
+        self.field = field.encode()
+        self.sink = sink
+        self.found = False
+        self._writing = False
+        self._header = b""
+        self._value = b""
+        self._disposition = b""
+
+    def callbacks(self):
+        return {"on_part_begin": self.on_part_begin, "on_part_data": self.on_part_data, "on_part_end": self.on_part_end,
+                "on_header_field": self.on_header_field, "on_header_value": self.on_header_value,
+                "on_header_end": self.on_header_end, "on_headers_finished": self.on_headers_finished}
+
+    def on_part_begin(self):
+        self._disposition = b""
+
+    def on_header_field(self, data, start, end):
+        self._header += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        if self._header.lower() == b"content-disposition":
+            self._disposition = self._value
+        self._header, self._value = b"", b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        self._writing = not self.found and options.get(b"name") == self.field
+        self.found = self.found or self._writing
+
+    def on_part_data(self, data, start, end):
+        if self._writing:
+            self.sink.add(data[start:end])
+
+    def on_part_end(self):
+        self._writing = False
+
+
+async def receive_multipart(request, path, field="file"):
+    """Write the `field` part of a multipart/form-data request to `path` while the body arrives.
+
+    Returns the SHA-256 hex digest of the part's bytes, as storage.content_hash() computes it.
+    The body is read once and the file written once: Starlette's form parsing (UploadFile)
+    would spool it to a temporary file first, to be copied from there. Raises UploadError
+    if the body is not multipart or has no such part; `path` is removed on any failure.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise UploadError("Expected a multipart/form-data body")
+    f = open(path, "xb")
+    try:
+        with f:
+            sink = _Sink(f, hashlib.sha256())
+            part = _FilePart(field, sink)
+            parser = multipart.MultipartParser(params[b"boundary"], part.callbacks())
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if sink.full:
+                    await sink.flush()
+            parser.finalize()
+            await sink.flush()
+        if not part.found:
+            raise UploadError(f"No '{field}' part in the upload")
+    except FormParserError as exc:
+        os.remove(path)
+        raise UploadError(f"Malformed multipart body: {exc}") from exc
+    except BaseException:
+        os.remove(path)
+        raise
+    return sink.digest.hexdigest()
+
+
+class UploadSessions:
+    """Resumable uploads: a large file sent as a series of appends, then completed as one upload.
+
+    A session is the part file {id}.part in `directory`. Its size is the offset the next append
+    must start at, so a client whose connection dropped asks for the offset and resumes from
+    there, after a restart or on another worker process too. The SHA-256 of the bytes is
+    carried from append to append within this process; finish() reads the file again only
+    when that chain was broken. Sessions untouched for `ttl` seconds are removed when new
+    ones are created.
+    """
+
+    def __init__(self, directory, ttl=UPLOAD_SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        # id -> (offset, sha256 of the bytes up to it), for sessions appended to in this process
+        self._digests = {}
+        # ids with an append or completion in progress
+        self._busy = set()
+
+    def path(self, upload_id):
+        if not _SESSION_ID.fullmatch(upload_id or ""):
+            raise UnknownUpload(upload_id)
+        return os.path.join(self.directory, f"{upload_id}.part")
+
+    def create(self):
+        """Start a session; returns its id."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._prune()
+        upload_id = uuid.uuid4().hex
+        open(self.path(upload_id), "xb").close()
+        self._digests[upload_id] = (0, hashlib.sha256())
+        return upload_id
+
+    def offset(self, upload_id):
+        """Bytes the session holds. Raises UnknownUpload."""
+        try:
+            return os.path.getsize(self.path(upload_id))
+        except FileNotFoundError:
+            raise UnknownUpload(upload_id) from None
+
+    def _claim(self, upload_id, offset=None):
+        current = self.offset(upload_id)
+        if upload_id in self._busy or (offset is not None and offset != current):
+            raise UploadConflict(current)
+        self._busy.add(upload_id)
+        return current
+
+    async def append(self, upload_id, offset, request):
+        """Append the request's body, which holds the file from byte `offset` on. Returns the new offset.
+
+        Raises UploadConflict unless `offset` is where the session ends. Bytes received before
+        a dropped connection are kept, so the client resends only the rest.
+        """
+        current = self._claim(upload_id, offset)
+        chained = self._digests.pop(upload_id, None)
+        sink = None
+        try:
+            with open(self.path(upload_id), "ab") as f:
+                sink = _Sink(f, chained[1] if chained and chained[0] == current else None)
+                try:
+                    async for chunk in request.stream():
+                        sink.add(chunk)
+                        if sink.full:
+                            await sink.flush()
+                finally:
+                    await sink.flush()
+        finally:
+            self._busy.discard(upload_id)
+            if sink is not None and sink.digest is not None:
+                self._digests[upload_id] = (current + sink.size, sink.digest)
+        return current + sink.size
+
+    async def finish(self, upload_id, path):
+        """End the session, moving its file to `path`. Returns the SHA-256 hex digest of the file."""
+        size = self._claim(upload_id)
+        try:
+            chained = self._digests.pop(upload_id, None)
+            source = self.path(upload_id)
+            if chained and chained[0] == size:
+                digest = chained[1].hexdigest()
+            else:
+                digest = await run_in_threadpool(content_hash, source)
+            os.replace(source, path)
+        finally:
+            self._busy.discard(upload_id)
+        return digest
+
+    def discard(self, upload_id):
+        """Drop the session and the bytes received. Raises UnknownUpload, or UploadConflict while it is in use."""
+        self._claim(upload_id)
+        try:
+            os.remove(self.path(upload_id))
+            self._digests.pop(upload_id, None)
+        finally:
+            self._busy.discard(upload_id)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            upload_id = name[:-len(".part")]
+            if not name.endswith(".part") or upload_id in self._busy:
+                continue
+            try:
+                if os.path.getmtime(os.path.join(self.directory, name)) < cutoff:
+                    os.remove(os.path.join(self.directory, name))
+                    self._digests.pop(upload_id, None)
+            except OSError:
+                pass
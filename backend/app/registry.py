@@ -0,0 +1,267 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .model import ModelWrapper, prepare_flat_model
+
+
+# Artifact set of one model version; a version directory holds these files
+ARTIFACT_FILES = {
+    "model_path": "ipdr_model.pkl",
+    "scaler_path": "ipdr_scaler.pkl",
+    "numeric_cols_path": "ipdr_features.pkl",
+    "le_path": "ipdr_label_encoder.pkl",
+}
+# Name given to the unversioned artifacts directly under outputs/
+DEFAULT_VERSION = "default"
+# Seconds between checks of the ACTIVE pointer, so every worker follows an activation made elsewhere
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "5"))
+
+_VERSION_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+LoadedModel = namedtuple("LoadedModel", ["version", "wrapper", "kwargs", "loaded_at"])
+
+
+class UnknownVersion(KeyError):
+    """No artifact set exists for the requested model version."""
+
+
+def artifact_paths(directory):
+    return {key: os.path.join(directory, name) for key, name in ARTIFACT_FILES.items()}
+
+
+class ModelRegistry:
+    """Versioned model artifact sets with background loading and atomic swap.
+
+    Versions live in `root/{version}/` (default outputs/models/); the unversioned artifacts in
+    outputs/ itself are version "default". `root/ACTIVE` names the version to serve. Requests
+    take the current LoadedModel once and keep using it, so swapping in a new version never
+    affects work already in flight; the old model is freed when the last such request ends.
+    """
+
+    def __init__(self, output_base, root=None, reload_interval=MODEL_RELOAD_INTERVAL):
+        self.output_base = output_base
+        self.root = root or os.getenv("MODEL_REGISTRY_DIR") or os.path.join(output_base, "models")
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._current = None
+        self._loading = None
+        self._last_error = None
+        self._executor = None
+        self._pointer_seen = None
+        self._next_check = 0.0
+
+    @property
+    def pointer_path(self):
+        return os.path.join(self.root, "ACTIVE")
+
+    def _version_dir(self, version):
+        if version == DEFAULT_VERSION:
+            return self.output_base
+        if not _VERSION_RE.match(version or ""):
+            raise UnknownVersion(version)
+        return os.path.join(self.root, version)
+
+    def artifacts(self, version):
+        """ModelWrapper keyword arguments for `version`."""
+        paths = artifact_paths(self._version_dir(version))
+        if not os.path.exists(paths["model_path"]):
+            raise UnknownVersion(version)
+        return dict(paths, version=version)
+
+    def versions(self):
+        found = []
+        if os.path.exists(artifact_paths(self.output_base)["model_path"]):
+            found.append(DEFAULT_VERSION)
+        if os.path.isdir(self.root):
+            for name in sorted(os.listdir(self.root)):
+                if _VERSION_RE.match(name) and os.path.exists(artifact_paths(os.path.join(self.root, name))["model_path"]):
+                    found.append(name)
+        return found
+
+    def _read_pointer(self):
+        try:
+            with open(self.pointer_path, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _write_pointer(self, version):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.pointer_path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(version + "\n")
+        os.replace(tmp, self.pointer_path)
+
+    def active_version(self):
+        """Version named by the ACTIVE pointer, else "default", else the newest registered version."""
+        version = self._read_pointer()
+        if version:
+            return version
+        versions = self.versions()
+        if DEFAULT_VERSION in versions:
+            return DEFAULT_VERSION
+        return versions[-1] if versions else DEFAULT_VERSION
+
+    def _pointer_stamp(self):
+        try:
+            st = os.stat(self.pointer_path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def load_active(self):
+        """Load the active version synchronously (at startup)."""
+        with self._load_lock:
+            self._pointer_seen = self._pointer_stamp()
+            self._load(self.active_version())
+        return self._current
+
+    def _load(self, version):
+        kwargs = self.artifacts(version)
+        wrapper = ModelWrapper(**kwargs)
+        loaded = LoadedModel(version, wrapper, kwargs, time.time())
+        with self._lock:
+            # Rebinding one reference is the whole swap; callers never see a half-loaded model
+            self._current = loaded
+        return loaded
+
+    def current(self):
+        """The LoadedModel to use for a new request. Also notices ACTIVE changes made by other processes."""
+        if self._current is None:
+            # Nothing loaded at startup (the app was used without its startup phase): load now
+            with self._load_lock:
+                if self._current is None:
+                    self._pointer_seen = self._pointer_stamp()
+                    self._load(self.active_version())
+        if self.reload_interval >= 0 and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.reload_interval
+            stamp = self._pointer_stamp()
+            if stamp != self._pointer_seen:
+                self._pointer_seen = stamp
+                version = self._read_pointer()
+                if version and self._current is not None and version != self._current.version:
+                    try:
+                        self.activate(version, persist=False)
+                    except UnknownVersion:
+                        self._last_error = f"ACTIVE names unknown version {version}"
+        return self._current
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+            return self._executor
+
+    def activate(self, version, persist=True):
+        """Load `version` in the background and swap it in when ready. Returns a future of the LoadedModel.
+
+        With persist=True the ACTIVE pointer is updated after the swap, so other workers follow.
+        Raises UnknownVersion right away if the version has no artifacts.
+        """
+        self.artifacts(version)
+        with self._lock:
+            self._loading = version
+
+        def run():
+            try:
+                loaded = self._load(version)
+                if persist:
+                    self._write_pointer(version)
+                    self._pointer_seen = self._pointer_stamp()
+                self._last_error = None
+                return loaded
+            except Exception as exc:
+                # The previous model stays in service
+                self._last_error = f"Loading {version} failed: {exc}"
+                raise
+            finally:
+                with self._lock:
+                    if self._loading == version:
+                        self._loading = None
+        return self._get_executor().submit(run)
+
+    def status(self):
+        current = self._current
+        return {
+            "active": current.version if current else None,
+            "loaded_at": current.loaded_at if current else None,
+            "backend": current.wrapper.backend if current else None,
+            # Rows scored by this process through the serving model's cache (see predictcache.py)
+            "prediction_cache": current.wrapper.cache.stats() if current and current.wrapper.cache is not None else None,
+            "loading": self._loading,
+            "last_error": self._last_error,
+            "versions": self.versions(),
+        }
+
+    def import_version(self, version, source_dir):
+        """Copy an artifact set from `source_dir` into the registry as `version`."""
+        if version == DEFAULT_VERSION or not _VERSION_RE.match(version):
+            raise ValueError(f"Invalid version name: {version}")
+        target = self._version_dir(version)
+        if os.path.exists(target):
+            raise ValueError(f"Version {version} already exists")
+        sources = artifact_paths(source_dir)
+        if not os.path.exists(sources["model_path"]):
+            raise FileNotFoundError(f"No {ARTIFACT_FILES['model_path']} in {source_dir}")
+        tmp = target + ".tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for path in sources.values():
+            if os.path.exists(path):
+                shutil.copy2(path, tmp)
+        os.replace(tmp, target)
+        return target
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    # python -m app.registry list [outputs_dir]
+    # python -m app.registry activate VERSION [outputs_dir]
+    # python -m app.registry import VERSION SOURCE_DIR [outputs_dir]
+    # python -m app.registry prepare [outputs_dir]   (flatten the active model for INFERENCE_BACKEND=flat)
+    usage = "usage: python -m app.registry list|activate VERSION|import VERSION SOURCE_DIR|prepare [outputs_dir]"
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    nargs = {"list": 0, "activate": 1, "import": 2, "prepare": 0}.get(command)
+    if nargs is None or len(sys.argv) < 2 + nargs:
+        print(usage, file=sys.stderr)
+        sys.exit(2)
+    args = sys.argv[2:2 + nargs]
+    extra = sys.argv[2 + nargs:]
+    base = extra[0] if extra else os.getenv("OUTPUT_PATH") or os.path.join(os.path.dirname(__file__), "..", "..", "outputs")
+    registry = ModelRegistry(base)
+    if command == "list":
+        print(json.dumps({"active": registry.active_version(), "versions": registry.versions()}, indent=2))
+    elif command == "activate":
+        # Running workers pick this up within MODEL_RELOAD_INTERVAL seconds
+        try:
+            registry.artifacts(args[0])
+        except UnknownVersion:
+            print(f"unknown version {args[0]}; known: {', '.join(registry.versions())}", file=sys.stderr)
+            sys.exit(1)
+        registry._write_pointer(args[0])
+        print(f"activated {args[0]}")
+    elif command == "prepare":
+        # Run before starting several workers so none of them has to flatten the model itself
+        try:
+            version = registry.active_version()
+            print("prepared", prepare_flat_model(registry.artifacts(version)["model_path"]))
+        except (UnknownVersion, ValueError) as e:
+            print(f"cannot prepare {version}: {e}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        try:
+            print("imported", registry.import_version(args[0], args[1]))
+        except (ValueError, FileNotFoundError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,284 @@
+import os
+import io
+import glob
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from .storage import decode_labels, open_predictions
+
+
+REPORT_TOP_IPS = 10
+REPORT_SAMPLE_ROWS = 10
+# Bars in the confidence chart; the catalog's finer bins are merged down to at most this many
+REPORT_HISTOGRAM_BARS = 20
+# Part of every cache key, so reports laid out by an older version are not served after an upgrade
+REPORT_LAYOUT_VERSION = 1
+# Seconds a superseded report is kept, for downloads already handed its path
+REPORT_GRACE_SECONDS = 60
+
+
+def report_inputs(catalog):
+    """Everything the PDF shows, read from the counters the catalog maintains plus a few sample rows.
+
+    The counters and the catalog `fingerprint` they belong to come from one catalog snapshot.
+    """
+    inputs = catalog.snapshot(REPORT_TOP_IPS)
+    sample = []
+    for entry in inputs.pop("entries"):
+        if len(sample) >= REPORT_SAMPLE_ROWS:
+            break
+        try:
+            preds = open_predictions(catalog.predictions_path(entry))
+            sample.extend(decode_labels(preds.read(stop=REPORT_SAMPLE_ROWS - len(sample))).to_pylist())
+        except Exception:
+            continue
+    return dict(inputs, sample=sample)
+
+
+def _histogram_bars(bins):
+    # Merge the fine [0, 1] bins spanning the observed confidences into at most REPORT_HISTOGRAM_BARS bars
+    occupied = [i for i, count in enumerate(bins) if count]
+    if not occupied:
+        return [], [], 0.0
+    first, last = occupied[0], occupied[-1]
+    step = -(-(last - first + 1) // REPORT_HISTOGRAM_BARS)
+    edges, counts = [], []
+    for start in range(first, last + 1, step):
+        edges.append(start / len(bins))
+        counts.append(sum(bins[start:start + step]))
+    return edges, counts, step / len(bins)
+
+
+def render_pdf(inputs):
+    """The report as PDF bytes."""
+    # The plotting and PDF stacks take longer to import than the rest of the app together and
+    # only this report uses them, so they are imported on its first render
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.utils import ImageReader
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    if not inputs["total"]:
+        # a simple PDF stating no data
+        bio = io.BytesIO()
+        c = canvas.Canvas(bio, pagesize=letter)
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(72, 720, "IPDR Analysis Report")
+        c.setFont("Helvetica", 12)
+        c.drawString(72, 690, "No prediction data available to generate a report.")
+        c.showPage()
+        c.save()
+        return bio.getvalue()
+
+    total = inputs["total"]
+    by_label = inputs["by_label"]
+    by_ip = dict(inputs["top_ips"])
+
+    # Create charts as PNGs in memory
+    images = []
+    try:
+        # Label distribution pie
+        plt.figure(figsize=(6, 4))
+        if len(by_label) == 0:
+            plt.text(0.5, 0.5, 'No labels', ha='center')
+        else:
+            labels = list(by_label.keys())
+            sizes = list(by_label.values())
+            plt.pie(sizes, labels=labels, autopct='%1.1f%%')
+        buf = io.BytesIO()
+        plt.tight_layout()
+        plt.savefig(buf, format='png')
+        plt.close()
+        buf.seek(0)
+        images.append(buf)
+
+        # Top IPs bar
+        if len(by_ip) > 0:
+            plt.figure(figsize=(8, 4))
+            sns.barplot(x=list(by_ip.values()), y=list(by_ip.keys()), palette='viridis')
+            plt.title('Top IPs by prediction count')
+            plt.xlabel('Count')
+            plt.ylabel('IP')
+            buf2 = io.BytesIO()
+            plt.tight_layout()
+            plt.savefig(buf2, format='png')
+            plt.close()
+            buf2.seek(0)
+            images.append(buf2)
+
+        # Confidence histogram if present
+        edges, counts, width = _histogram_bars(inputs["confidence_bins"])
+        if counts:
+            try:
+                plt.figure(figsize=(6, 4))
+                plt.bar(edges, counts, width=width, align='edge')
+                plt.title('Prediction Confidence Distribution')
+                plt.xlabel('Confidence')
+                plt.ylabel('Frequency')
+                buf3 = io.BytesIO()
+                plt.tight_layout()
+                plt.savefig(buf3, format='png')
+                plt.close()
+                buf3.seek(0)
+                images.append(buf3)
+            except Exception:
+                pass
+    except Exception:
+        images = []
+
+    # Compose PDF
+    pdf_buf = io.BytesIO()
+    c = canvas.Canvas(pdf_buf, pagesize=letter)
+    width, height = letter
+
+    # Title
+    c.setFont("Helvetica-Bold", 20)
+    c.drawString(72, height - 72, "IPDR Analysis Report")
+    c.setFont("Helvetica", 10)
+    c.drawString(72, height - 96, f"Generated: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    # Summary box
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(72, height - 128, "Summary")
+    c.setFont("Helvetica", 10)
+    c.drawString(72, height - 144, f"Total records analyzed: {total}")
+    y = height - 162
+    for k, v in by_label.items():
+        c.drawString(88, y, f"{k}: {v}")
+        y -= 14
+
+    # Insert charts
+    y_image = y - 12
+    for img_buf in images:
+        try:
+            img = ImageReader(img_buf)
+            # Draw image with max width 460, height scaled
+            iw, ih = img.getSize()
+            max_w = 460
+            scale = min(max_w / iw, 300 / ih, 1)
+            draw_w = iw * scale
+            draw_h = ih * scale
+            if y_image - draw_h < 72:
+                c.showPage()
+                y_image = height - 72
+            c.drawImage(img, 72, y_image - draw_h, width=draw_w, height=draw_h)
+            y_image = y_image - draw_h - 18
+        except Exception:
+            continue
+
+    # Add a sample table of the first rows
+    try:
+        c.showPage()
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(72, height - 72, f"Sample Predictions (first {REPORT_SAMPLE_ROWS})")
+        c.setFont("Helvetica", 9)
+        sample = inputs["sample"]
+        cols = [col for col in ['row', 'ip', 'timestamp', 'prediction', 'confidence'] if sample and col in sample[0]]
+        x = 72
+        y = height - 96
+        # header
+        for col in cols:
+            c.drawString(x, y, col.upper())
+            x += 120
+        y -= 14
+        for r in sample:
+            x = 72
+            for col in cols:
+                txt = str(r.get(col, ''))[:30]
+                c.drawString(x, y, txt)
+                x += 120
+            y -= 12
+            if y < 72:
+                c.showPage()
+                y = height - 72
+    except Exception:
+        pass
+
+    c.save()
+    return pdf_buf.getvalue()
+
+
+class ReportCache:
+    """Rendered PDF reports, kept on disk and keyed on the catalog fingerprint.
+
+    A report is rendered at most once per set of prediction artifacts: later requests for the
+    same set get the stored file, and concurrent requests share one render. Rendering runs on a
+    single background thread (matplotlib's pyplot is not thread-safe) from the totals the catalog
+    keeps up to date, so it never rereads the prediction sets. The file lives in the uploads
+    directory, so every worker process serves a report rendered by any of them.
+    """
+
+    def __init__(self, catalog, directory):
+        self.catalog = catalog
+        self.directory = directory
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report")
+            return self._executor
+
+    def path(self, key):
+        return os.path.join(self.directory, f"report_{key}.pdf")
+
+    @staticmethod
+    def _key(fingerprint):
+        return f"{REPORT_LAYOUT_VERSION}-{fingerprint}"
+
+    def get(self):
+        """Future of the path of the report for the current prediction set; already done when cached.
+
+        A render reads the catalog again, so an upload registered meanwhile is included: the
+        report is then stored (and the future resolves) under the newer fingerprint.
+        """
+        key = self._key(self.catalog.fingerprint())
+        path = self.path(key)
+        if os.path.exists(path):
+            # Superseded reports left within the grace period of the last render
+            self._prune(path)
+            future = Future()
+            future.set_result(path)
+            return future
+        executor = self._get_executor()
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = executor.submit(self._render, key)
+        return future
+
+    def _render(self, key):
+        try:
+            inputs = report_inputs(self.catalog)
+            data = render_pdf(inputs)
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.path(self._key(inputs["fingerprint"]))
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._prune(path)
+            return path
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _prune(self, current):
+        # Reports other than `current` go once no download can still be about to open them
+        for old in glob.glob(os.path.join(self.directory, "report_*.pdf")):
+            try:
+                if old != current and time.time() - os.path.getmtime(old) > REPORT_GRACE_SECONDS:
+                    os.remove(old)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,123 @@
+import os
+import io
+import numpy as np
+import pandas as pd
+
+
+# One byte offset is kept per ROW_INDEX_STRIDE data rows. Reaching any row costs one seek plus
+# skipping fewer than ROW_INDEX_STRIDE raw lines; the index stays ~8 bytes / stride per row.
+ROW_INDEX_STRIDE = int(os.getenv("ROW_INDEX_STRIDE", "128"))
+
+_BLOCK = 1 << 22
+
+
+def index_path(csv_path):
+    return csv_path + ".rowidx.npz"
+
+
+class RowIndex:
+    """Sidecar byte-offset index over the data rows of a stored CSV.
+
+    offsets[k] is the byte position where data row k * stride starts. Rows are located by
+    raw newlines, so this assumes no quoted field contains a line break (true for IPDR
+    exports). The index records the CSV's size and mtime and is rebuilt when they change.
+    """
+
+    def __init__(self, csv_path, offsets, rows, stride, header_end):
+        self.csv_path = csv_path
+        self.offsets = offsets
+        self.rows = rows
+        self.stride = stride
+        self.header_end = header_end
+
+    @classmethod
+    def build(cls, csv_path, stride=ROW_INDEX_STRIDE):
+        """Scan the CSV once and write its index next to it."""
+        checkpoints = []
+        starts_seen = 0  # newlines so far; newline i starts data row i
+        header_end = None
+        pos = 0
+        last = b""
+        with open(csv_path, 'rb') as f:
+            while True:
+                block = f.read(_BLOCK)
+                if not block:
+                    break
+                starts = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10) + (pos + 1)
+                if header_end is None and len(starts):
+                    header_end = int(starts[0])
+                rows_here = np.arange(starts_seen, starts_seen + len(starts))
+                checkpoints.append(starts[rows_here % stride == 0])
+                starts_seen += len(starts)
+                pos += len(block)
+                last = block[-1:]
+        offsets = np.concatenate(checkpoints).astype(np.int64) if checkpoints else np.empty(0, dtype=np.int64)
+        rows = starts_seen
+        if last == b"\n":
+            # The final newline terminates the last row rather than starting a new one
+            rows -= 1
+            offsets = offsets[offsets < pos]
+        if header_end is None:
+            header_end = pos
+        stat = os.stat(csv_path)
+        meta = np.array([rows, stride, header_end, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        tmp = index_path(csv_path) + ".tmp.npz"
+        np.savez(tmp, offsets=offsets, meta=meta)
+        os.replace(tmp, index_path(csv_path))
+        return cls(csv_path, offsets, rows, stride, header_end)
+
+    @classmethod
+    def load(cls, csv_path):
+        """The stored index if it matches the CSV on disk, else None."""
+        path = index_path(csv_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                offsets = data["offsets"]
+                rows, stride, header_end, size, mtime_ns = (int(v) for v in data["meta"])
+        except Exception:
+            return None
+        stat = os.stat(csv_path)
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+        return cls(csv_path, offsets, rows, stride, header_end)
+
+    @classmethod
+    def open(cls, csv_path):
+        """Load the index, building it on first use."""
+        return cls.load(csv_path) or cls.build(csv_path)
+
+    def read_lines(self, start, count):
+        """Raw bytes of the header line plus data rows [start, start + count)."""
+        return self.read_rows_raw(range(start, min(self.rows, start + count)))
+
+    def read_rows_raw(self, rows):
+        """Raw bytes of the header line plus the given data rows, which must be in ascending order."""
+        lines = []
+        with open(self.csv_path, 'rb') as f:
+            header = f.read(self.header_end)
+            current = None  # data row the file is positioned at
+            for row in rows:
+                row = int(row)
+                if row >= self.rows:
+                    break
+                k = row // self.stride
+                # Seek only when the nearest checkpoint is ahead of where we are
+                if current is None or k * self.stride > current:
+                    f.seek(int(self.offsets[k]))
+                    current = k * self.stride
+                for _ in range(row - current):
+                    f.readline()
+                line = f.readline()
+                current = row + 1
+                lines.append(line if line.endswith(b"\n") else line + b"\n")
+        return header + b"".join(lines)
+
+    def read_page(self, start, count, columns=None, **read_csv_kwargs):
+        """Parse only data rows [start, start + count) into a DataFrame."""
+        return pd.read_csv(io.BytesIO(self.read_lines(start, count)), usecols=columns, **read_csv_kwargs)
+
+    def read_rows(self, rows, columns=None, **read_csv_kwargs):
+        """Parse only the given data rows (ascending) into a DataFrame."""
+        return pd.read_csv(io.BytesIO(self.read_rows_raw(rows)), usecols=columns, **read_csv_kwargs)
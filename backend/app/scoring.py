@@ -0,0 +1,299 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from .ingest import MemoryAccount, iter_csv, read_csv, read_csv_header, record_ingest
+from .metrics import stage
+from .storage import prediction_table, write_predictions
+from .rowindex import RowIndex, index_path as row_index_path
+from .searchindex import SearchIndex, index_path as search_index_path
+from .uploadtable import UploadTable, table_path
+
+
+# Rows scored per chunk in streaming mode. Peak memory grows with this, not with the file size.
+DEFAULT_CHUNK_SIZE = int(os.getenv("PREDICT_CHUNK_SIZE", "50000"))
+
+# Parse plans kept in memory; a feed sends the same few header layouts over and over
+PARSE_PLAN_CACHE = int(os.getenv("PARSE_PLAN_CACHE", "64"))
+
+KEY_COLUMN_CANDIDATES = {
+    "ip": ["ip", "ip_address", "source_ip", "destination_ip", "src_ip", "dst_ip", "ipaddress", "ip address"],
+    "msisdn": ["msisdn", "msisdn_number", "msisdn_no", "msisdnid"],
+    "timestamp": ["timestamp", "time", "date", "ts", "datetime"],
+    "volume": ["data_volume", "volume", "bytes", "data_bytes", "data_volume_bytes"],
+}
+
+
+class UploadParseError(ValueError):
+    """The uploaded file could not be parsed as CSV."""
+
+
+def pick_column(dfcols, candidates):
+    """Heuristic column lookup: exact (case-insensitive) match first, then substring match."""
+    lower = {c.lower(): c for c in dfcols}
+    for cand in candidates:
+        if cand.lower() in lower:
+            return lower[cand.lower()]
+    # try partial matching
+    for k, v in lower.items():
+        for cand in candidates:
+            if cand.lower() in k:
+                return v
+    return None
+
+
+def resolve_key_columns(columns):
+    """Map each key field (ip, msisdn, timestamp, volume) to a column of the upload, or None."""
+    columns = list(columns)
+    return {key: pick_column(columns, cands) for key, cands in KEY_COLUMN_CANDIDATES.items()}
+
+
+def _identifier_dtypes(key_cols):
+    # Identifiers are read as text so chunked and whole-file parsing agree (and '+' prefixes survive)
+    return {key_cols[k]: str for k in ("ip", "msisdn") if key_cols.get(k)}
+
+
+class ParsePlan:
+    """How uploads with one header row are read for one model's features.
+
+    Holds the header's columns, the key columns resolved from them, the model features the
+    header has, and what scoring parses: only the feature and key columns (`usecols`), with
+    features as float64 and IPs and MSISDNs as categoricals (`dtype`; the Arrow ingest engine
+    narrows features to float32 where that is lossless). Without a feature list
+    every column is read, since the numeric ones are picked after parsing. `id_dtypes` are the
+    options for parsing all columns, as the Parquet copy and the search index do.
+    """
+
+    def __init__(self, columns, features=None):
+        self.columns = list(columns)
+        self.key_cols = resolve_key_columns(self.columns)
+        self.id_dtypes = _identifier_dtypes(self.key_cols)
+        present = set(self.columns)
+        self.features = [c for c in features if c in present] if features else None
+        if self.features is None:
+            self.usecols = None
+            self.dtype = dict(self.id_dtypes)
+            return
+        wanted = set(self.features) | {c for c in self.key_cols.values() if c}
+        self.usecols = [c for c in self.columns if c in wanted]
+        # float64, not float32: the scaler works in the input's precision, so narrower values could move scores
+        self.dtype = {c: "float64" for c in self.features}
+        for col in self.id_dtypes:
+            self.dtype.setdefault(col, "category")
+
+
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def _header_line(source):
+    if hasattr(source, 'seek'):
+        line = source.readline()
+        source.seek(0)
+        return line if isinstance(line, bytes) else line.encode('utf-8')
+    with open(source, 'rb') as f:
+        return f.readline()
+
+
+def parse_plan(source, features=None):
+    """The ParsePlan for the header of a CSV path or seekable file object, cached on a hash of the header row."""
+    key = (hashlib.sha1(_header_line(source)).hexdigest(), tuple(features) if features else None)
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            return plan
+    plan = ParsePlan(read_csv_header(source), features)
+    with _plans_lock:
+        _plans[key] = plan
+        while len(_plans) > PARSE_PLAN_CACHE:
+            _plans.popitem(last=False)
+    return plan
+
+
+def read_upload_csv(source, chunk_size=None, plan=None, account=None):
+    """Parse an upload with the ingest engine, with the same options in whole-file and chunked mode.
+
+    Reads the columns and dtypes of `plan` (by default every column, identifiers as text).
+    Returns a DataFrame when chunk_size is None, otherwise yields (chunk, bytes_read) for
+    chunk_size rows at a time (source must then be a path). The memory held is added to
+    `account`, an ingest.MemoryAccount.
+    """
+    plan = plan or parse_plan(source)
+    options = dict(columns=plan.columns, usecols=plan.usecols, dtype=plan.dtype, downcast=plan.features or (), account=account)
+    if chunk_size is None:
+        return read_csv(source, **options)
+    return iter_csv(source, chunk_size, **options)
+
+
+def _upload_chunks(plan, path, chunk_size, account):
+    # (chunk, bytes_read) from the Parquet copy when there is one, else from the CSV text
+    bytes_total = os.path.getsize(path)
+    table = UploadTable.load(path)
+    if table is not None:
+        done = 0
+        for chunk in table.iter_batches(columns=plan.usecols, batch_size=chunk_size):
+            done += len(chunk)
+            yield chunk, bytes_total * done // max(table.rows, 1)
+        return
+    for chunk, bytes_read in read_upload_csv(path, chunk_size=chunk_size, plan=plan, account=account):
+        yield chunk, min(bytes_read, bytes_total)
+
+
+def iter_scored_chunks(wrapper, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Score a stored upload chunk by chunk.
+
+    Yields (offset, table, bytes_read, bytes_total) per chunk, where table is the chunk's
+    prediction_table; only one chunk is held in memory. Once the upload has its Parquet copy,
+    only the model feature and key columns are read.
+    Every row is scored independently, so the concatenated output equals whole-file scoring.
+    """
+    bytes_total = os.path.getsize(path)
+    with stage("columns"):
+        plan = parse_plan(path, wrapper.numeric_cols)
+    offset = 0
+    memory = MemoryAccount()
+    chunks = _upload_chunks(plan, path, chunk_size, memory)
+    while True:
+        with stage("parse"):
+            item = next(chunks, None)
+        if item is None:
+            break
+        chunk, bytes_read = item
+        chunk = chunk.reset_index(drop=True)
+        preds, confidences = wrapper.predict_with_confidence(chunk)
+        with stage("detailed_rows"):
+            table = prediction_table(chunk, preds, confidences, plan.key_cols, offset=offset)
+        yield offset, table, bytes_read, bytes_total
+        offset += len(chunk)
+    if memory.rows:
+        record_ingest(memory.as_dict())
+
+
+def remove_upload(filepath, preds_path=None):
+    """Remove a stored CSV, its Parquet copy and indexes, and its predictions when given, whichever exist."""
+    for path in (filepath, table_path(filepath), row_index_path(filepath), search_index_path(filepath), preds_path):
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+def index_upload(path, frame=None, account=None):
+    """Build what reads of a stored upload go through: its Parquet copy and its search index.
+
+    Returns (reader, search_index), where reader pages through rows (UploadTable, or a RowIndex
+    over the CSV text if the copy cannot be written). Pass `frame` when the CSV is already parsed.
+    The memory the copy's ingest held is recorded, and added to `account` when given.
+    """
+    plan = parse_plan(path)
+    reader = _store_reader(path, plan, frame, account)
+    if frame is None and isinstance(reader, UploadTable):
+        # Read the key columns back from the copy instead of parsing the CSV again
+        frame = reader.read(columns=[c for c in plan.key_cols.values() if c]).to_pandas()
+    return reader, SearchIndex.build(path, plan.key_cols, dtype=plan.id_dtypes, frame=frame)
+
+
+def _store_reader(path, plan, frame=None, account=None):
+    memory = account if account is not None else MemoryAccount()
+    try:
+        reader = UploadTable.convert(path, dtype=plan.id_dtypes, frame=frame, account=memory)
+    except Exception:
+        reader = RowIndex.build(path)
+    else:
+        stale = row_index_path(path)
+        if os.path.exists(stale):
+            os.remove(stale)
+    if memory.rows:
+        record_ingest(memory.as_dict())
+    return reader
+
+
+def store_upload_table(path):
+    """Write the Parquet copy that views and searches of a stored upload read rows from.
+
+    Whole-file scoring parses only the columns the model needs, so the copy of every column is
+    written afterwards (main.py runs this once the response is sent). Until it exists, readers
+    build it themselves through open_upload_reader().
+    """
+    try:
+        with stage("upload_table"):
+            _store_reader(path, parse_plan(path))
+    except OSError:
+        pass
+    # Deleted meanwhile: drop what was just written for it
+    if not os.path.exists(path):
+        for leftover in (table_path(path), row_index_path(path)):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def open_upload_reader(path):
+    """Row reader of a stored upload: its Parquet copy, or the row-offset index of the CSV."""
+    reader = UploadTable.load(path) or RowIndex.load(path)
+    return reader if reader is not None else index_upload(path)[0]
+
+
+def open_upload_indexes(path):
+    """(reader, SearchIndex) of a stored upload, rebuilding them if missing or stale."""
+    reader, search_index = UploadTable.load(path) or RowIndex.load(path), SearchIndex.load(path)
+    if reader is None or search_index is None:
+        return index_upload(path)
+    return reader, search_index
+
+
+def predict_stored_upload(wrapper, spool_path, filepath, preds_path, filename):
+    """Whole-file scoring of a spooled upload. Runs on an inference worker.
+
+    On success the spooled CSV is moved to `filepath`, predictions are written to
+    `preds_path`, and (preds, detailed rows for the response, MemoryAccount.as_dict() of the
+    parse) is returned. Raises UploadParseError if the CSV cannot be read. On any failure
+    nothing is left behind: neither the spooled file nor the stored one and its sidecars.
+    """
+    memory = MemoryAccount()
+    try:
+        with stage("columns"):
+            plan = parse_plan(spool_path, wrapper.numeric_cols)
+        with stage("parse"):
+            df = read_upload_csv(spool_path, plan=plan, account=memory)
+    except Exception as exc:
+        os.remove(spool_path)
+        raise UploadParseError(str(exc))
+
+    try:
+        preds, confidences = wrapper.predict_with_confidence(df)
+    except Exception:
+        os.remove(spool_path)
+        raise
+    os.replace(spool_path, filepath)
+    try:
+        # The search index is built from the key columns already parsed; the Parquet copy of all
+        # columns is left to store_upload_table()
+        with stage("index"):
+            SearchIndex.build(filepath, plan.key_cols, dtype=plan.id_dtypes, frame=df)
+
+        # Connect predictions to the CSV key fields and store them column-wise
+        with stage("detailed_rows"):
+            table = prediction_table(df, preds, confidences, plan.key_cols)
+        with stage("persist"):
+            write_predictions(preds_path, filename, table, model_version=wrapper.version)
+        with stage("detailed_rows"):
+            detailed = table.to_pylist()
+    except Exception:
+        remove_upload(filepath, preds_path)
+        raise
+    return preds, detailed, memory.as_dict()
+
+
+def score_file(wrapper, path, writer, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Score `path` into `writer` in chunks. `progress(rows_scored, bytes_read, bytes_total)` is called per chunk.
+
+    Returns the number of rows scored.
+    """
+    rows = 0
+    for offset, table, bytes_read, bytes_total in iter_scored_chunks(wrapper, path, chunk_size):
+        with stage("persist"):
+            writer.write(table)
+        rows = offset + table.num_rows
+        if progress is not None:
+            progress(rows, bytes_read, bytes_total)
+    return rows
+
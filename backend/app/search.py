@@ -0,0 +1,141 @@
+import os
+import json
+import base64
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .scoring import open_upload_indexes
+
+
+# Threads used to match and read uploads concurrently; index lookups and CSV reads are mostly outside the GIL
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+
+class InvalidCursor(ValueError):
+    """The cursor is malformed or belongs to a different query."""
+
+
+def query_fingerprint(**params):
+    """Short stable hash of the search parameters, used to tie a cursor to its query."""
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def encode_cursor(fingerprint, file, row, total):
+    state = {"q": fingerprint, "f": file, "r": int(row), "t": total}
+    return base64.urlsafe_b64encode(json.dumps(state).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, fingerprint):
+    """(file, row, total) of the last row returned before the cursor."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        file, row, total = state["f"], int(state["r"]), state["t"]
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+    if state.get("q") != fingerprint:
+        raise InvalidCursor("Cursor does not belong to this query")
+    return file, row, total
+
+
+class SearchExecutor:
+    """Runs index searches over many uploads on a thread pool.
+
+    Matching is split in two phases: every upload's matching row numbers are computed from its
+    sidecar index in parallel (cheap, and gives the exact total), then only the rows that land
+    on the requested page are read back from the CSVs, again one upload per worker and one bulk
+    parse per upload. Uploads are visited in name order so positions are stable for cursors.
+    """
+
+    def __init__(self, workers=SEARCH_WORKERS):
+        self.workers = max(1, workers)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="search")
+            return self._executor
+
+    @staticmethod
+    def _match(path, filters):
+        try:
+            row_index, search_index = open_upload_indexes(path)
+            return os.path.basename(path), row_index, search_index, search_index.match(row_index.rows, **filters)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _materialize(part):
+        (_, row_index, search_index, _), rows = part
+        try:
+            return row_index.read_rows(rows, dtype=search_index.text_columns()).to_dict(orient='records')
+        except Exception:
+            return []
+
+    def _match_all(self, paths, filters):
+        hits = self._get_executor().map(lambda p: self._match(p, filters), paths)
+        return [h for h in hits if h is not None]
+
+    def _collect(self, parts):
+        records = []
+        for chunk in self._get_executor().map(self._materialize, parts):
+            records.extend(chunk)
+        return records
+
+    def search(self, paths, filters, start, limit):
+        """Rows [start, start + limit) of the matches across `paths`.
+
+        Returns (records, total, last, more) where total is exact, last is (file, row) of the
+        final record returned (for a cursor) and more says whether matches follow it.
+        """
+        hits = self._match_all(sorted(paths), filters)
+        total = int(sum(len(h[3]) for h in hits))
+        parts = []
+        pos = 0
+        for hit in hits:
+            n = len(hit[3])
+            lo, hi = max(0, start - pos), min(n, start + limit - pos)
+            if lo < hi:
+                parts.append((hit, hit[3][lo:hi]))
+            pos += n
+        last = (parts[-1][0][0], int(parts[-1][1][-1])) if parts else None
+        return self._collect(parts), total, last, start + limit < total
+
+    def search_after(self, paths, filters, file, row, limit):
+        """The next `limit` matches after row `row` of upload `file`, without revisiting earlier uploads.
+
+        Returns (records, last, more) like search().
+        """
+        remaining = [p for p in sorted(paths) if os.path.basename(p) >= file]
+        parts = []
+        needed = limit + 1  # one extra match tells whether another page follows
+        for i in range(0, len(remaining), self.workers):
+            for hit in self._match_all(remaining[i:i + self.workers], filters):
+                rows = hit[3]
+                if hit[0] == file:
+                    rows = rows[np.searchsorted(rows, row, side='right'):]
+                if len(rows):
+                    parts.append((hit, rows[:needed]))
+                    needed -= len(parts[-1][1])
+                if needed <= 0:
+                    break
+            if needed <= 0:
+                break
+        more = needed <= 0
+        if more:
+            # Drop the look-ahead match again
+            hit, rows = parts[-1]
+            parts[-1] = (hit, rows[:-1])
+            if not len(parts[-1][1]):
+                parts.pop()
+        last = (parts[-1][0][0], int(parts[-1][1][-1])) if parts else None
+        return self._collect(parts), last, more
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
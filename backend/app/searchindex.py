@@ -0,0 +1,242 @@
+import os
+import threading
+import ipaddress
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+# Loaded indexes kept in memory per process, so repeated searches do not re-read the sidecars
+SEARCH_INDEX_CACHE = int(os.getenv("SEARCH_INDEX_CACHE", "16"))
+
+TERM_KEYS = ("ip", "msisdn")
+RANGE_KEYS = ("timestamp", "volume")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def index_path(csv_path):
+    return csv_path + ".searchidx.npz"
+
+
+def parse_term(value, allow_cidr=False):
+    """Interpret a search term: 'a*' is a prefix match, 'a.b.c.d/n' a CIDR block (IPs only), anything else exact.
+
+    Returns ('exact', value), ('prefix', prefix) or ('cidr', first, last) with IPv4 addresses as integers.
+    """
+    value = value.strip()
+    if value.endswith('*'):
+        return ("prefix", value[:-1])
+    if allow_cidr and '/' in value:
+        try:
+            net = ipaddress.IPv4Network(value, strict=False)
+        except ValueError:
+            raise ValueError(f"Invalid CIDR block: {value}")
+        return ("cidr", int(net.network_address), int(net.broadcast_address))
+    return ("exact", value)
+
+
+def parse_time_range(date_from=None, date_to=None):
+    """[start, stop) in epoch nanoseconds; a date without a time in date_to includes that whole day."""
+    def parse(value):
+        try:
+            ts = pd.Timestamp(value.strip())
+        except Exception:
+            raise ValueError(f"Invalid date: {value}")
+        if ts.tzinfo is not None:
+            ts = ts.tz_convert(None)
+        return ts
+
+    start = parse(date_from).value if date_from else None
+    stop = None
+    if date_to:
+        ts = parse(date_to)
+        if len(date_to.strip()) <= 10 and ts == ts.normalize():
+            ts += pd.Timedelta(days=1)
+            stop = ts.value
+        else:
+            stop = ts.value + 1
+    return start, stop
+
+
+def _ipv4_numbers(values):
+    # Dotted-quad strings to integers; -1 for anything that is not an IPv4 address
+    octets = pd.Series(values, dtype=object).str.extract(r'^\s*(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})\s*$')
+    octets = octets.apply(pd.to_numeric).to_numpy(dtype=np.float64)
+    valid = ~np.isnan(octets).any(axis=1) & (np.nan_to_num(octets, nan=0) <= 255).all(axis=1)
+    octets = np.nan_to_num(octets, nan=0).astype(np.int64)
+    numbers = ((octets[:, 0] * 256 + octets[:, 1]) * 256 + octets[:, 2]) * 256 + octets[:, 3]
+    return np.where(valid, numbers, -1)
+
+
+def timestamp_values(series):
+    """Timestamps of a column as epoch nanoseconds; unparseable ones become the smallest int64.
+
+    Numbers are taken as epoch seconds. Zone-aware values are converted to UTC; naive ones are
+    taken as they are.
+    """
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        parsed = pd.to_datetime(series, unit='s', errors='coerce', utc=True)
+    else:
+        parsed = pd.to_datetime(series, errors='coerce', utc=True)
+    parsed = parsed.dt.tz_convert(None)
+    values = parsed.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    return np.where(parsed.isna().to_numpy(), np.iinfo(np.int64).min, values)
+
+
+def _gather(starts, rows, ids):
+    # Concatenate rows[starts[i]:starts[i + 1]] for every i in ids without a Python loop
+    lengths = starts[ids + 1] - starts[ids]
+    shift = np.repeat(starts[ids] - (np.cumsum(lengths) - lengths), lengths)
+    return rows[shift + np.arange(int(lengths.sum()))]
+
+
+class SearchIndex:
+    """Secondary indexes over the key columns of a stored CSV, kept next to it in a sidecar file.
+
+    IP and MSISDN get an inverted index: the sorted distinct values, and for each one the data
+    rows holding it, so exact and prefix terms resolve to a contiguous slice found by binary
+    search. IPv4 values are also ordered numerically for CIDR lookups. Timestamp and volume get
+    a sorted (value, row) index for range queries. Row numbers match RowIndex, which reads the
+    matching rows back from the CSV.
+    """
+
+    def __init__(self, csv_path, arrays, key_cols):
+        self.csv_path = csv_path
+        self.arrays = arrays
+        self.key_cols = key_cols
+
+    @classmethod
+    def build(cls, csv_path, key_cols, dtype=None, frame=None):
+        """Index the key columns of the CSV (or of `frame`, its rows already parsed) and write the index next to it."""
+        usecols = [c for c in key_cols.values() if c]
+        if frame is not None:
+            df = frame[usecols]
+        else:
+            df = pd.read_csv(csv_path, usecols=usecols, dtype=dtype, skip_blank_lines=False) if usecols else pd.DataFrame()
+        arrays = {}
+        for key in TERM_KEYS:
+            col = key_cols.get(key)
+            if not col:
+                continue
+            codes, uniques = pd.factorize(df[col].astype("string").str.strip(), sort=True)
+            codes = np.asarray(codes, dtype=np.int64)
+            order = np.argsort(codes, kind='stable')
+            sorted_codes = codes[order]
+            first = np.searchsorted(sorted_codes, 0)
+            values = np.array(list(uniques), dtype=str) if len(uniques) else np.empty(0, dtype='<U1')
+            arrays[f"{key}_values"] = values
+            arrays[f"{key}_starts"] = np.searchsorted(sorted_codes, np.arange(len(uniques) + 1)).astype(np.int64) - first
+            arrays[f"{key}_rows"] = order[first:].astype(np.int64)
+            if key == "ip":
+                numbers = _ipv4_numbers(values)
+                numeric_order = np.argsort(numbers, kind='stable')
+                arrays["ip_numbers"] = numbers[numeric_order]
+                arrays["ip_numeric_order"] = numeric_order.astype(np.int64)
+        for key in RANGE_KEYS:
+            col = key_cols.get(key)
+            if not col:
+                continue
+            if key == "timestamp":
+                values = timestamp_values(df[col])
+                valid = values != np.iinfo(np.int64).min
+            else:
+                values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+                valid = ~np.isnan(values)
+            rows = np.flatnonzero(valid)
+            order = np.argsort(values[rows], kind='stable')
+            arrays[f"{key}_values"] = values[rows][order]
+            arrays[f"{key}_rows"] = rows[order].astype(np.int64)
+        stat = os.stat(csv_path)
+        arrays["meta"] = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        arrays["key_cols"] = np.array([[k, v or ""] for k, v in key_cols.items()], dtype=str)
+        tmp = index_path(csv_path) + ".tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, index_path(csv_path))
+        index = cls(csv_path, arrays, dict(key_cols))
+        _remember(csv_path, stat, index)
+        return index
+
+    @classmethod
+    def load(cls, csv_path):
+        """The stored index if it matches the CSV on disk, else None."""
+        path = index_path(csv_path)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(csv_path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        with _cache_lock:
+            cached = _cache.get(csv_path)
+            if cached is not None and cached[0] == key:
+                _cache.move_to_end(csv_path)
+                return cached[1]
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except Exception:
+            return None
+        if tuple(int(v) for v in arrays["meta"]) != key:
+            return None
+        key_cols = {k: (v or None) for k, v in arrays["key_cols"].tolist()}
+        index = cls(csv_path, arrays, key_cols)
+        _remember(csv_path, stat, index)
+        return index
+
+    def text_columns(self):
+        """read_csv dtype mapping that keeps the identifier columns as text, as at ingest."""
+        return {self.key_cols[k]: str for k in TERM_KEYS if self.key_cols.get(k)}
+
+    def _term_rows(self, key, term):
+        if f"{key}_values" not in self.arrays:
+            return np.empty(0, dtype=np.int64)
+        values, starts, rows = (self.arrays[f"{key}_{name}"] for name in ("values", "starts", "rows"))
+        if term[0] == "cidr":
+            numbers = self.arrays["ip_numbers"]
+            lo, hi = np.searchsorted(numbers, term[1], 'left'), np.searchsorted(numbers, term[2], 'right')
+            return np.sort(_gather(starts, rows, self.arrays["ip_numeric_order"][lo:hi]))
+        lo = np.searchsorted(values, term[1], 'left')
+        if term[0] == "prefix":
+            # Every value with the prefix sorts between it and the prefix followed by the largest code point
+            hi = np.searchsorted(values, term[1] + '\U0010ffff', 'left')
+        else:
+            hi = lo + 1 if lo < len(values) and values[lo] == term[1] else lo
+        return np.sort(rows[starts[lo]:starts[hi]])
+
+    def _range_rows(self, key, start=None, stop=None):
+        if f"{key}_values" not in self.arrays:
+            return np.empty(0, dtype=np.int64)
+        values, rows = self.arrays[f"{key}_values"], self.arrays[f"{key}_rows"]
+        lo = np.searchsorted(values, start, 'left') if start is not None else 0
+        hi = np.searchsorted(values, stop, 'left') if stop is not None else len(values)
+        return np.sort(rows[lo:hi])
+
+    def match(self, n_rows, ip=None, msisdn=None, time_range=None, min_volume=None):
+        """Sorted row numbers satisfying every given filter (terms from parse_term, time_range from parse_time_range).
+
+        A filter on a column this upload does not have matches nothing.
+        """
+        selections = []
+        if ip is not None:
+            selections.append(self._term_rows("ip", ip))
+        if msisdn is not None:
+            selections.append(self._term_rows("msisdn", msisdn))
+        if time_range is not None and time_range != (None, None):
+            selections.append(self._range_rows("timestamp", *time_range))
+        if min_volume is not None:
+            selections.append(self._range_rows("volume", float(min_volume)))
+        if not selections:
+            return np.arange(n_rows, dtype=np.int64)
+        selections.sort(key=len)
+        rows = selections[0]
+        for other in selections[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
+
+
+def _remember(csv_path, stat, index):
+    with _cache_lock:
+        _cache[csv_path] = ((stat.st_size, stat.st_mtime_ns), index)
+        _cache.move_to_end(csv_path)
+        while len(_cache) > SEARCH_INDEX_CACHE:
+            _cache.popitem(last=False)
@@ -0,0 +1,349 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Prediction sets are stored as Parquet: one typed column per field, built straight from the
+# scored DataFrame, so readers can load just the columns and row groups they need.
+PREDICTION_COLUMNS = ['row', 'prediction', 'ip', 'msisdn', 'timestamp', 'volume', 'confidence']
+PREDICTION_ROW_GROUP = int(os.getenv("PREDICTION_ROW_GROUP", "65536"))
+PREDICTION_COMPRESSION = os.getenv("PREDICTION_COMPRESSION", "zstd")
+
+_FIELD_TYPES = {
+    'row': pa.int64(),
+    'ip': pa.string(),
+    'msisdn': pa.string(),
+    'timestamp': pa.string(),
+    'volume': pa.float64(),
+    'confidence': pa.float64(),
+}
+
+
+def predictions_path(uploads_dir, filename):
+    """Artifact path for an uploaded CSV: upload_{ts}.csv -> predictions_{ts}.parquet."""
+    stem = os.path.splitext(filename)[0]
+    if stem.startswith("upload_"):
+        stem = stem[len("upload_"):]
+    return os.path.join(uploads_dir, f"predictions_{stem}.parquet")
+
+
+def content_hash(path):
+    """SHA-256 hex digest of a file's bytes, under which byte-identical uploads are recognised."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _text_array(series):
+    if series is None:
+        return None
+    if not pd.api.types.is_string_dtype(series.dtype):
+        series = series.astype("string")
+    return pa.array(series, type=pa.string(), from_pandas=True)
+
+
+def prediction_table(df, preds, confidences, key_cols, offset=0):
+    """Columnar prediction set for one scored DataFrame; `offset` is the row number of df's first row."""
+    n = len(df)
+
+    def source(key):
+        col = key_cols.get(key)
+        return df[col] if col else None
+
+    volume = source("volume")
+    columns = {
+        'row': pa.array(range(offset, offset + n), type=pa.int64()),
+        'prediction': pa.array(list(preds)).dictionary_encode(),
+        'ip': _text_array(source("ip")),
+        'msisdn': _text_array(source("msisdn")),
+        'timestamp': _text_array(source("timestamp")),
+        'volume': pa.array(pd.to_numeric(volume, errors='coerce'), type=pa.float64(), from_pandas=True) if volume is not None else None,
+        'confidence': pa.array(confidences, type=pa.float64()) if confidences is not None else None,
+    }
+    arrays = [columns[k] if columns[k] is not None else pa.nulls(n, _FIELD_TYPES[k]) for k in PREDICTION_COLUMNS]
+    return pa.Table.from_arrays(arrays, names=PREDICTION_COLUMNS)
+
+
+class PredictionWriter:
+    """Streams prediction tables into a predictions_{ts}.parquet file, one row group per write.
+
+    The file is written under a temporary name and moved into place by close(). With
+    `partial=True` each chunk is also appended to an Arrow IPC stream, so rows already
+    scored can be read back with read_partial() while scoring continues. The upload's file
+    name and the model version that scored it are kept in the file's metadata.
+    """
+
+    def __init__(self, path, filename, partial=False, model_version=None):
+        self.path = path
+        self.filename = filename
+        self.model_version = model_version
+        self.n = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._tmp_path = path + ".tmp"
+        self._writer = None
+        self._spool_path = path + ".part.arrows" if partial else None
+        self._spool = None
+        self._spool_writer = None
+        self._chunk_rows = []
+
+    def write(self, table):
+        if table.num_rows == 0:
+            return
+        with self._lock:
+            if self._writer is None:
+                schema = table.schema.with_metadata(self._metadata())
+                self._writer = pq.ParquetWriter(self._tmp_path, schema, compression=PREDICTION_COMPRESSION)
+            self._writer.write_table(table.replace_schema_metadata(self._writer.schema.metadata), row_group_size=PREDICTION_ROW_GROUP)
+            if self._spool_path is not None:
+                if self._spool_writer is None:
+                    self._spool = pa.OSFile(self._spool_path, 'wb')
+                    self._spool_writer = pa.ipc.new_stream(self._spool, table.schema)
+                self._spool_writer.write_table(table, max_chunksize=table.num_rows)
+                self._spool.flush()
+                self._chunk_rows.append(table.num_rows)
+            self.n += table.num_rows
+
+    def _metadata(self):
+        meta = {b"file": self.filename.encode('utf-8')}
+        if self.model_version:
+            meta[b"model_version"] = str(self.model_version).encode('utf-8')
+        return meta
+
+    def read_partial(self, start, stop):
+        """Detailed rows [start, stop) among those written so far, or None once the writer is closed."""
+        with self._lock:
+            if self.closed:
+                return None
+            stop = min(stop, self.n)
+            if start >= stop or self._spool_writer is None:
+                return []
+            batches = []
+            first_row = None
+            pos = 0
+            with pa.memory_map(self._spool_path) as source:
+                reader = pa.ipc.open_stream(source)
+                # Batches are memory-mapped, so skipping the ones before `start` costs no copying
+                for size in self._chunk_rows:
+                    if pos >= stop:
+                        break
+                    batch = reader.read_next_batch()
+                    if pos + size > start:
+                        batches.append(batch)
+                        if first_row is None:
+                            first_row = pos
+                    pos += size
+                return _slice(pa.Table.from_batches(batches), start - first_row, stop - first_row).to_pylist()
+
+    def close(self):
+        """Finish the file. An empty prediction set still produces a readable (zero-row) file."""
+        with self._lock:
+            if self._writer is None:
+                empty = prediction_table(pd.DataFrame(), [], None, {})
+                self._writer = pq.ParquetWriter(self._tmp_path, empty.schema.with_metadata(self._metadata()),
+                                                compression=PREDICTION_COMPRESSION)
+            self._writer.close()
+            os.replace(self._tmp_path, self.path)
+            self._discard_spool()
+
+    def abort(self):
+        """Drop what was written. Does nothing once the writer is closed (or already aborted)."""
+        with self._lock:
+            if self.closed:
+                return
+            if self._writer is not None:
+                self._writer.close()
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+            self._discard_spool()
+
+    def _discard_spool(self):
+        self.closed = True
+        if self._spool_writer is not None:
+            self._spool_writer.close()
+            self._spool.close()
+        if self._spool_path and os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
+
+
+def decode_labels(table):
+    """Replace dictionary-encoded columns by their plain values (row groups carry separate dictionaries)."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+    return table
+
+
+def write_predictions(path, filename, table, model_version=None):
+    """Write a whole prediction set in one go."""
+    writer = PredictionWriter(path, filename, model_version=model_version)
+    try:
+        writer.write(table)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def _slice(table, start, stop):
+    start = max(0, start)
+    return table.slice(start, max(0, min(stop, table.num_rows) - start))
+
+
+def _value_counts(column):
+    counts = {}
+    for item in column.value_counts().to_pylist():
+        if item['values'] is not None:
+            counts[item['values']] = counts.get(item['values'], 0) + item['counts']
+    return counts
+
+
+class ParquetPredictions:
+    """Read access to a stored prediction set that only touches the requested columns and row groups."""
+
+    def __init__(self, path):
+        self.path = path
+        self._pf = pq.ParquetFile(path)
+        meta = self._pf.schema_arrow.metadata or {}
+        self.file = meta.get(b"file", b"").decode('utf-8') or None
+        self.model_version = meta.get(b"model_version", b"").decode('utf-8') or None
+        self.num_rows = self._pf.metadata.num_rows
+
+    def read(self, columns=None, start=0, stop=None):
+        stop = self.num_rows if stop is None else min(stop, self.num_rows)
+        columns = list(columns) if columns is not None else PREDICTION_COLUMNS
+        groups = []
+        first_row = None
+        pos = 0
+        for i in range(self._pf.num_row_groups):
+            size = self._pf.metadata.row_group(i).num_rows
+            if pos < stop and pos + size > start:
+                groups.append(i)
+                if first_row is None:
+                    first_row = pos
+            pos += size
+        if not groups:
+            return self._pf.schema_arrow.empty_table().select(columns)
+        table = self._pf.read_row_groups(groups, columns=columns)
+        return _slice(table, start - first_row, stop - first_row)
+
+    def iter_batches(self, columns=None, batch_size=PREDICTION_ROW_GROUP):
+        columns = list(columns) if columns is not None else PREDICTION_COLUMNS
+        for batch in self._pf.iter_batches(batch_size=batch_size, columns=columns):
+            yield pa.Table.from_batches([batch])
+
+    def _labels_column(self):
+        return decode_labels(self.read(['prediction']))['prediction']
+
+    def labels(self):
+        return self._labels_column().to_pylist()
+
+    def label_counts(self):
+        return _value_counts(self._labels_column())
+
+    def ip_counts(self):
+        """Rows per IP value; rows without an IP are left out."""
+        return _value_counts(self.read(['ip'])['ip'])
+
+    def confidence_histogram(self, bins):
+        """Row counts of the confidences in `bins` equal-width bins over [0, 1]."""
+        values = self.read(['confidence'])['confidence'].to_numpy(zero_copy_only=False).astype(np.float64)
+        values = values[~np.isnan(values)]
+        return np.histogram(np.clip(values, 0.0, 1.0), bins=bins, range=(0.0, 1.0))[0].tolist()
+
+
+class LegacyJsonPredictions(ParquetPredictions):
+    """Read-only view of a pre-Parquet predictions_{ts}.json blob with the same interface."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.file = data.get('file')
+        self.model_version = None
+        detailed = data.get('detailed') or [{'row': i, 'prediction': p} for i, p in enumerate(data.get('predictions', []))]
+        df = pd.DataFrame(detailed, columns=PREDICTION_COLUMNS)
+        confidences = pd.to_numeric(df['confidence'], errors='coerce')
+        self._table = prediction_table(df, df['prediction'].tolist(), confidences.tolist() if confidences.notna().any() else None,
+                                       {k: k for k in ('ip', 'msisdn', 'timestamp', 'volume')})
+        self.num_rows = self._table.num_rows
+
+    def read(self, columns=None, start=0, stop=None):
+        table = self._table.select(list(columns) if columns is not None else PREDICTION_COLUMNS)
+        return _slice(table, start, self.num_rows if stop is None else stop)
+
+    def iter_batches(self, columns=None, batch_size=PREDICTION_ROW_GROUP):
+        table = self.read(columns)
+        for start in range(0, table.num_rows, batch_size):
+            yield table.slice(start, batch_size)
+
+
+def list_prediction_files(uploads_dir):
+    """Stored prediction artifacts, preferring Parquet over a legacy JSON blob with the same stem."""
+    if not os.path.exists(uploads_dir):
+        return []
+    names = set(os.listdir(uploads_dir))
+    out = []
+    for name in sorted(names):
+        if not name.startswith('predictions_'):
+            continue
+        if name.endswith('.parquet'):
+            out.append(os.path.join(uploads_dir, name))
+        elif name.endswith('.json') and name[:-len('.json')] + '.parquet' not in names:
+            out.append(os.path.join(uploads_dir, name))
+    return out
+
+
+def open_predictions(path):
+    if path.endswith('.json'):
+        return LegacyJsonPredictions(path)
+    return ParquetPredictions(path)
+
+
+def find_predictions(uploads_dir, filename):
+    """Locate the prediction set of an uploaded CSV, or None."""
+    path = predictions_path(uploads_dir, filename)
+    if os.path.exists(path):
+        return open_predictions(path)
+    for candidate in list_prediction_files(uploads_dir):
+        try:
+            preds = open_predictions(candidate)
+        except Exception:
+            continue
+        if preds.file == filename:
+            return preds
+    return None
+
+
+def migrate_legacy(uploads_dir, remove=False):
+    """Convert every legacy predictions_{ts}.json in uploads_dir to Parquet. Returns the converted paths."""
+    converted = []
+    for path in list_prediction_files(uploads_dir):
+        if not path.endswith('.json'):
+            continue
+        legacy = LegacyJsonPredictions(path)
+        target = path[:-len('.json')] + '.parquet'
+        write_predictions(target, legacy.file or "", legacy.read())
+        if remove:
+            os.remove(path)
+        converted.append(target)
+    return converted
+
+
+if __name__ == '__main__':
+    # python -m app.storage migrate [uploads_dir] [--remove]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("usage: python -m app.storage migrate [uploads_dir] [--remove]", file=sys.stderr)
+        sys.exit(2)
+    args = [a for a in sys.argv[2:] if not a.startswith('--')]
+    target_dir = args[0] if args else os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
+    for p in migrate_legacy(target_dir, remove='--remove' in sys.argv):
+        print("converted", p)
@@ -0,0 +1,165 @@
+import os
+import threading
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .ingest import INGEST_ENGINE, TypeDrift, iter_csv_tables
+
+
+# Layout of the columnar copy kept for every upload; readers decode whole row groups.
+UPLOAD_ROW_GROUP = int(os.getenv("UPLOAD_ROW_GROUP", "65536"))
+UPLOAD_COMPRESSION = os.getenv("UPLOAD_COMPRESSION", "zstd")
+
+
+def table_path(csv_path):
+    """upload_{ts}.csv -> upload_{ts}.parquet"""
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+class _SchemaDrift(Exception):
+    def __init__(self, column, dtype):
+        super().__init__(column)
+        self.column = column
+        self.dtype = dtype
+
+
+def _widen(table, schema):
+    """Cast a chunk to the file schema, or raise _SchemaDrift naming the first column that does not fit."""
+    table = table.replace_schema_metadata(None)
+    try:
+        return table.cast(schema.remove_metadata())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, ValueError):
+        pass
+    for field in schema:
+        try:
+            table.column(field.name).cast(field.type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            other = table.schema.field(field.name).type
+            numeric = all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in (field.type, other))
+            raise _SchemaDrift(field.name, "float64" if numeric else str)
+    raise _SchemaDrift(None, None)
+
+
+class UploadTable:
+    """Parquet copy of an uploaded CSV, written at ingest next to the original.
+
+    The CSV is parsed by the ingest engine with identifiers kept as text, so rows match what
+    the model saw. Readers load only the columns and row groups they need; the raw CSV is kept
+    untouched for download. The copy records the size and mtime of its CSV and is ignored
+    once they change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pf = pq.ParquetFile(path)
+        self.rows = self._pf.metadata.num_rows
+        self.columns = self._pf.schema_arrow.names
+        sizes = [self._pf.metadata.row_group(i).num_rows for i in range(self._pf.num_row_groups)]
+        self._group_starts = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+    @classmethod
+    def convert(cls, csv_path, dtype=None, frame=None, account=None):
+        """Write the Parquet copy of a stored CSV (from `frame` when it is already parsed).
+
+        The memory held while parsing is added to `account`, an ingest.MemoryAccount.
+        """
+        dtype = dict(dtype or {})
+        engine = None
+        while True:
+            if frame is not None:
+                tables = [pa.Table.from_pandas(frame, preserve_index=False)]
+            else:
+                tables = iter_csv_tables(csv_path, UPLOAD_ROW_GROUP, dtype=dtype, engine=engine, account=account)
+            try:
+                return cls._write(csv_path, tables)
+            except (_SchemaDrift, TypeDrift) as drift:
+                if drift.column is None or drift.column in dtype and dtype[drift.column] == drift.dtype:
+                    raise ValueError(f"Cannot store {os.path.basename(csv_path)} as Parquet")
+                # A later chunk did not fit the types inferred from the first one: widen that column and start over
+                dtype[drift.column] = drift.dtype
+            except pa.ArrowInvalid:
+                if frame is not None or (engine or INGEST_ENGINE) == "pandas":
+                    raise
+                # Rows Arrow's reader rejects (ragged ones) are left to pandas
+                engine = "pandas"
+            if account is not None:
+                account.rows = 0
+
+    @classmethod
+    def _write(cls, csv_path, tables):
+        path = table_path(csv_path)
+        # Per writer: a read can build the copy while ingest is still writing it
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        stat = os.stat(csv_path)
+        metadata = {b"source_size": str(stat.st_size).encode(), b"source_mtime_ns": str(stat.st_mtime_ns).encode()}
+        writer = None
+        try:
+            for table in tables:
+                if writer is None:
+                    schema = table.schema.remove_metadata().with_metadata(metadata)
+                    writer = pq.ParquetWriter(tmp, schema, compression=UPLOAD_COMPRESSION)
+                else:
+                    table = _widen(table, writer.schema)
+                writer.write_table(table.replace_schema_metadata(metadata), row_group_size=UPLOAD_ROW_GROUP)
+            if writer is None:
+                raise ValueError("empty upload")
+            writer.close()
+            writer = None
+            os.replace(tmp, path)
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return cls(path)
+
+    @classmethod
+    def load(cls, csv_path):
+        """The Parquet copy if it matches the CSV on disk, else None."""
+        path = table_path(csv_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            table = cls(path)
+            meta = table._pf.schema_arrow.metadata or {}
+            source = (int(meta[b"source_size"]), int(meta[b"source_mtime_ns"]))
+        except Exception:
+            return None
+        stat = os.stat(csv_path)
+        return table if source == (stat.st_size, stat.st_mtime_ns) else None
+
+    def read(self, columns=None, start=0, stop=None):
+        """Rows [start, stop) of the given columns as an Arrow table; only overlapping row groups are decoded."""
+        stop = self.rows if stop is None else min(stop, self.rows)
+        if start >= stop:
+            return self._pf.schema_arrow.empty_table().select(columns or self.columns)
+        first = int(np.searchsorted(self._group_starts, start, side='right')) - 1
+        last = int(np.searchsorted(self._group_starts, stop, side='left'))
+        table = self._pf.read_row_groups(list(range(first, last)), columns=columns)
+        return table.slice(start - self._group_starts[first], stop - start)
+
+    def take(self, rows, columns=None):
+        """The given rows (ascending) as an Arrow table, decoding only the row groups that hold them."""
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[rows < self.rows]
+        if not len(rows):
+            return self._pf.schema_arrow.empty_table().select(columns or self.columns)
+        group_of = np.searchsorted(self._group_starts, rows, side='right') - 1
+        groups = np.unique(group_of)
+        sizes = self._group_starts[groups + 1] - self._group_starts[groups]
+        # Position of each selected group inside the concatenation of the groups read
+        base = np.cumsum(sizes) - sizes
+        local = rows - self._group_starts[group_of] + base[np.searchsorted(groups, group_of)]
+        return self._pf.read_row_groups(groups.tolist(), columns=columns).take(pa.array(local))
+
+    def iter_batches(self, columns=None, batch_size=UPLOAD_ROW_GROUP):
+        for batch in self._pf.iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+
+    def read_page(self, start, count, columns=None):
+        """Rows [start, start + count) as a DataFrame."""
+        return self.read(columns, start, start + count).to_pandas()
+
+    def read_rows(self, rows, columns=None, dtype=None):
+        """The given rows (ascending) as a DataFrame. Column types were fixed at conversion, so `dtype` is unused."""
+        return self.take(rows, columns).to_pandas()
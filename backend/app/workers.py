@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .metrics import collect_stages, record_stage, record_stages
+
+
+# Pool configuration. INFERENCE_POOL is "thread" (shares the loaded model) or "process"
+# (each worker loads the model itself, mapping the shared forest files with INFERENCE_BACKEND=flat;
+# sidesteps the GIL for pandas parsing).
+INFERENCE_POOL = os.getenv("INFERENCE_POOL", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Uploads allowed to wait for a free worker. Beyond workers + queue size, new uploads are refused.
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "8"))
+# Seconds an upload may wait for admission when the queue is full; 0 rejects immediately.
+INFERENCE_ADMISSION_TIMEOUT = float(os.getenv("INFERENCE_ADMISSION_TIMEOUT", "0"))
+
+
+class PoolSaturated(Exception):
+    """Raised when the inference pool and its queue are full."""
+
+
+# Model used by tasks inside process-pool workers: loaded by _init_process_worker and
+# replaced when a task arrives for a different model version
+_process_wrapper = None
+
+
+def _init_process_worker(model_kwargs):
+    _worker_model(model_kwargs)
+
+
+def _worker_model(model_kwargs):
+    global _process_wrapper
+    if _process_wrapper is None or _process_wrapper.version != model_kwargs.get("version"):
+        from .model import ModelWrapper
+        _process_wrapper = None
+        _process_wrapper = ModelWrapper(**model_kwargs)
+    return _process_wrapper
+
+
+def _run_task(fn, wrapper, model_kwargs, args):
+    # Executed on the worker; reports its own start time so queue wait can be measured, and the
+    # stages it timed, which the submitting request records (they would be lost in a process worker)
+    started = time.time()
+    with collect_stages() as stages:
+        result = fn(wrapper if wrapper is not None else _worker_model(model_kwargs), *args)
+    return started, stages, result
+
+
+class InferencePool:
+    """Bounded worker pool for CPU-bound scoring with explicit admission control.
+
+    At most `workers` tasks run at once and at most `queue_size` more wait for a
+    worker. Anything beyond that raises PoolSaturated (after waiting up to
+    `admission_timeout` seconds for a slot), so heavy uploads cannot pile up behind
+    each other and starve the rest of the API.
+
+    Streaming responses score chunk by chunk on the request's threadpool thread instead, so
+    they are admitted through hold() against slots of their own: at most `workers` streams
+    score at once, whatever the executor is doing, and none waits in the queue.
+    """
+
+    def __init__(self, models, kind=INFERENCE_POOL, workers=INFERENCE_WORKERS,
+                 queue_size=INFERENCE_QUEUE_SIZE, admission_timeout=INFERENCE_ADMISSION_TIMEOUT):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown inference pool kind: {kind}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.admission_timeout = admission_timeout
+        # Source of the model to score with (a ModelRegistry); read once per task
+        self.models = models
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._stream_slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._streaming = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._wait_last = 0.0
+        self._waits = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_process_worker,
+                                                         initargs=(self.models.current().kwargs,))
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+            return self._executor
+
+    async def _admit(self, stream=False):
+        slots = self._stream_slots if stream else self._slots
+        deadline = time.monotonic() + self.admission_timeout
+        while not slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                with self._lock:
+                    self._rejected += 1
+                if stream:
+                    raise PoolSaturated(f"Inference pool saturated ({self.workers} streams running)")
+                raise PoolSaturated(f"Inference pool saturated ({self.workers} running, {self.queue_size} queued)")
+            await asyncio.sleep(0.05)
+        with self._lock:
+            if stream:
+                self._streaming += 1
+            else:
+                self._in_flight += 1
+
+    def _release(self, ok=True, stream=False):
+        with self._lock:
+            if stream:
+                self._streaming -= 1
+            else:
+                self._in_flight -= 1
+            if ok:
+                self._completed += 1
+            else:
+                self._failed += 1
+        (self._stream_slots if stream else self._slots).release()
+
+    def _record_wait(self, seconds):
+        with self._lock:
+            self._waits += 1
+            self._wait_total += seconds
+            self._wait_last = seconds
+            self._wait_max = max(self._wait_max, seconds)
+
+    async def run(self, fn, *args):
+        """Run fn(wrapper, *args) on a worker with the current model. In process mode fn and args must be picklable."""
+        await self._admit()
+        ok = False
+        try:
+            submitted = time.time()
+            # Process workers hold their own copy of the model, reloading it when the version changes;
+            # threads share the loaded one
+            model = self.models.current()
+            wrapper = model.wrapper if self.kind == "thread" else None
+            future = self._get_executor().submit(_run_task, fn, wrapper, model.kwargs, args)
+            started, stages, result = await asyncio.wrap_future(future)
+            self._record_wait(max(0.0, started - submitted))
+            record_stage("queue", max(0.0, started - submitted))
+            record_stages(stages)
+            ok = True
+            return result
+        finally:
+            self._release(ok)
+
+    async def hold(self):
+        """Admit a streaming response, which scores outside the executor, against the stream slots.
+
+        Returns a release callable that must be called exactly once when the work is done.
+        """
+        await self._admit(stream=True)
+        self._record_wait(0.0)
+        released = []
+
+        def release(ok=True):
+            if not released:
+                released.append(True)
+                self._release(ok, stream=True)
+        return release
+
+    def stats(self):
+        with self._lock:
+            running = min(self._in_flight, self.workers)
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": running,
+                "queued": self._in_flight - running,
+                "streaming": self._streaming,
+                "stream_slots": self.workers,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "wait_ms_avg": round(1000 * self._wait_total / self._waits, 2) if self._waits else 0.0,
+                "wait_ms_max": round(1000 * self._wait_max, 2),
+                "wait_ms_last": round(1000 * self._wait_last, 2),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
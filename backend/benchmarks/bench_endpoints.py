@@ -0,0 +1,285 @@
+"""Throughput, latency percentiles and peak memory of the API endpoints at several upload sizes.
+
+    python benchmarks/bench_endpoints.py [--rows 100k,1M] [--requests 20] [--mix Benign=0.8,DDoS=0.2]
+                                         [--data-dir DIR] [--json OUT] [--compare BASELINE]
+
+Run from the backend directory (with OUTPUT_PATH set if the model is not in ../outputs). The app
+runs in this process behind FastAPI's TestClient, against a scratch uploads directory, so nothing
+in ../uploads is touched. For each size a synthetic upload (gen_ipdr.py, cached in --data-dir) is
+scored through /predict-file, sent again (answered from the stored predictions) and scored once
+more through /predict-file?stream=true&reuse=false (its rows now come from the prediction
+cache) and through a resumable upload (/uploads, in 8 MiB pieces); then /data/view, /ml/results, /search, the report endpoints and /data/delete are timed
+against it.
+
+Per endpoint the suite prints requests, p50/p95/p99 latency, throughput (rows/s where the
+request handles the whole upload, requests/s otherwise) and peak memory: the highest resident
+set size sampled while the requests ran, above what it was when they started (Linux only; with
+INFERENCE_POOL=process the scoring workers' memory is not included). --json saves the results
+with the commit they were measured on; --compare prints them against such a file.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+from gen_ipdr import DEFAULT_MIX, generate, model_features, parse_mix, parse_rows  # noqa: E402
+
+# Bytes per PATCH of the resumable upload
+RESUMABLE_PIECE = 8 << 20
+
+
+class PeakMemory:
+    """Samples this process's resident set size on a background thread while in the with-block."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak_mb = None
+
+    @staticmethod
+    def rss_mb():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+        except (OSError, ValueError):
+            return None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, self.rss_mb())
+
+    def __enter__(self):
+        self._start = self.rss_mb()
+        if self._start is not None:
+            self._peak = self._start
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_mb = max(self._peak, self.rss_mb()) - self._start
+
+
+def summarize(endpoint, rows, latencies, handled_rows, peak_mb):
+    ms = 1000 * np.asarray(latencies)
+    elapsed = float(np.sum(latencies))
+    return {
+        "rows": rows,
+        "endpoint": endpoint,
+        "requests": len(latencies),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+        "throughput": round((handled_rows or len(latencies)) / elapsed, 1),
+        "unit": "rows/s" if handled_rows else "req/s",
+        "peak_mb": None if peak_mb is None else round(peak_mb, 1),
+    }
+
+
+def timed(call, repeat):
+    # Runs call(i) `repeat` times; returns the latencies and the peak memory above the start
+    latencies = []
+    with PeakMemory() as memory:
+        for i in range(repeat):
+            started = time.perf_counter()
+            call(i)
+            latencies.append(time.perf_counter() - started)
+    return latencies, memory.peak_mb
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url} -> {response.status_code}: {response.text[:200]}")
+    return response
+
+
+def dataset(data_dir, rows, mix, seed):
+    key = zlib.crc32(json.dumps(mix, sort_keys=True).encode())
+    path = os.path.join(data_dir, f"ipdr_{rows}_s{seed}_{key:08x}.csv")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        generate(path, rows, mix=mix, features=model_features(), seed=seed)
+        print(f"generated {rows:,} rows in {time.perf_counter() - started:.1f} s -> {path}", file=sys.stderr)
+    return path
+
+
+def bench_size(client, path, rows, repeat):
+    results = []
+
+    def record(endpoint, call, times=repeat, handled_rows=0):
+        latencies, peak = timed(call, times)
+        results.append(summarize(endpoint, rows, latencies, handled_rows, peak))
+        print(format_row(results[-1]), flush=True)
+
+    uploaded = {}
+
+    def upload(_):
+        with open(path, "rb") as f:
+            body = check(client.post("/predict-file", files={"file": ("bench.csv", f, "text/csv")})).json()
+        uploaded["plain"] = body["file"]
+
+    def upload_again(_):
+        with open(path, "rb") as f:
+            body = check(client.post("/predict-file", files={"file": ("bench.csv", f, "text/csv")})).json()
+        if not body["deduplicated"]:
+            raise RuntimeError("identical upload was scored again")
+
+    def upload_stream(_):
+        with open(path, "rb") as f, client.stream("POST", "/predict-file?stream=true&reuse=false", files={"file": ("bench.csv", f, "text/csv")}) as r:
+            check(r)
+            events = [json.loads(line) for line in r.iter_lines() if line]
+        if events[-1]["event"] != "done":
+            raise RuntimeError(f"streamed upload failed: {events[-1]}")
+        uploaded["stream"] = events[-1]["file"]
+
+    def upload_resumable(_):
+        upload_id = check(client.post("/uploads")).json()["upload_id"]
+        offset = 0
+        with open(path, "rb") as f:
+            for piece in iter(lambda: f.read(RESUMABLE_PIECE), b""):
+                offset = check(client.patch(f"/uploads/{upload_id}", content=piece, headers={"Upload-Offset": str(offset)})).json()["offset"]
+        with client.stream("POST", f"/uploads/{upload_id}/complete?stream=true&reuse=false") as r:
+            check(r)
+            events = [json.loads(line) for line in r.iter_lines() if line]
+        if events[-1]["event"] != "done":
+            raise RuntimeError(f"resumable upload failed: {events[-1]}")
+        uploaded["resumable"] = events[-1]["file"]
+
+    record("POST /predict-file", upload, 1, rows)
+    record("POST /predict-file (duplicate)", upload_again, 1, rows)
+    record("POST /predict-file?stream=true", upload_stream, 1, rows)
+    record("POST /uploads (resumable)", upload_resumable, 1, rows)
+    name = uploaded["plain"]
+
+    rng = random.Random(0)
+    pages = max(1, rows // 50)
+    record("GET /data/view", lambda i: check(client.get("/data/view", params={"file": name, "page": rng.randrange(pages), "page_size": 50})))
+    record("GET /ml/results", lambda i: check(client.get("/ml/results", params={"file": name, "page": rng.randrange(pages), "page_size": 50})))
+
+    sample = check(client.get("/data/view", params={"file": name, "page": 0, "page_size": 200})).json()["rows"]
+    ips = [r["ip"] for r in sample]
+    msisdns = [str(r["msisdn"]) for r in sample]
+    first = sample[0]["timestamp"][:13]
+    record("GET /search ip", lambda i: check(client.get("/search", params={"file": name, "ip": ips[i % len(ips)]})))
+    record("GET /search ip prefix", lambda i: check(client.get("/search", params={"file": name, "ip": ips[i % len(ips)].rsplit(".", 1)[0] + ".*"})))
+    record("GET /search msisdn", lambda i: check(client.get("/search", params={"file": name, "msisdn": msisdns[i % len(msisdns)]})))
+    record("GET /search date range", lambda i: check(client.get("/search", params={"file": name, "date_from": f"{first}:00:00", "date_to": f"{first}:59:59"})))
+    record("GET /search all uploads", lambda i: check(client.get("/search", params={"ip": ips[i % len(ips)]})))
+    record("GET /reports/summary", lambda i: check(client.get("/reports/summary")))
+
+    def export(fmt):
+        def call(_):
+            with client.stream("GET", "/reports/export", params={"format": fmt}) as r:
+                check(r)
+                for _ in r.iter_bytes():
+                    pass
+        return call
+
+    exports = max(1, min(repeat, 3))
+    record("GET /reports/export csv", export("csv"), exports, 2 * rows)
+    record("GET /reports/export parquet", export("parquet"), exports, 2 * rows)
+    record("GET /reports/export_pdf (render)", lambda i: check(client.get("/reports/export_pdf")), 1)
+    record("GET /reports/export_pdf (cached)", lambda i: check(client.get("/reports/export_pdf")))
+
+    files = [uploaded["plain"], uploaded["stream"], uploaded["resumable"]]
+    record("DELETE /data/delete", lambda i: check(client.delete("/data/delete", params={"file": files[i]})), len(files))
+    return results
+
+
+def format_row(r):
+    peak = "n/a" if r["peak_mb"] is None else f"{r['peak_mb']:.1f}"
+    return (f"{r['rows']:>10,} {r['endpoint']:<34} {r['requests']:>4} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+            f"{r['p99_ms']:>9.1f} {r['throughput']:>12,.1f} {r['unit']:<6} {peak:>8}")
+
+
+HEADER = (f"{'rows':>10} {'endpoint':<34} {'reqs':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'throughput':>12} {'':<6} {'peak MB':>8}")
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR, capture_output=True, text=True)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "") if out.returncode == 0 else None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(r["rows"], r["endpoint"]): r for r in baseline["results"]}
+    print(f"\nagainst {baseline_path} (commit {baseline['meta'].get('commit')}): ratios are new / old")
+    print(f"{'rows':>10} {'endpoint':<34} {'p50':>7} {'p95':>7} {'throughput':>11} {'peak MB':>16}")
+    for r in results:
+        old = before.get((r["rows"], r["endpoint"]))
+        if old is None:
+            continue
+        peak = "n/a" if r["peak_mb"] is None or old["peak_mb"] is None else f"{old['peak_mb']:.1f} -> {r['peak_mb']:.1f}"
+        print(f"{r['rows']:>10,} {r['endpoint']:<34} {r['p50_ms'] / max(old['p50_ms'], 1e-3):>6.2f}x "
+              f"{r['p95_ms'] / max(old['p95_ms'], 1e-3):>6.2f}x {r['throughput'] / max(old['throughput'], 1e-3):>10.2f}x {peak:>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="100k", help="comma-separated upload sizes, e.g. 100k,1M,10M")
+    parser.add_argument("--requests", type=int, default=20, help="requests per read endpoint and size")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="label shares of the synthetic uploads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where generated uploads are kept and reused (default: a temporary directory)")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="results file from an earlier run to compare against")
+    args = parser.parse_args()
+    sizes = [parse_rows(s) for s in args.rows.split(",")]
+
+    scratch = tempfile.TemporaryDirectory(prefix="bench_endpoints_")
+    data_dir = args.data_dir or scratch.name
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {rows: dataset(data_dir, rows, args.mix, args.seed) for rows in sizes}
+
+    # The app reads its uploads directory at import
+    os.environ["UPLOADS_PATH"] = os.path.join(scratch.name, "uploads")
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    results = []
+    with TestClient(app) as client:
+        print(HEADER)
+        for rows in sizes:
+            results.extend(bench_size(client, paths[rows], rows, args.requests))
+    scratch.cleanup()
+
+    meta = {
+        "commit": git_commit(),
+        "when": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "requests": args.requests,
+        "mix": args.mix,
+        "seed": args.seed,
+        "env": {k: os.environ[k] for k in ("INFERENCE_BACKEND", "INFERENCE_POOL", "INFERENCE_WORKERS") if k in os.environ},
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
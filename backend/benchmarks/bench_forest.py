@@ -0,0 +1,61 @@
+"""Rows/second of the flattened forest engine (app/forest.py) against sklearn's predict_proba.
+
+    python benchmarks/bench_forest.py [--model PATH] [--batch-sizes 1,10,100,1000,10000] [--seconds 2]
+
+Run from the backend directory. The model defaults to $OUTPUT_PATH/ipdr_model.pkl, then
+../outputs/ipdr_model.pkl. Inputs are standard-normal rows, which is what the model sees after
+the scaler. Every batch size is also checked for identical probabilities.
+"""
+import os
+import sys
+import time
+import argparse
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from app.forest import FlatForest  # noqa: E402
+
+
+def default_model_path():
+    base = os.getenv("OUTPUT_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "outputs")
+    return os.path.join(base, "ipdr_model.pkl")
+
+
+def rows_per_second(fn, X, seconds):
+    fn(X)  # warm-up (and numba compilation on first use)
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn(X)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls * len(X) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=default_model_path())
+    parser.add_argument("--batch-sizes", default="1,10,100,1000,10000")
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent per engine and batch size")
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    t = time.perf_counter()
+    forest = FlatForest.from_sklearn(model)
+    print(f"{type(model).__name__}: {forest.n_trees} trees, {len(forest.feature)} nodes, depth {forest.depth}; "
+          f"flattened in {1000 * (time.perf_counter() - t):.0f} ms; kernel: {'numba' if forest.compiled else 'numpy'}")
+
+    rng = np.random.default_rng(0)
+    print(f"{'batch':>8} {'sklearn rows/s':>16} {'flat rows/s':>14} {'speedup':>8}  identical")
+    for size in (int(s) for s in args.batch_sizes.split(",")):
+        X = rng.standard_normal((size, model.n_features_in_))
+        identical = np.array_equal(model.predict_proba(X), forest.predict_proba(X))
+        sk = rows_per_second(model.predict_proba, X, args.seconds)
+        flat = rows_per_second(forest.predict_proba, X, args.seconds)
+        print(f"{size:>8} {sk:>16,.0f} {flat:>14,.0f} {flat / sk:>7.1f}x  {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Parse time and memory of the CSV ingest engines (INGEST_ENGINE=pandas|arrow) on synthetic IPDR uploads.
+
+    python benchmarks/bench_ingest.py [--rows 100k,1M] [--extra-columns 80] [--engines pandas,arrow]
+                                      [--modes score,chunks,copy] [--repeat 3] [--data-dir DIR] [--json OUT]
+
+Run from the backend directory (with OUTPUT_PATH set if the model is not in ../outputs). Uploads
+come from gen_ipdr.py (cached in --data-dir); --extra-columns pads them with numeric columns the
+model does not read, as the wide CICIDS exports have. Every measurement runs in a fresh Python
+process with INGEST_ENGINE set, through the same calls the service makes:
+
+    score   whole-file parse of the model's columns, as /predict-file does
+    chunks  the same in PREDICT_CHUNK_SIZE-row chunks, as streamed scoring of a CSV does
+    copy    every column into the upload's Parquet copy, as views and searches need
+
+Per run the suite reports the time, the peak resident set size above the process's size before
+the parse (sampled, Linux only), the peak and resident bytes the engine accounted for
+(ingest.MemoryAccount; pandas does not report a peak) and, for score, the DataFrame kept.
+Times are medians over --repeat runs, memory the largest seen.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+from gen_ipdr import generate, model_features, parse_rows  # noqa: E402
+from bench_endpoints import PeakMemory, git_commit  # noqa: E402
+
+MODES = ("score", "chunks", "copy")
+
+
+def dataset(data_dir, rows, extra, seed):
+    path = os.path.join(data_dir, f"ipdr_{rows}_x{extra}_s{seed}.csv")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        features = model_features() + [f"Extra {i}" for i in range(extra)]
+        generate(path, rows, features=features, seed=seed)
+        print(f"generated {rows:,} rows in {time.perf_counter() - started:.1f} s -> {path}", file=sys.stderr)
+    return path
+
+
+def run_child(mode, path):
+    # One measurement in this (fresh) process; INGEST_ENGINE is set by the parent
+    from app.ingest import MemoryAccount
+    from app.scoring import DEFAULT_CHUNK_SIZE, parse_plan, read_upload_csv
+    from app.uploadtable import UploadTable
+
+    scratch = tempfile.mkdtemp(prefix="bench_ingest_")
+    try:
+        # The Parquet copy is written next to its CSV: give it a CSV of its own
+        csv_path = os.path.join(scratch, "upload.csv")
+        os.symlink(os.path.abspath(path), csv_path)
+        plan = parse_plan(csv_path, model_features())
+        account = MemoryAccount()
+        frame = None
+        started = time.perf_counter()
+        with PeakMemory() as memory:
+            if mode == "score":
+                frame = read_upload_csv(csv_path, plan=plan, account=account)
+            elif mode == "chunks":
+                for _chunk, _ in read_upload_csv(csv_path, chunk_size=DEFAULT_CHUNK_SIZE, plan=plan, account=account):
+                    pass
+            else:
+                UploadTable.convert(csv_path, dtype=plan.id_dtypes, account=account)
+        elapsed = time.perf_counter() - started
+        kept = None if frame is None else int(frame.memory_usage(index=False, deep=True).sum())
+        return {"seconds": elapsed, "rss_peak_mb": memory.peak_mb, "account": account.as_dict(), "frame_bytes": kept}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def measure(engine, mode, path, repeat):
+    runs = []
+    for _ in range(repeat):
+        env = dict(os.environ, INGEST_ENGINE=engine)
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, path],
+                             cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+        if out.returncode != 0:
+            raise RuntimeError(f"{engine} {mode} failed:\n{out.stderr[-2000:]}")
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    def most(values):
+        values = [v for v in values if v is not None]
+        return max(values) if values else None
+    seconds = float(np.median([r["seconds"] for r in runs]))
+    mb = lambda v: None if v is None else round(v / 2 ** 20, 1)  # noqa: E731
+    return {
+        "engine": runs[0]["account"]["engine"],
+        "mode": mode,
+        "seconds": round(seconds, 3),
+        "rows_per_s": round(runs[0]["account"]["rows"] / seconds, 1),
+        "mb_per_s": round(os.path.getsize(path) / 2 ** 20 / seconds, 1),
+        "rss_peak_mb": most(r["rss_peak_mb"] for r in runs),
+        "accounted_peak_mb": mb(most(r["account"]["peak_bytes"] for r in runs)),
+        "resident_mb": mb(most(r["account"]["resident_bytes"] for r in runs)),
+        "frame_mb": mb(most(r["frame_bytes"] for r in runs)),
+    }
+
+
+def fmt(value, spec):
+    return "n/a" if value is None else format(value, spec)
+
+
+HEADER = (f"{'rows':>10} {'cols':>5} {'mode':<7} {'engine':<7} {'seconds':>8} {'rows/s':>12} {'MB/s':>7} "
+          f"{'RSS peak MB':>12} {'acct peak MB':>13} {'resident MB':>12}")
+
+
+def format_row(r):
+    return (f"{r['rows']:>10,} {r['columns']:>5} {r['mode']:<7} {r['engine']:<7} {r['seconds']:>8.3f} {r['rows_per_s']:>12,.0f} "
+            f"{r['mb_per_s']:>7.1f} {fmt(r['rss_peak_mb'], '.1f'):>12} {fmt(r['accounted_peak_mb'], '.1f'):>13} {fmt(r['resident_mb'], '.1f'):>12}")
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        print(json.dumps(run_child(sys.argv[2], sys.argv[3])))
+        return
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="100k,1M", help="comma-separated upload sizes, e.g. 100k,1M")
+    parser.add_argument("--extra-columns", type=int, default=0, help="numeric columns added beside the model's")
+    parser.add_argument("--engines", default="pandas,arrow")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where generated uploads are kept and reused (default: a temporary directory)")
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args()
+    modes = [m for m in args.modes.split(",") if m]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+
+    scratch = tempfile.TemporaryDirectory(prefix="bench_ingest_data_")
+    data_dir = args.data_dir or scratch.name
+    os.makedirs(data_dir, exist_ok=True)
+    results = []
+    print(HEADER)
+    for rows in (parse_rows(s) for s in args.rows.split(",")):
+        path = dataset(data_dir, rows, args.extra_columns, args.seed)
+        with open(path) as f:
+            columns = len(f.readline().split(","))
+        for mode in modes:
+            for engine in args.engines.split(","):
+                result = dict(measure(engine, mode, path, args.repeat), rows=rows, columns=columns)
+                results.append(result)
+                print(format_row(result), flush=True)
+    scratch.cleanup()
+
+    if args.json:
+        meta = {
+            "commit": git_commit(),
+            "when": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+            "extra_columns": args.extra_columns,
+        }
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Start-up time and memory per worker process for each inference backend (app/model.py).
+
+    python benchmarks/bench_model_load.py [--outputs DIR] [--workers 4]
+
+Run from the backend directory. Starts --workers fresh processes at once, as uvicorn --workers
+does, and has each of them load the model and score one batch. Reports each worker's load time,
+its resident memory and its proportional share (PSS, Linux only) while all of them are alive.
+With the flat backend the forest files are prepared first, as fetch_and_start.py does.
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def default_outputs():
+    return os.getenv("OUTPUT_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "outputs")
+
+
+def memory_mb():
+    # (rss, pss) of this process in MB; pss is None where /proc/self/smaps_rollup is missing
+    fields = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] in ("Rss:", "Pss:"):
+                    fields[parts[0]] = int(parts[1]) / 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, None
+    return fields.get("Rss:"), fields.get("Pss:")
+
+
+def worker(outputs, backend, barrier, results):
+    from app.model import ModelWrapper
+    from app.registry import artifact_paths
+    t = time.perf_counter()
+    wrapper = ModelWrapper(**artifact_paths(outputs), backend=backend)
+    loaded = time.perf_counter() - t
+    n_features = len(wrapper.numeric_cols) if wrapper.numeric_cols else wrapper.model.n_features_in_
+    wrapper._predict_proba(np.random.default_rng(0).standard_normal((1000, n_features)))
+    barrier.wait()  # measure while every worker holds its model
+    results.put((loaded,) + memory_mb())
+    barrier.wait()
+
+
+def run(outputs, backend, workers):
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(outputs, backend, barrier, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    load = [r[0] for r in rows]
+    rss = sum(r[1] for r in rows)
+    pss = sum(r[2] for r in rows) if all(r[2] is not None for r in rows) else None
+    print(f"{backend:8s} load {1000 * min(load):7.0f}-{1000 * max(load):.0f} ms   "
+          f"RSS total {rss:8.1f} MB   PSS total {'n/a' if pss is None else f'{pss:8.1f} MB'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--outputs", default=default_outputs())
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    from app.model import prepare_flat_model
+    from app.registry import artifact_paths
+    t = time.perf_counter()
+    print("prepared", prepare_flat_model(artifact_paths(args.outputs)["model_path"]),
+          f"in {1000 * (time.perf_counter() - t):.0f} ms")
+    for backend in ("sklearn", "flat"):
+        run(args.outputs, backend, args.workers)
+
+
+if __name__ == '__main__':
+    main()
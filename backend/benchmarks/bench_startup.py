@@ -0,0 +1,113 @@
+"""Cold-start cost of the API: time to import app.main and time until a fresh server answers.
+
+    python benchmarks/bench_startup.py [--repeat 3] [--top 10] [--max-import-ms MS] [--max-ready-ms MS]
+
+Run from the backend directory (with OUTPUT_PATH set if the model is not in ../outputs). Each
+repeat imports app.main in a new interpreter; the slowest top-level imports of the last run are
+listed from `python -X importtime`. Then uvicorn is started and polled until GET /models answers,
+and the startup phase timings from /system/status are printed. With --max-import-ms or
+--max-ready-ms the script exits with status 1 when the median exceeds the budget, so it can
+guard against import-time regressions in CI.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+
+def import_once():
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1]), out.stderr
+
+
+def slowest_imports(importtime_log, top):
+    # Modules imported directly by app.main (one level of nesting), by cumulative microseconds
+    found = []
+    for line in importtime_log.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        if name.startswith("   ") and not name.startswith("     "):
+            found.append((int(parts[1]), name.strip()))
+    return sorted(found, reverse=True)[:top]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def ready_once(timeout=120):
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                              cwd=BACKEND_DIR)
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with status {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/models", timeout=1) as resp:
+                    resp.read()
+                ready = time.perf_counter() - started
+                break
+            except OSError:
+                time.sleep(0.02)
+        else:
+            raise RuntimeError("server did not answer in time")
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/system/status", timeout=10) as resp:
+            phases = json.load(resp).get("startup", {})
+        return ready, phases
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="slowest top-level imports to list")
+    parser.add_argument("--max-import-ms", type=float, help="fail when the median import time exceeds this")
+    parser.add_argument("--max-ready-ms", type=float, help="fail when the median time to first response exceeds this")
+    args = parser.parse_args()
+
+    imports = []
+    for _ in range(args.repeat):
+        seconds, log = import_once()
+        imports.append(1000 * seconds)
+    print(f"import app.main: median {statistics.median(imports):.0f} ms (runs: {', '.join(f'{v:.0f}' for v in imports)})")
+    for micros, name in slowest_imports(log, args.top):
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    readies = []
+    for _ in range(args.repeat):
+        seconds, phases = ready_once()
+        readies.append(1000 * seconds)
+    print(f"time to first response: median {statistics.median(readies):.0f} ms (runs: {', '.join(f'{v:.0f}' for v in readies)})")
+    for phase, seconds in phases.items():
+        print(f"  {phase}: {1000 * seconds:.0f} ms")
+
+    failed = False
+    if args.max_import_ms is not None and statistics.median(imports) > args.max_import_ms:
+        print(f"FAIL: import time above {args.max_import_ms:.0f} ms", file=sys.stderr)
+        failed = True
+    if args.max_ready_ms is not None and statistics.median(readies) > args.max_ready_ms:
+        print(f"FAIL: time to first response above {args.max_ready_ms:.0f} ms", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
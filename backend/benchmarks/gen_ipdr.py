@@ -0,0 +1,195 @@
+"""Synthetic IPDR uploads shaped like the CICIDS flows the model was trained on.
+
+    python benchmarks/gen_ipdr.py OUT.csv [--rows 1M] [--mix Benign=0.8,DDoS=0.1,PortScan=0.1]
+                                  [--seed 0] [--hosts N] [--subscribers N] [--hours 24] [--no-label]
+
+Run from the backend directory. Every row has the model's feature columns (read from
+ipdr_features.pkl in $OUTPUT_PATH or ../outputs), the key columns the service looks for (ip,
+msisdn, timestamp, data_volume) and, unless --no-label, the class it was drawn from in a Label
+column. Feature values follow a per-class profile (short, dense floods for DDoS, single-packet
+probes for PortScan, long sessions for Benign), IPs and MSISDNs come from fixed pools with a few
+heavy users, and timestamps increase over --hours. Rows are written in chunks, so 10M-row files
+need no more memory than 100k-row ones; the same seed always gives the same file.
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+DEFAULT_FEATURES = ['Flow Duration', 'Flow IAT Mean', 'Fwd IAT Mean', 'Bwd IAT Mean', 'Speed_Burst']
+
+# label -> (median flow duration in microseconds, its log-spread, median packets, median bytes per packet)
+CLASS_PROFILES = {
+    'Benign': (400_000, 2.0, 14, 600),
+    'Bot': (120_000, 1.0, 8, 300),
+    'DDoS': (1_500, 1.2, 4, 80),
+    'DoS': (5_000_000, 1.5, 10, 200),
+    'Heartbleed': (60_000_000, 0.3, 2_000, 1_400),
+    'Patator': (2_000_000, 0.8, 20, 120),
+    'PortScan': (60, 0.8, 2, 60),
+}
+
+DEFAULT_MIX = "Benign=0.8,DDoS=0.08,DoS=0.04,PortScan=0.05,Bot=0.02,Patator=0.01"
+
+CHUNK_ROWS = 100_000
+
+
+def default_outputs():
+    return os.getenv("OUTPUT_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "outputs")
+
+
+def model_features(outputs=None):
+    """Feature columns the model scores, falling back to the shipped model's list."""
+    path = os.path.join(outputs or default_outputs(), "ipdr_features.pkl")
+    if os.path.exists(path):
+        import joblib
+        return list(joblib.load(path))
+    return list(DEFAULT_FEATURES)
+
+
+def parse_rows(text):
+    """'250000', '100k', '1M' or '1.5m' as a row count."""
+    text = str(text).strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def parse_mix(text):
+    """'Benign=0.8,DDoS=0.2' as {label: share}, normalised to sum to 1."""
+    mix = {}
+    for part in text.split(","):
+        label, _, share = part.partition("=")
+        label = label.strip()
+        if label not in CLASS_PROFILES:
+            raise ValueError(f"unknown label {label!r}; expected one of {', '.join(CLASS_PROFILES)}")
+        mix[label] = float(share)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("label shares must add up to more than 0")
+    return {label: share / total for label, share in mix.items()}
+
+
+def _pools(rng, hosts, subscribers):
+    ips = np.array([f"10.{a}.{b}.{c}" for a, b, c in rng.integers(0, 256, size=(hosts, 3))], dtype=object)
+    msisdns = np.array([f"91{n:010d}" for n in rng.integers(6_000_000_000, 9_999_999_999, size=subscribers)], dtype=object)
+    # Zipf-like weights: a handful of hosts and subscribers carry most of the traffic
+    return ips, _zipf(hosts), msisdns, _zipf(subscribers)
+
+
+def _zipf(n, s=1.1):
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+
+def _features(rng, labels, names):
+    n = len(labels)
+    duration = np.empty(n)
+    packets = np.empty(n)
+    packet_bytes = np.empty(n)
+    for label, (median, spread, median_packets, median_bytes) in CLASS_PROFILES.items():
+        mask = labels == label
+        k = int(mask.sum())
+        if not k:
+            continue
+        duration[mask] = rng.lognormal(np.log(median), spread, k)
+        packets[mask] = np.maximum(1, np.round(rng.lognormal(np.log(median_packets), 0.5, k)))
+        packet_bytes[mask] = rng.lognormal(np.log(median_bytes), 0.3, k)
+    fwd = np.maximum(1, np.round(packets * rng.uniform(0.5, 1.0, n)))
+    bwd = packets - fwd
+    volume = np.round(packets * packet_bytes)
+    known = {
+        'Flow Duration': np.round(duration),
+        'Flow IAT Mean': duration / np.maximum(packets - 1, 1),
+        'Fwd IAT Mean': duration / np.maximum(fwd - 1, 1),
+        'Bwd IAT Mean': np.where(bwd > 1, duration / np.maximum(bwd - 1, 1), 0.0),
+        'Speed_Burst': volume / np.maximum(duration / 1e6, 1e-6),
+    }
+    # Feature names this profile does not know get a generic positive value per class
+    scale = {label: i + 1 for i, label in enumerate(CLASS_PROFILES)}
+    shift = np.log(np.vectorize(scale.get)(labels).astype(float))
+    columns = {name: known[name] if name in known else rng.lognormal(shift, 1.0) for name in names}
+    return columns, volume
+
+
+def iter_chunks(rows, mix=None, features=None, seed=0, hosts=None, subscribers=None, hours=24.0,
+                label=True, chunk_rows=CHUNK_ROWS):
+    """Arrow tables of at most `chunk_rows` synthetic rows, `rows` in total."""
+    rng = np.random.default_rng(seed)
+    mix = mix or parse_mix(DEFAULT_MIX)
+    names = features or model_features()
+    hosts = hosts or max(16, min(rows // 50, 200_000))
+    subscribers = subscribers or max(16, min(rows // 20, 500_000))
+    ips, ip_weights, msisdns, msisdn_weights = _pools(rng, hosts, subscribers)
+    # Attacks come from a small set of hosts, as in the CICIDS captures
+    attackers = ips[rng.choice(hosts, size=max(1, hosts // 100), replace=False)]
+    classes = np.array(list(mix), dtype=object)
+    shares = np.array(list(mix.values()))
+
+    start = np.datetime64("2025-11-16T00:00:00", "ms")
+    step_ms = hours * 3_600_000 / max(rows, 1)
+    clock = 0.0
+    done = 0
+    while done < rows:
+        n = min(chunk_rows, rows - done)
+        labels = classes[rng.choice(len(classes), size=n, p=shares)]
+        columns, volume = _features(rng, labels, names)
+        ip = ips[rng.choice(hosts, size=n, p=ip_weights)]
+        attack = labels != 'Benign'
+        ip[attack] = attackers[rng.integers(0, len(attackers), int(attack.sum()))]
+        offsets = clock + np.cumsum(rng.exponential(step_ms, n))
+        clock = offsets[-1]
+        stamps = np.datetime_as_string(start + offsets.astype("timedelta64[ms]"), unit="s")
+
+        data = dict(columns)
+        data['ip'] = ip
+        data['msisdn'] = msisdns[rng.choice(subscribers, size=n, p=msisdn_weights)]
+        data['timestamp'] = np.char.add(stamps.astype(str), "Z")
+        data['data_volume'] = volume
+        if label:
+            data['Label'] = labels
+        yield pa.table({name: pa.array(values) for name, values in data.items()})
+        done += n
+
+
+def generate(path, rows, **kwargs):
+    """Write `rows` synthetic rows to the CSV at `path`; keyword arguments as for iter_chunks."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    # Plain unquoted CSV, as exported by the probes; Arrow would quote the header
+    options = pacsv.WriteOptions(include_header=False, quoting_style="none")
+    writer = None
+    with open(tmp, "wb") as f:
+        try:
+            for table in iter_chunks(rows, **kwargs):
+                if writer is None:
+                    f.write((",".join(table.column_names) + "\n").encode("utf-8"))
+                    writer = pacsv.CSVWriter(f, table.schema, write_options=options)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    os.replace(tmp, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("out")
+    parser.add_argument("--rows", type=parse_rows, default=parse_rows("100k"), help="row count; accepts 100k, 1M")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="label shares, e.g. Benign=0.9,DDoS=0.1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hosts", type=int, help="distinct IPs (default rows/50)")
+    parser.add_argument("--subscribers", type=int, help="distinct MSISDNs (default rows/20)")
+    parser.add_argument("--hours", type=float, default=24.0, help="time span covered by the timestamps")
+    parser.add_argument("--no-label", dest="label", action="store_false", help="leave out the Label column")
+    parser.add_argument("--outputs", default=default_outputs(), help="directory holding ipdr_features.pkl")
+    args = parser.parse_args()
+
+    generate(args.out, args.rows, mix=args.mix, features=model_features(args.outputs), seed=args.seed,
+             hosts=args.hosts, subscribers=args.subscribers, hours=args.hours, label=args.label)
+    print(f"wrote {args.rows:,} rows to {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 import os
 import sys
 import zipfile
+import subprocess
 from pathlib import Path
 
 def outputs_nonempty(dest):
@@ -38,10 +39,27 @@ def download_and_extract(file_id, dest_dir):
         pass
     return True
 
+def activate_version(dest, version):
+    # Point the model registry (app/registry.py) at this version; running workers follow it
+    pointer = os.path.join(dest, "models", "ACTIVE")
+    with open(pointer + ".tmp", "w") as f:
+        f.write(version + "\n")
+    os.replace(pointer + ".tmp", pointer)
+
 def main():
     dest = "/app/outputs"
     file_id = os.environ.get("MODEL_DRIVE_FILE_ID")
-    if outputs_nonempty(dest):
+    version = os.environ.get("MODEL_VERSION")
+    if version:
+        # Versioned rollout: the artifacts go to outputs/models/<version>/ next to earlier versions
+        version_dir = os.path.join(dest, "models", version)
+        if outputs_nonempty(version_dir):
+            print(f"Model version {version} already present, skipping download.")
+        elif not file_id or not download_and_extract(file_id, version_dir):
+            print(f"Failed to fetch model version {version}", file=sys.stderr)
+            sys.exit(1)
+        activate_version(dest, version)
+    elif outputs_nonempty(dest):
         print("Outputs directory already present and non-empty, skipping download.")
     elif file_id:
         ok = download_and_extract(file_id, dest)
@@ -50,6 +68,11 @@ def main():
             sys.exit(1)
     else:
         print("No MODEL_DRIVE_FILE_ID provided and outputs/ missing; continuing without models.")
+    if os.environ.get("INFERENCE_BACKEND") == "flat":
+        # Flatten the model once up front; each uvicorn worker (WEB_CONCURRENCY) then memory-maps
+        # the same files instead of loading and holding its own copy of the forest
+        subprocess.run([sys.executable, "-m", "app.registry", "prepare", dest],
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
     port = os.environ.get("PORT", "8000")
     os.execvp("uvicorn", ["uvicorn", "app.main:app", "--host", "0.0.0.0", "--port", port])
 
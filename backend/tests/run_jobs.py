@@ -0,0 +1,49 @@
+import urllib.request, urllib.parse, json, sys, os, time
+
+BASE = os.environ.get('BASE_URL', 'http://127.0.0.1:8000')
+
+csv_text = "ip,timestamp,msisdn,data_volume\n" + "".join(
+    f"192.0.2.{i % 250},2025-11-16T12:00:{i % 60:02d}Z,+1000000{i:03d},{1000 + i}\n" for i in range(500))
+
+boundary = '----IpdrJobBoundary'
+body = '\r\n'.join([
+    f'--{boundary}',
+    'Content-Disposition: form-data; name="file"; filename="job.csv"',
+    'Content-Type: text/csv',
+    '',
+    csv_text,
+    f'--{boundary}--',
+]).encode('utf-8')
+
+req = urllib.request.Request(BASE + '/jobs/predict-file?chunk_size=100', data=body)
+req.add_header('Content-Type', f'multipart/form-data; boundary={boundary}')
+try:
+    with urllib.request.urlopen(req, timeout=20) as r:
+        job = json.loads(r.read().decode('utf-8'))
+except Exception as e:
+    print('Job submission failed:', e)
+    sys.exit(2)
+
+print('Submitted job:', job)
+job_id = job['job_id']
+
+deadline = time.time() + 60
+while time.time() < deadline:
+    with urllib.request.urlopen(f'{BASE}/jobs/{job_id}', timeout=10) as r:
+        job = json.loads(r.read().decode('utf-8'))
+    print('status:', job['status'], job['rows_scored'], '/', job['total_rows'])
+    if job['status'] in ('done', 'failed'):
+        break
+    time.sleep(0.5)
+
+if job['status'] != 'done':
+    print('Job did not finish:', job)
+    sys.exit(2)
+
+with urllib.request.urlopen(f'{BASE}/ml/results?file={urllib.parse.quote(job["file"])}&page_size=5', timeout=10) as r:
+    res = json.loads(r.read().decode('utf-8'))
+if res.get('n') != 500:
+    print('Unexpected prediction count:', res.get('n'))
+    sys.exit(2)
+
+print('Job test succeeded:', res['n'], 'predictions stored for', job['file'])
@@ -40,6 +40,28 @@ def run():
     else:
         print('No uploads found; skip /ml/results')
 
+    # Every export format streams back a non-empty body (the CSV has at least its header)
+    for fmt in ('csv', 'ndjson', 'parquet', 'arrow'):
+        for gz in ('false', 'true'):
+            try:
+                with urllib.request.urlopen(f'{BASE}/reports/export?format={fmt}&gzip={gz}', timeout=60) as r:
+                    code, size = r.getcode(), len(r.read())
+            except Exception as e:
+                code, size = None, str(e)
+            print(f'GET /reports/export format={fmt} gzip={gz} ->', code, size)
+            if code != 200:
+                ok = False
+
+    # Prometheus metrics cover the requests made above, and responses carry their stage timings
+    try:
+        with urllib.request.urlopen(BASE + '/metrics', timeout=10) as r:
+            code, text, timing = r.getcode(), r.read().decode('utf-8'), r.headers.get('Server-Timing')
+    except Exception as e:
+        code, text, timing = None, str(e), None
+    print('GET /metrics ->', code, 'Server-Timing:', timing)
+    if code != 200 or 'ipdr_http_requests_total{' not in text or not timing:
+        ok = False
+
     if not ok:
         sys.exit(2)
 
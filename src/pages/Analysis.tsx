@@ -1,6 +1,6 @@
 import { DashboardLayout } from "@/components/Layout/DashboardLayout";
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card";
-import { BarChart3, TrendingUp, AlertTriangle, RotateCw } from "lucide-react";
+import { BarChart3, TrendingUp, AlertTriangle, RotateCw, Users, Globe } from "lucide-react";
 import { useState, useEffect } from "react";
 import { toast } from "sonner";
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from "recharts";
@@ -11,8 +11,51 @@ interface ReportSummary {
   by_label: Record<string, number>;
 }
 
+interface BehaviourProfile {
+  key: string;
+  sessions: number;
+  flagged: number;
+  flagged_ratio: number;
+  last_seen: string | null;
+}
+
+const TopFlagged = ({ title, description, icon: Icon, profiles }: {
+  title: string;
+  description: string;
+  icon: typeof Users;
+  profiles: BehaviourProfile[];
+}) => (
+  <Card className="border-border/50 bg-gradient-to-br from-card to-card/50 backdrop-blur-sm">
+    <CardHeader>
+      <CardTitle className="flex items-center gap-2 text-foreground">
+        <Icon className="h-5 w-5 text-primary" />
+        {title}
+      </CardTitle>
+      <CardDescription>{description}</CardDescription>
+    </CardHeader>
+    <CardContent>
+      {profiles.length === 0 ? (
+        <p className="text-sm text-muted-foreground">No data available</p>
+      ) : (
+        <div className="space-y-2">
+          {profiles.map((p) => (
+            <div key={p.key} className="flex items-center justify-between p-2 bg-muted/30 rounded-lg">
+              <span className="font-mono text-sm text-foreground">{p.key}</span>
+              <span className="text-sm text-muted-foreground">
+                <span className="font-bold text-destructive">{p.flagged}</span> / {p.sessions} sessions ({(p.flagged_ratio * 100).toFixed(1)}%)
+              </span>
+            </div>
+          ))}
+        </div>
+      )}
+    </CardContent>
+  </Card>
+);
+
 const Analysis = () => {
   const [reportData, setReportData] = useState<ReportSummary | null>(null);
+  const [topSubscribers, setTopSubscribers] = useState<BehaviourProfile[]>([]);
+  const [topIps, setTopIps] = useState<BehaviourProfile[]>([]);
   const [loading, setLoading] = useState(true);
   const [isRefreshing, setIsRefreshing] = useState(false);
 
@@ -23,6 +66,12 @@ const Analysis = () => {
       if (!res.ok) throw new Error('Failed to fetch reports');
       const data = await res.json();
       setReportData(data);
+      const [subscribers, ips] = await Promise.all(['msisdn', 'ip'].map(async (kind) => {
+        const r = await fetch(`${apiUrl}/analysis/${kind}?sort=flagged&page_size=10`);
+        return r.ok ? (await r.json()).profiles : [];
+      }));
+      setTopSubscribers(subscribers);
+      setTopIps(ips);
     } catch (error) {
       console.error(error);
       toast.error('Failed to load analysis data');
@@ -178,6 +227,19 @@ const Analysis = () => {
               </div>
             </CardContent>
           </Card>
+
+          <TopFlagged
+            title="Top Flagged Subscribers"
+            description="MSISDNs with the most non-benign sessions"
+            icon={Users}
+            profiles={topSubscribers}
+          />
+          <TopFlagged
+            title="Top Flagged IPs"
+            description="IP addresses with the most non-benign sessions"
+            icon={Globe}
+            profiles={topIps}
+          />
         </div>
       </div>
     </DashboardLayout>
@@ -12,8 +12,8 @@ const Dashboard = () => {
   const apiUrl = import.meta.env.VITE_API_URL || "http://localhost:8000";
 
   const formatTimeAgo = (filename: string): string => {
-    // Extract timestamp from filename (e.g., "upload_1763446518.csv")
-    const match = filename.match(/_(\d+)\./);
+    // Extract timestamp from filename (e.g., "upload_1763446518_3f9c2a1b.csv")
+    const match = filename.match(/^upload_(\d+)/);
     if (!match) return "Unknown time";
     
     const timestamp = parseInt(match[1]) * 1000;
@@ -6,6 +6,7 @@ import { Label } from "@/components/ui/label";
 import { Button } from "@/components/ui/button";
 import { Search, Filter, Calendar } from "lucide-react";
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from "@/components/ui/table";
+import { toast } from "sonner";
 
 const SearchFilter = () => {
   const [searchResults, setSearchResults] = useState<any[]>([]);
@@ -16,8 +17,9 @@ const SearchFilter = () => {
   const handleSearch = async (e: React.FormEvent<HTMLFormElement>) => {
     e.preventDefault();
     const formData = new FormData(e.currentTarget as HTMLFormElement);
-    const ip = (formData.get('ip') || '').toString();
-    const msisdn = (formData.get('msisdn') || '').toString();
+    const ip = (formData.get('ip') || '').toString().trim();
+    // MSISDNs are stored as digits only: drop a leading '+' and any spaces or dashes
+    const msisdn = (formData.get('msisdn') || '').toString().trim().replace(/^\+/, '').replace(/[\s-]/g, '');
     const date_from = (formData.get('date-from') || '').toString();
     const date_to = (formData.get('date-to') || '').toString();
     const min_volume = formData.get('min-volume')?.toString() || '';
@@ -36,6 +38,9 @@ const SearchFilter = () => {
       if (res.ok) {
         const data = await res.json();
         setSearchResults(data.rows || []);
+      } else {
+        const data = await res.json().catch(() => ({}));
+        toast.error(data.detail || 'Search failed');
       }
     } catch (e) {
       console.error(e);
@@ -70,6 +75,7 @@ const SearchFilter = () => {
                     placeholder="192.168.1.100"
                     className="border-border/50 bg-input"
                   />
+                  <p className="text-xs text-muted-foreground">Exact address, prefix with * (192.168.*) or CIDR block (192.168.1.0/24)</p>
                 </div>
 
                 <div className="space-y-2">
@@ -77,9 +83,10 @@ const SearchFilter = () => {
                   <Input
                     id="msisdn"
                     name="msisdn"
-                    placeholder="+1234567890"
+                    placeholder="919876543210"
                     className="border-border/50 bg-input"
                   />
+                  <p className="text-xs text-muted-foreground">Full number, or the first digits followed by * (91987*)</p>
                 </div>
 
                 <div className="space-y-2">